@@ -1,20 +1,9 @@
 # from langchain_openai import ChatOpenAI
-from langchain.chat_models import init_chat_model
-from langgraph.prebuilt import create_react_agent
 from utils.prompt import SYSTEM_PREFIX
-import yaml
-from dotenv import load_dotenv
-import os
 from pydantic import BaseModel
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain_community.utilities.sql_database import SQLDatabase
-from utils.schema_utils import engine
-
-import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
-from langchain_openai import OpenAIEmbeddings
+from agent import resources
+
+from langchain_core.example_selectors import BaseExampleSelector
 from langchain_core.prompts import (
     ChatPromptTemplate,
     FewShotPromptTemplate,
@@ -33,12 +22,7 @@ class reactAgentConfig(BaseModel):
     handle_parsing_errors: bool = True
     max_iterations: int = 5
 
-# 加载配置
-with open("config.yaml", "r",encoding="utf-8") as f:
-    config = yaml.safe_load(f)
-# 加载环境变量
-load_dotenv()
-# 初始化llm
+# 初始化llm（见 agent/resources.py，首次使用时创建）
 # llm = ChatOpenAI(model=os.getenv("model"), 
 #                  api_key=os.getenv("api_key"), 
 #                  base_url=os.getenv("base_url"), 
@@ -51,10 +35,6 @@ load_dotenv()
 #                       max_tokens=config["max_tokens"], 
 #                       temperature=config["temperature"])
 
-llm = init_chat_model(model=os.getenv("model"), 
-                      api_key=os.getenv("api_key"), 
-                      base_url=os.getenv("base_url"), 
-                      max_tokens=config["max_tokens"])
 # # 初始化数据库
 # db = SQLDatabase(engine)
 # # 初始化工具
@@ -73,10 +53,6 @@ llm = init_chat_model(model=os.getenv("model"),
 # )
 
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large",
-                              base_url=os.getenv("base_url"),
-                              openai_api_key=os.getenv("api_key"))
-
 # embedding_dim = len(embeddings.embed_query("hello world"))
 # index = faiss.IndexFlatL2(embedding_dim)
 
@@ -172,24 +148,22 @@ examples = [
 ]
 
 
-example_selector = SemanticSimilarityExampleSelector.from_examples(
-    examples,
-    embeddings,
-    FAISS,
-    k=2,
-    input_keys=["input"],
-)
+def _build_example_selector() -> BaseExampleSelector:
+    # 配置了 few_shot.source 时从问答对文件挖掘示例，否则使用上面的手写示例
+    return (resources.mined_example_selector(k=2)
+            or resources.example_selector(examples, k=2))
 
 
-few_shot_prompt = FewShotPromptTemplate(
-    example_selector=example_selector,
-    example_prompt=PromptTemplate.from_template(
-        "User input: {input}\nSQL query: {query}"
-    ),
-    input_variables=["input", "dialect", "top_k"],
-    prefix=SYSTEM_PREFIX,
-    suffix="User input: {input}\nSQL query: ",
-)
+def _build_few_shot_prompt() -> FewShotPromptTemplate:
+    return FewShotPromptTemplate(
+        example_selector=resources.get("agent.example_selector"),
+        example_prompt=PromptTemplate.from_template(
+            "User input: {input}\nSQL query: {query}"
+        ),
+        input_variables=["input", "dialect", "top_k"],
+        prefix=SYSTEM_PREFIX,
+        suffix="User input: {input}\nSQL query: ",
+    )
 
 # few_shot_prompt = FewShotPromptTemplate(
 #     examples=examples,
@@ -201,13 +175,28 @@ few_shot_prompt = FewShotPromptTemplate(
 #     suffix="User input: {input}\nSQL query: ",
 # )
 
-full_prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate(prompt=few_shot_prompt),
-        ("human", "{input}"),
-        MessagesPlaceholder("messages"),
-    ]
-)
+def _build_full_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate(prompt=resources.get("agent.few_shot_prompt")),
+            ("human", "{input}"),
+            MessagesPlaceholder("messages"),
+        ]
+    )
+
+
+resources.register("agent.example_selector", _build_example_selector)
+resources.register("agent.few_shot_prompt", _build_few_shot_prompt)
+resources.register("agent.full_prompt", _build_full_prompt)
+
+# 兼容旧的模块属性（如 from agent.agent import llm），访问时才创建
+__getattr__ = resources.module_getattr(__name__, {
+    "llm": "llm",
+    "embeddings": "embeddings",
+    "example_selector": "agent.example_selector",
+    "few_shot_prompt": "agent.few_shot_prompt",
+    "full_prompt": "agent.full_prompt",
+})
 
 # prompt_val = full_prompt.invoke(
 #     {
@@ -227,6 +216,11 @@ full_prompt = ChatPromptTemplate.from_messages(
 # )
 
 def create_react_agent_graph(db_name: str) -> Runnable:
+    from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from langgraph.prebuilt import create_react_agent
+
+    llm = resources.get("llm")
     # 根据db_name获取数据库
     db = SQLDatabase.from_uri(f"sqlite:///test_database/{db_name}/{db_name}.sqlite")
     # 初始化工具
@@ -235,7 +229,7 @@ def create_react_agent_graph(db_name: str) -> Runnable:
     return create_react_agent(
         model=llm,
         tools=toolkit.get_tools(),
-        prompt=full_prompt,
+        prompt=resources.get("agent.full_prompt"),
         state_schema=AgentState,
         config_schema=reactAgentConfig
     )
\ No newline at end of file
@@ -1,20 +1,8 @@
 # from langchain_openai import ChatOpenAI
-from langchain.chat_models import init_chat_model
-from langgraph.prebuilt import create_react_agent
 from utils.prompt import SYSTEM_PREFIX
-import yaml
-from dotenv import load_dotenv
-import os
 from pydantic import BaseModel
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain_community.utilities.sql_database import SQLDatabase
-from utils.schema_utils import engine
-from langchain import hub
-import faiss
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
-from langchain_openai import OpenAIEmbeddings
+from agent import resources
+from langchain_core.example_selectors import BaseExampleSelector
 from langchain_core.prompts import (
     ChatPromptTemplate,
     FewShotPromptTemplate,
@@ -31,12 +19,7 @@ class reactAgentConfig(BaseModel):
     handle_parsing_errors: bool = True
     max_iterations: int = 5
 
-# 加载配置
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-# 加载环境变量
-load_dotenv()
-# 初始化llm
+# 初始化llm（见 agent/resources.py，首次使用时创建）
 # llm = ChatOpenAI(model=os.getenv("model"), 
 #                  api_key=os.getenv("api_key"), 
 #                  base_url=os.getenv("base_url"), 
@@ -49,14 +32,15 @@ load_dotenv()
 #                       max_tokens=config["max_tokens"], 
 #                       temperature=config["temperature"])
 
-llm = init_chat_model(model=os.getenv("model"), 
-                      api_key=os.getenv("api_key"), 
-                      base_url=os.getenv("base_url"), 
-                      max_tokens=config["max_tokens"])
-# 初始化数据库
-db = SQLDatabase(engine)
-# 初始化工具
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+def _build_toolkit():
+    from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from utils.schema_utils import engine
+
+    # 初始化数据库
+    db = SQLDatabase(engine)
+    # 初始化工具
+    return SQLDatabaseToolkit(db=db, llm=resources.get("llm"))
 # 初始化系统提示
 # prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
 # assert len(prompt_template.messages) == 1
@@ -71,9 +55,6 @@ toolkit = SQLDatabaseToolkit(db=db, llm=llm)
 # )
 
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large",
-                              openai_api_key=os.getenv("api_key"))
-
 # embedding_dim = len(embeddings.embed_query("hello world"))
 # index = faiss.IndexFlatL2(embedding_dim)
 
@@ -91,32 +72,30 @@ examples = [{"input": "What is the average number of citations received by publi
            {"input": "What is the ratio of publications to authors in the database?", "query": "SELECT CAST(COUNT(DISTINCT publication.pid) AS FLOAT) / NULLIF(COUNT(DISTINCT author.aid), 0) AS publication_to_author_ratio FROM publication, author;"},
            {"input": "Which author had the most publications in the year 2021 and how many publications did he/she have that year?", "query": "SELECT author.name, author.aid, COUNT(publication.pid) AS publication_count FROM writes JOIN author ON writes.aid = author.aid JOIN publication ON writes.pid = publication.pid WHERE publication.year = 2021 GROUP BY author.name, author.aid ORDER BY publication_count DESC NULLS LAST LIMIT 1;"},
            ]
-example_selector = SemanticSimilarityExampleSelector.from_examples(
-    examples,
-    embeddings,
-    FAISS,
-    k=5,
-    input_keys=["input"],
-)
+def _build_example_selector() -> BaseExampleSelector:
+    return resources.example_selector(examples, k=5)
 
 
-few_shot_prompt = FewShotPromptTemplate(
-    example_selector=example_selector,
-    example_prompt=PromptTemplate.from_template(
-        "User input: {input}\nSQL query: {query}"
-    ),
-    input_variables=["input", "dialect", "top_k"],
-    prefix=SYSTEM_PREFIX,
-    suffix="User input: {input}\nSQL query: ",
-)
+def _build_few_shot_prompt() -> FewShotPromptTemplate:
+    return FewShotPromptTemplate(
+        example_selector=resources.get("curation.example_selector"),
+        example_prompt=PromptTemplate.from_template(
+            "User input: {input}\nSQL query: {query}"
+        ),
+        input_variables=["input", "dialect", "top_k"],
+        prefix=SYSTEM_PREFIX,
+        suffix="User input: {input}\nSQL query: ",
+    )
 
-full_prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate(prompt=few_shot_prompt),
-        ("human", "{input}"),
-        MessagesPlaceholder("messages"),
-    ]
-)
+
+def _build_full_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate(prompt=resources.get("curation.few_shot_prompt")),
+            ("human", "{input}"),
+            MessagesPlaceholder("messages"),
+        ]
+    )
 
 # prompt_val = full_prompt.invoke(
 #     {
@@ -127,10 +106,31 @@ full_prompt = ChatPromptTemplate.from_messages(
 #     }   
 # )
 
-react_agent_graph = create_react_agent(
-    model=llm,
-    tools=toolkit.get_tools(),
-    prompt=full_prompt,
-    state_schema=AgentState,
-    config_schema=reactAgentConfig
-)
\ No newline at end of file
+def _build_react_agent_graph():
+    from langgraph.prebuilt import create_react_agent
+
+    return create_react_agent(
+        model=resources.get("llm"),
+        tools=resources.get("curation.toolkit").get_tools(),
+        prompt=resources.get("curation.full_prompt"),
+        state_schema=AgentState,
+        config_schema=reactAgentConfig
+    )
+
+
+resources.register("curation.toolkit", _build_toolkit)
+resources.register("curation.example_selector", _build_example_selector)
+resources.register("curation.few_shot_prompt", _build_few_shot_prompt)
+resources.register("curation.full_prompt", _build_full_prompt)
+resources.register("curation.react_agent_graph", _build_react_agent_graph)
+
+# 兼容旧的模块属性（如 from agent.agent_curation import react_agent_graph），访问时才创建
+__getattr__ = resources.module_getattr(__name__, {
+    "llm": "llm",
+    "embeddings": "embeddings",
+    "toolkit": "curation.toolkit",
+    "example_selector": "curation.example_selector",
+    "few_shot_prompt": "curation.few_shot_prompt",
+    "full_prompt": "curation.full_prompt",
+    "react_agent_graph": "curation.react_agent_graph",
+})
\ No newline at end of file
@@ -1,25 +1,103 @@
-from langchain_core.runnables import Runnable 
+from langchain_core.runnables import Runnable
+from dotenv import load_dotenv
+from typing import Dict, Hashable, Optional, Tuple
 import logging
+import os
+import threading
+import yaml
+
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+
+
+def _load_agent_cache_size(config_path: str = "config.yaml") -> int:
+    """读取 config.yaml 的 agent_cache_size（缺省为 32）"""
+    if not os.path.exists(config_path):
+        return 32
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    return config.get("agent_cache_size", 32)
+
+
+# 编译好的 Agent 图缓存：(数据库, 模式, 模型) -> Runnable
+# 命中时不再重复 SQLDatabase.from_uri（表反射）、SQLDatabaseToolkit 与 create_react_agent
+_agent_cache = LRUCache(maxsize=_load_agent_cache_size())
+_build_locks: Dict[Hashable, threading.Lock] = {}   # 只包含正在构建的键
+_build_locks_guard = threading.Lock()
+
+
+def _agent_key(db_name: str, use_graphrag: bool) -> Tuple[str, str, Optional[str]]:
+    return (db_name, "graphrag" if use_graphrag else "standard", os.getenv("model"))
+
 
 def create_agent(db_name: str, use_graphrag: bool = False) -> Runnable:
     """
     统一的 Agent 创建入口
-    
+
+    同一 (数据库, 模式, 模型) 的 Agent 图只构建一次并跨调用复用，超出 agent_cache_size 时按 LRU 淘汰
+
     Args:
         db_name: 数据库名称
         use_graphrag: 是否使用 GraphRAG 增强（默认 False）
-    
+
     Returns:
         创建好的 ReAct Agent
     """
-    if use_graphrag:
-        logger.info(f" 创建 GraphRAG 增强模式 Agent (数据库: {db_name})")
-        from agent.agent_graphrag import create_graphrag_agent
-        return create_graphrag_agent(db_name)
-    else:
-        logger.info(f" 创建标准模式 Agent (数据库: {db_name})")
-        from agent.agent import create_react_agent_graph
-        return create_react_agent_graph(db_name)
\ No newline at end of file
+    key = _agent_key(db_name, use_graphrag)
+    agent = _agent_cache.get(key)
+    if agent is not None:
+        return agent
+
+    # 按键加锁：同一数据库的并发请求只构建一次，不同数据库互不阻塞
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            agent = _agent_cache.get(key)
+            if agent is not None:
+                return agent
+
+            if use_graphrag:
+                logger.info(f" 创建 GraphRAG 增强模式 Agent (数据库: {db_name})")
+                from agent.agent_graphrag import create_graphrag_agent
+                agent = create_graphrag_agent(db_name)
+            else:
+                logger.info(f" 创建标准模式 Agent (数据库: {db_name})")
+                from agent.agent import create_react_agent_graph
+                agent = create_react_agent_graph(db_name)
+
+            for evicted_key, _ in _agent_cache.put(key, agent):
+                logger.info(f"[淘汰] 释放 Agent: {evicted_key}")
+        return agent
+    finally:
+        # 锁只在构建期间保留：之后的请求直接命中缓存，被淘汰或失效的键不会留下锁
+        with _build_locks_guard:
+            if _build_locks.get(key) is lock:
+                del _build_locks[key]
+
+
+def invalidate_agent(db_name: Optional[str] = None, use_graphrag: Optional[bool] = None) -> int:
+    """
+    使缓存的 Agent 失效（如数据库 Schema 变更后），下次 create_agent 时重新构建
+
+    Args:
+        db_name: 数据库名称，None 表示全部数据库
+        use_graphrag: 只失效指定模式，None 表示两种模式
+
+    Returns:
+        失效的 Agent 数量
+    """
+    mode = None if use_graphrag is None else ("graphrag" if use_graphrag else "standard")
+    dropped = _agent_cache.pop_where(
+        lambda key: (db_name is None or key[0] == db_name) and (mode is None or key[1] == mode)
+    )
+    logger.info(f"[失效] 清除 {dropped} 个缓存的 Agent (数据库: {db_name or '全部'})")
+    return dropped
+
+
+def agent_cache_stats() -> Dict:
+    """Agent 缓存的命中/未命中/淘汰统计"""
+    return _agent_cache.stats()
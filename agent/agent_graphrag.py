@@ -2,18 +2,10 @@
 GraphRAG 增强的 Agent 模块
 使用图检索技术智能选择相关的 Schema
 """
-from langchain.chat_models import init_chat_model
-from langgraph.prebuilt import create_react_agent
 from utils.prompt import SYSTEM_PREFIX
-import yaml
-from dotenv import load_dotenv
-import os
 from pydantic import BaseModel
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
+from agent import resources
+from langchain_core.example_selectors import BaseExampleSelector
 from langchain_core.prompts import (
     ChatPromptTemplate,
     FewShotPromptTemplate,
@@ -35,26 +27,7 @@ class reactAgentConfig(BaseModel):
     handle_parsing_errors: bool = True
     max_iterations: int = 5
 
-# 加载配置
-with open("config.yaml", "r", encoding="utf-8") as f:
-    config = yaml.safe_load(f)
-
-load_dotenv()
-
-# 初始化 LLM
-llm = init_chat_model(
-    model=os.getenv("model"), 
-    api_key=os.getenv("api_key"), 
-    base_url=os.getenv("base_url"), 
-    max_tokens=config["max_tokens"]
-)
-
-# 初始化 Embeddings
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-large",
-    base_url=os.getenv("base_url"),
-    openai_api_key=os.getenv("api_key")
-)
+# LLM 与 Embeddings 见 agent/resources.py，首次创建 Agent 时才初始化
 
 # Few-shot Examples（与主分支保持一致）
 examples = [
@@ -81,33 +54,48 @@ examples = [
 ]
 
 # 语义相似度 Example Selector
-example_selector = SemanticSimilarityExampleSelector.from_examples(
-    examples,
-    embeddings,
-    FAISS,
-    k=1,
-    input_keys=["input"],
-)
+def _build_example_selector() -> BaseExampleSelector:
+    # 配置了 few_shot.source 时从问答对文件挖掘示例，否则使用上面的手写示例
+    return (resources.mined_example_selector(k=1)
+            or resources.example_selector(examples, k=1))
+
 
 # Few-shot Prompt
-few_shot_prompt = FewShotPromptTemplate(
-    example_selector=example_selector,
-    example_prompt=PromptTemplate.from_template(
-        "User input: {input}\nSQL query: {query}"
-    ),
-    input_variables=["input", "dialect", "top_k"],
-    prefix=SYSTEM_PREFIX,
-    suffix="User input: {input}\nSQL query: ",
-)
+def _build_few_shot_prompt() -> FewShotPromptTemplate:
+    return FewShotPromptTemplate(
+        example_selector=resources.get("graphrag.example_selector"),
+        example_prompt=PromptTemplate.from_template(
+            "User input: {input}\nSQL query: {query}"
+        ),
+        input_variables=["input", "dialect", "top_k"],
+        prefix=SYSTEM_PREFIX,
+        suffix="User input: {input}\nSQL query: ",
+    )
+
 
 # 完整 Prompt
-full_prompt = ChatPromptTemplate.from_messages(
-    [
-        SystemMessagePromptTemplate(prompt=few_shot_prompt),
-        ("human", "{input}"),
-        MessagesPlaceholder("messages"),
-    ]
-)
+def _build_full_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages(
+        [
+            SystemMessagePromptTemplate(prompt=resources.get("graphrag.few_shot_prompt")),
+            ("human", "{input}"),
+            MessagesPlaceholder("messages"),
+        ]
+    )
+
+
+resources.register("graphrag.example_selector", _build_example_selector)
+resources.register("graphrag.few_shot_prompt", _build_few_shot_prompt)
+resources.register("graphrag.full_prompt", _build_full_prompt)
+
+# 兼容旧的模块属性（如 from agent.agent_graphrag import llm），访问时才创建
+__getattr__ = resources.module_getattr(__name__, {
+    "llm": "llm",
+    "embeddings": "embeddings",
+    "example_selector": "graphrag.example_selector",
+    "few_shot_prompt": "graphrag.few_shot_prompt",
+    "full_prompt": "graphrag.full_prompt",
+})
 
 
 def create_graphrag_agent(db_name: str) -> Runnable:
@@ -115,7 +103,12 @@ def create_graphrag_agent(db_name: str) -> Runnable:
     创建使用 GraphRAG 增强的 ReAct Agent
     
     """
+    from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+    from langchain_community.utilities.sql_database import SQLDatabase
+    from langgraph.prebuilt import create_react_agent
+    
     logger.info(f"初始化 GraphRAG Agent (数据库: {db_name})")
+    llm = resources.get("llm")
     
     # 创建数据库连接
     db = SQLDatabase.from_uri(f"sqlite:///test_database/{db_name}/{db_name}.sqlite")
@@ -127,7 +120,7 @@ def create_graphrag_agent(db_name: str) -> Runnable:
     agent = create_react_agent(
         model=llm,
         tools=toolkit.get_tools(),
-        prompt=full_prompt,
+        prompt=resources.get("graphrag.full_prompt"),
         state_schema=AgentState,
         config_schema=reactAgentConfig
     )
@@ -0,0 +1,216 @@
+"""
+Agent 共享资源注册表
+LLM、Embeddings、Few-shot 示例选择器、Prompt 等重量级资源只登记构造函数，首次 get 时才创建：
+- 导入 agent 模块不再调用 init_chat_model、不再为 Few-shot 示例请求 Embedding 接口
+- 每个资源在进程内只创建一次（线程安全，并发的首次访问只构造一次）
+- reset 用于测试或配置变更后重新创建
+Few-shot 示例选择只嵌入问题本身（不含 Schema），问题向量与 GraphRAG 检索共用同一个问题向量缓存
+（embedding_store / question_cache 直接按 config.yaml 获取共享实例，不需要构建检索器或解析 tables.json）。
+手写示例的 FAISS 向量库按 (示例集合, Embedding 模型) 的哈希落盘，重启或多个 worker 启动时直接 load_local；
+配置 few_shot.source 时改用从问答对文件挖掘的示例库（utils/example_store.py）。
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_instances: Dict[str, Any] = {}
+_locks: Dict[str, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def register(name: str, factory: Callable[[], Any]):
+    """登记资源的构造函数（不会立即调用）；重复登记时替换构造函数并丢弃已创建的实例"""
+    with _registry_lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name: str) -> Any:
+    """获取资源，首次访问时调用构造函数"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _registry_lock:
+        if name not in _factories:
+            raise KeyError(f"未登记的资源: {name}")
+        factory, lock = _factories[name], _locks[name]
+    # 按资源加锁：构造 LLM 时不阻塞其他资源的首次访问
+    with lock:
+        instance = _instances.get(name)
+        if instance is None:
+            logger.info(f"[资源] 初始化 {name}")
+            instance = factory()
+            _instances[name] = instance
+    return instance
+
+
+def is_initialized(name: str) -> bool:
+    return name in _instances
+
+
+def reset(name: Optional[str] = None):
+    """丢弃已创建的实例（下次 get 时重新构造），name 为 None 表示全部"""
+    with _registry_lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+def module_getattr(module_name: str, attrs: Dict[str, str]) -> Callable[[str], Any]:
+    """
+    生成模块级 __getattr__：把旧的模块属性（如 agent.agent.llm）映射到注册表中的资源
+
+    Args:
+        module_name: 模块名（用于错误信息）
+        attrs: 属性名 -> 资源名
+    """
+    def __getattr__(name: str) -> Any:
+        if name in attrs:
+            return get(attrs[name])
+        raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
+
+
+def load_config(config_path: str = "config.yaml") -> Dict:
+    """读取 config.yaml（每次调用都重新读取，只在资源构造时使用）"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def embedding_store():
+    """config.yaml 中 graphrag.cache_dir 的共享 Embedding 磁盘缓存（与 GraphRAG 检索器同一实例），未配置时返回 None"""
+    from utils.embedding_store import embedding_model_name, get_shared_embedding_store
+
+    graphrag_config = load_config().get("graphrag", {}) or {}
+    cache_dir = graphrag_config.get("cache_dir", ".cache/graphrag")
+    if not cache_dir:
+        return None
+    return get_shared_embedding_store(cache_dir, embedding_model_name(get("embeddings")),
+                                      dtype=graphrag_config.get("embedding_dtype", "float16"),
+                                      dim=graphrag_config.get("embedding_dim"))
+
+
+def question_cache():
+    """与 GraphRAG 检索器共用的问题向量缓存（按 config.yaml 的 graphrag 段获取共享实例）"""
+    from utils.embedding_store import get_shared_question_cache
+
+    graphrag_config = load_config().get("graphrag", {}) or {}
+    store = embedding_store() if graphrag_config.get("question_cache_persist", True) else None
+    return get_shared_question_cache(get("embeddings"), store=store,
+                                     maxsize=graphrag_config.get("question_cache_size", 4096))
+
+
+def example_selector(examples: List[Dict[str, str]], k: int):
+    """
+    手写示例的语义相似度 Example Selector，FAISS 向量库持久化到 <graphrag.cache_dir>/few_shot/<哈希>
+
+    只索引示例 input 中 "User question:" 之后的问题部分，查询时同样只嵌入用户问题：
+    示例与查询的问题向量都来自与 GraphRAG 检索共用的问题向量缓存，检索 Schema 时已经算过的问题
+    不再请求 Embedding 接口。示例集合与 Embedding 模型不变时直接 load_local，不再计算示例向量。
+
+    Args:
+        examples: Few-shot 示例（input / query）
+        k: 每次选择的示例数
+    """
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from utils.embedding_store import embedding_model_name, text_hash
+    from utils.example_store import VectorStoreExampleSelector, extract_question
+    from utils.vector_index import normalize_rows
+
+    embeddings = get("embeddings")
+    cache = question_cache()
+    graphrag_config = load_config().get("graphrag", {}) or {}
+    cache_dir = graphrag_config.get("cache_dir", ".cache/graphrag")
+    fingerprint = text_hash(json.dumps({"examples": examples, "model": embedding_model_name(embeddings),
+                                        "dim": graphrag_config.get("embedding_dim")},
+                                       sort_keys=True, ensure_ascii=False))[:16]
+    path = os.path.join(cache_dir, "few_shot", fingerprint) if cache_dir else None
+
+    vectorstore = None
+    if path and os.path.exists(os.path.join(path, "index.faiss")):
+        try:
+            # 缓存目录只由本函数写入，可以信任其中 pickle 格式的 docstore
+            vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+            logger.info(f"[资源] 从 {path} 加载 {len(examples)} 条 Few-shot 示例向量")
+        except Exception as e:
+            logger.warning(f"[资源] 读取 Few-shot 索引失败，重新构建: {str(e)}")
+
+    if vectorstore is None:
+        questions = [extract_question(example["input"]) for example in examples]
+        vecs = cache.embed_many(questions)
+        cache.flush()
+        # 磁盘命中的向量可能已按 embedding_dim 截断，统一截到最短维度后归一化
+        dim = min(len(vec) for vec in vecs)
+        matrix = normalize_rows(np.stack([np.asarray(vec, dtype=np.float32)[:dim] for vec in vecs]))
+        vectorstore = FAISS.from_embeddings(list(zip(questions, matrix.tolist())), embeddings, metadatas=examples)
+        if path:
+            # 先写临时目录再整体改名；并发的 worker 已写好同一份索引时保留已有的
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            vectorstore.save_local(tmp_path)
+            try:
+                os.replace(tmp_path, path)
+                logger.info(f"[资源] Few-shot 示例向量已写入 {path}")
+            except OSError:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+    return VectorStoreExampleSelector(vectorstore, cache, k=k)
+
+
+def mined_example_selector(k: int):
+    """
+    基于问答对文件的示例库选择器（config.yaml 的 few_shot.source），未配置时返回 None
+
+    示例库复用与 GraphRAG 检索器共享的向量缓存与问题向量缓存，数千条示例也只需一次矩阵向量乘；
+    few_shot.k 覆盖调用方的默认 k。
+    """
+    config = load_config()
+    few_shot_config = config.get("few_shot", {}) or {}
+    source = few_shot_config.get("source")
+    if not source:
+        return None
+    from utils.example_store import StoreExampleSelector, get_shared_example_store
+
+    example_store = get_shared_example_store(
+        source,
+        get("embeddings"),
+        store=embedding_store(),
+        question_cache=question_cache(),
+        tables_json_path=(config.get("database", {}) or {}).get("tables_json_path"),
+        ann_threshold=few_shot_config.get("ann_threshold", 20000)
+    )
+    return StoreExampleSelector(example_store,
+                                k=few_shot_config.get("k") or k,
+                                hardness=few_shot_config.get("hardness"),
+                                leave_one_out=few_shot_config.get("leave_one_out", True))
+
+
+def _build_llm():
+    from langchain.chat_models import init_chat_model
+
+    load_dotenv()
+    return init_chat_model(model=os.getenv("model"),
+                           api_key=os.getenv("api_key"),
+                           base_url=os.getenv("base_url"),
+                           max_tokens=load_config()["max_tokens"])
+
+
+def _build_embeddings():
+    from utils.embeddings import get_embeddings
+
+    return get_embeddings(load_config().get("embeddings"))
+
+
+register("llm", _build_llm)
+register("embeddings", _build_embeddings)
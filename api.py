@@ -1,12 +1,14 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
-from agent.agent import react_agent_graph
+from agent.agent_factory import create_agent
 from langchain_core.messages import AIMessage, ToolMessage
+from utils.db_router import get_shared_router
 import logging
 import json
 from datetime import datetime
 import os
+import yaml
 
 # 创建logs目录（如果不存在）
 os.makedirs('logs', exist_ok=True)
@@ -23,6 +25,12 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 加载配置
+with open("config.yaml", "r", encoding="utf-8") as f:
+    config = yaml.safe_load(f) or {}
+tables_json_path = config.get("database", {}).get("tables_json_path", "test/tables.json")
+router_top_n = (config.get("router", {}) or {}).get("top_n", 3)
+
 app = FastAPI(
     title="text to sql API",
     description="API for converting text to SQL queries",
@@ -31,6 +39,7 @@ app = FastAPI(
 
 class QueryRequest(BaseModel):
     question: str
+    db_name: Optional[str] = None  # 未指定时按问题路由到最相关的数据库
     top_k: Optional[int] = 5
     dialect: Optional[str] = "SQLite"
 
@@ -39,6 +48,21 @@ class QueryResponse(BaseModel):
     result: Optional[str] = None
     error: Optional[str] = None
     steps: List[dict] = []
+    db_name: Optional[str] = None
+    routing: List[dict] = []
+
+class RouteRequest(BaseModel):
+    question: str
+    top_n: Optional[int] = None
+
+class RouteResponse(BaseModel):
+    candidates: List[dict] = []
+
+def route_question(question: str, top_n: Optional[int] = None) -> List[dict]:
+    """返回候选数据库 [{"db_id": ..., "score": ...}]，按分数降序"""
+    router = get_shared_router(tables_json_path)
+    return [{"db_id": db_id, "score": score}
+            for db_id, score in router.route(question, top_n=top_n or router_top_n)]
 
 @app.post("/query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
@@ -46,6 +70,15 @@ async def process_query(request: QueryRequest):
         # 记录请求
         logger.info(f"Received query request: {json.dumps(request.model_dump(), ensure_ascii=False)}")
         
+        response = QueryResponse(steps=[], db_name=request.db_name)
+        if response.db_name is None:
+            response.routing = route_question(request.question)
+            if not response.routing:
+                raise ValueError("没有可路由的数据库")
+            response.db_name = response.routing[0]["db_id"]
+            logger.info(f"[路由] 问题路由到数据库: {response.db_name}")
+        react_agent_graph = create_agent(response.db_name)
+        
         initial_state = {
             "input": request.question,
             "top_k": request.top_k,
@@ -53,7 +86,6 @@ async def process_query(request: QueryRequest):
             "messages": []
         }
         
-        response = QueryResponse(steps=[])
         sql_query = None
         result = None
         
@@ -92,6 +124,17 @@ async def process_query(request: QueryRequest):
         logger.error(f"Error processing query: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/route", response_model=RouteResponse)
+async def route(request: RouteRequest):
+    try:
+        candidates = route_question(request.question, request.top_n)
+        logger.info(f"Route request: {request.question} -> {json.dumps(candidates, ensure_ascii=False)}")
+        return RouteResponse(candidates=candidates)
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"Error routing question: {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
 @app.get("/health")
 async def health_check():
     logger.info("Health check requested")
@@ -217,15 +217,12 @@ if st.session_state.run_query:
                     # ========== GraphRAG 检索逻辑 ==========
             if use_graphrag:
                 try:
-                    from utils.graphrag import GraphRAGRetriever  # ✅ 延迟导入
+                    from utils.graphrag import get_shared_retriever  # ✅ 延迟导入
                     
                     st.info(f"正在使用 GraphRAG 检索 Top-{top_k} 相关表...")  # ✅ 显示用户选择的 Top-K
                     
-                    # ✅ 只对当前数据库初始化 GraphRAG
-                    retriever = GraphRAGRetriever(
-                        tables_json_path=TABLES_JSON_PATH,
-                        db_filter=[db_name]  # ✅ 只加载当前数据库
-                    )
+                    # ✅ 进程内共享检索器：当前数据库的 SchemaGraph 首次使用时构建，之后跨请求复用
+                    retriever = get_shared_retriever(TABLES_JSON_PATH)
                     
                     schema_info_text, metadata = retriever.retrieve_relevant_schema(
                         db_id=db_name,
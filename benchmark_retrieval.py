@@ -0,0 +1,237 @@
+"""
+GraphRAG 表检索基准测试
+用 test/dev.sql 的标准 SQL 作为标注，评估当前 config.yaml 中检索参数的质量与开销：
+- Recall@K：标准 SQL 中用到的表（经 process_sql.get_sql 解析，含子查询与集合运算）被检索到的比例
+- 上下文召回：最终 Schema 文本（含桥接表、外键邻居）覆盖标准表的比例
+- Token 节省：检索子图相对完整 Schema（Schema.to_text）的 prompt token 减少量
+- 延迟：单问题检索耗时的 p50 / p95
+
+用法：
+    python benchmark_retrieval.py                         # 使用 config.yaml 中的参数
+    python benchmark_retrieval.py --top-k 3 5 8 --dbs concert_singer,flight_2
+    python benchmark_retrieval.py --keyword-weight 0.3 --embedding-weight 0.7 --output logs/bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import tiktoken
+import yaml
+
+from process_sql import Schema as SchemaFromProcess, get_sql
+from utils.embedding_loader import EmbeddingLoader
+from utils.embeddings import get_embeddings
+from utils.graphrag import GraphRAGRetriever, retriever_options
+from utils.schema_utils import Schema, get_schemas_from_json
+from utils.text_utils import load_sql_pairs
+
+logger = logging.getLogger(__name__)
+
+
+def collect_tables(sql: Dict, tables: Optional[Set[str]] = None) -> Set[str]:
+    """
+    递归收集 get_sql 结果中 FROM 子句引用的表（包括 FROM / WHERE / HAVING 中的子查询与 INTERSECT / UNION / EXCEPT）
+
+    table_unit 的形式为 ('table_unit', '__name__') 或 ('sql', 子查询)
+    """
+    if tables is None:
+        tables = set()
+    if isinstance(sql, dict):
+        if "from" in sql:
+            for unit_type, unit in sql["from"]["table_units"]:
+                if unit_type == "table_unit" and isinstance(unit, str):
+                    tables.add(unit[2:-2] if unit.startswith("__") and unit.endswith("__") else unit)
+        for value in sql.values():
+            collect_tables(value, tables)
+    elif isinstance(sql, (list, tuple)):
+        for item in sql:
+            collect_tables(item, tables)
+    return tables
+
+
+def schema_text_tables(schema_text: str) -> Set[str]:
+    """从 "表名: 列1, 列2" 形式的 Schema 文本中提取表名"""
+    return {line.split(":", 1)[0].strip() for line in schema_text.splitlines() if ":" in line}
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_benchmark(retriever: GraphRAGRetriever,
+                  examples: List[Dict[str, str]],
+                  schemas: Dict[str, Dict],
+                  tables: Dict[str, Dict],
+                  top_ks: List[int],
+                  keyword_weight: float,
+                  embedding_weight: float,
+                  max_columns_per_table: Optional[int],
+                  encoding) -> Dict:
+    """对每个 top_k 逐题检索并汇总召回、Token 与延迟指标"""
+    # 解析标准 SQL 得到标准表集合（无法解析的题目跳过）
+    labeled = []
+    parse_failures = 0
+    for example in examples:
+        db_id = example["db_id"]
+        if db_id not in schemas or retriever.get_schema_graph(db_id) is None:
+            parse_failures += 1
+            continue
+        try:
+            gold_tables = collect_tables(get_sql(SchemaFromProcess(schemas[db_id]), example["query"]))
+        except Exception as e:
+            logger.warning(f"[跳过] 无法解析标准 SQL ({db_id}): {example['query']} ({str(e)})")
+            parse_failures += 1
+            continue
+        if gold_tables:
+            labeled.append((example, gold_tables))
+
+    full_tokens = {db_id: len(encoding.encode(Schema(schemas[db_id], tables[db_id]).to_text()))
+                   for db_id in {example["db_id"] for example, _ in labeled}}
+
+    report = {"questions": len(labeled), "skipped": parse_failures, "results": []}
+    for top_k in top_ks:
+        recalls, perfect, context_recalls, retrieved_tokens, baseline_tokens, latencies = [], [], [], [], [], []
+        per_db = defaultdict(list)
+        for example, gold_tables in labeled:
+            db_id = example["db_id"]
+            start = time.perf_counter()
+            schema_text, metadata = retriever.retrieve_relevant_schema(
+                db_id, example["question"],
+                top_k=top_k,
+                keyword_weight=keyword_weight,
+                embedding_weight=embedding_weight,
+                max_columns_per_table=max_columns_per_table
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            retrieved = set(metadata.get("relevant_tables", [])) if "relevant_tables" in metadata \
+                else schema_text_tables(schema_text)
+            recall = len(gold_tables & retrieved) / len(gold_tables)
+            recalls.append(recall)
+            perfect.append(float(gold_tables <= retrieved))
+            context_recalls.append(len(gold_tables & schema_text_tables(schema_text)) / len(gold_tables))
+            retrieved_tokens.append(len(encoding.encode(schema_text)))
+            baseline_tokens.append(full_tokens[db_id])
+            per_db[db_id].append(recall)
+
+        total_retrieved, total_baseline = sum(retrieved_tokens), sum(baseline_tokens)
+        report["results"].append({
+            "top_k": top_k,
+            "recall": float(np.mean(recalls)) if recalls else 0.0,
+            "perfect_recall_rate": float(np.mean(perfect)) if perfect else 0.0,
+            "context_recall": float(np.mean(context_recalls)) if context_recalls else 0.0,
+            "avg_schema_tokens": total_retrieved / len(labeled) if labeled else 0.0,
+            "avg_full_schema_tokens": total_baseline / len(labeled) if labeled else 0.0,
+            "token_reduction": 1 - total_retrieved / total_baseline if total_baseline else 0.0,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "mean": float(np.mean(latencies)) if latencies else 0.0,
+            },
+            "per_db_recall": {db_id: float(np.mean(values)) for db_id, values in sorted(per_db.items())},
+        })
+    return report
+
+
+def print_report(report: Dict, settings: Dict):
+    print("=" * 80)
+    print("GraphRAG 表检索基准")
+    print("=" * 80)
+    print(f"  参数: Keyword={settings['keyword_weight']}, Embedding={settings['embedding_weight']}, "
+          f"max_columns_per_table={settings['max_columns_per_table']}")
+    print(f"  题目数: {report['questions']} (跳过 {report['skipped']})")
+    print("-" * 80)
+    print(f"  {'top_k':>5} | {'Recall@K':>8} | {'全部命中':>8} | {'上下文召回':>10} | "
+          f"{'Tokens':>7} | {'完整':>7} | {'节省':>6} | {'p50 ms':>7} | {'p95 ms':>7}")
+    for result in report["results"]:
+        latency = result["latency_ms"]
+        print(f"  {result['top_k']:>5} | {result['recall']:>8.3f} | {result['perfect_recall_rate']:>8.3f} | "
+              f"{result['context_recall']:>10.3f} | {result['avg_schema_tokens']:>7.1f} | "
+              f"{result['avg_full_schema_tokens']:>7.1f} | {result['token_reduction']:>6.1%} | "
+              f"{latency['p50']:>7.2f} | {latency['p95']:>7.2f}")
+    print("=" * 80)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GraphRAG 表检索召回率 / Token / 延迟基准")
+    parser.add_argument("--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("--dev", default="test/dev.sql", help="dev.sql 路径（Question ... ||| db_id / SQL: ...）")
+    parser.add_argument("--tables", default=None, help="tables.json 路径，默认读取 database.tables_json_path")
+    parser.add_argument("--dbs", default=None, help="只评测这些数据库（逗号分隔），默认全部")
+    parser.add_argument("--limit", type=int, default=0, help="最多评测的题目数（0 表示不限制）")
+    parser.add_argument("--top-k", type=int, nargs="+", default=None, help="评测的 K 值，默认 graphrag.top_k_tables")
+    parser.add_argument("--keyword-weight", type=float, default=None)
+    parser.add_argument("--embedding-weight", type=float, default=None)
+    parser.add_argument("--max-columns", type=int, default=None, help="每张表保留的相关列数，默认读取配置")
+    parser.add_argument("--encoding", default="cl100k_base", help="统计 Token 使用的 tiktoken 编码")
+    parser.add_argument("--output", default=None, help="将完整结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    graphrag_config = config.get("graphrag", {}) or {}
+    tables_json_path = args.tables or config.get("database", {}).get("tables_json_path", "test/tables.json")
+
+    settings = {
+        "top_k": args.top_k or [graphrag_config.get("top_k_tables", 5)],
+        "keyword_weight": (args.keyword_weight if args.keyword_weight is not None
+                           else graphrag_config.get("keyword_weight", 0.4)),
+        "embedding_weight": (args.embedding_weight if args.embedding_weight is not None
+                             else graphrag_config.get("embedding_weight", 0.6)),
+        "max_columns_per_table": args.max_columns,
+    }
+
+    examples = load_sql_pairs(args.dev)
+    if args.dbs:
+        db_filter = {db.strip() for db in args.dbs.split(",") if db.strip()}
+        examples = [example for example in examples if example["db_id"] in db_filter]
+    if args.limit:
+        examples = examples[:args.limit]
+
+    schemas, _, tables = get_schemas_from_json(tables_json_path)
+
+    # Embedding 后端与批量加载参数同样取自 --config（而不是当前目录的 config.yaml）
+    embedding_config = config.get("embeddings", {}) or {}
+    embeddings = get_embeddings(embedding_config)
+
+    # 关闭检索结果缓存，保证每次调用都测到真实的检索开销；Embedding 缓存保留
+    options = retriever_options(graphrag_config)
+    options["result_cache_size"] = 0
+    retriever = GraphRAGRetriever(
+        tables_json_path,
+        db_filter=sorted({example["db_id"] for example in examples}),
+        cache_dir=graphrag_config.get("cache_dir", ".cache/graphrag"),
+        embeddings=embeddings,
+        embedding_loader=EmbeddingLoader.from_config(embeddings, embedding_config),
+        **options
+    )
+    # 预先计算问题向量，延迟只统计检索本身（Embedding 请求耗时取决于网络）
+    retriever.question_cache.embed_many([example["question"] for example in examples])
+
+    report = run_benchmark(
+        retriever, examples, schemas, tables,
+        top_ks=settings["top_k"],
+        keyword_weight=settings["keyword_weight"],
+        embedding_weight=settings["embedding_weight"],
+        max_columns_per_table=settings["max_columns_per_table"],
+        encoding=tiktoken.get_encoding(args.encoding)
+    )
+    report["settings"] = settings
+    print_report(report, settings)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from agent.agent_factory import create_agent
 from langchain_core.messages import AIMessage, ToolMessage
 import logging
@@ -10,10 +10,12 @@ import sqlparse
 import re
 import asyncio
 from utils.schema_utils import get_schemas_from_json, Schema
+from utils.text_utils import load_sql_pairs
 from langchain_core.runnables import Runnable
 from tools.sql_tool import sql_format
 import yaml
 from collections import defaultdict  # ✅ 新增：用于 Token 统计
+from functools import lru_cache
 
 os.makedirs('logs', exist_ok=True)
 os.makedirs('test', exist_ok=True)
@@ -45,6 +47,12 @@ def load_config(config_path: str = "config.yaml") -> Dict:
         return {}
 
 
+@lru_cache(maxsize=4)
+def load_schemas(tables_json_path: str):
+    """解析 tables.json（按路径缓存，路由后按数据库取 Schema 时复用）"""
+    return get_schemas_from_json(tables_json_path)
+
+
 class QueryRequest(BaseModel):
     question: str
     top_k: Optional[int] = 5
@@ -57,6 +65,8 @@ class QueryResponse(BaseModel):
     error: Optional[str] = None
     steps: List[dict] = []
     graphrag_metadata: Optional[Dict] = None
+    db_name: Optional[str] = None
+    routing: Optional[List[Dict]] = None
     token_usage: Optional[Dict] = None  # ✅ 新增：Token 使用信息
 
     
@@ -78,7 +88,8 @@ async def process_query(request: QueryRequest, schema: Optional[Schema] = None,
                         use_graphrag: bool = False, 
                         top_k: int = 5,
                         use_full_schema: bool = False,
-                        tables_json_path: str = "test/tables.json") -> QueryResponse:
+                        tables_json_path: str = "test/tables.json",
+                        graphrag_result: Optional[Tuple[str, Dict]] = None) -> QueryResponse:
     """
     处理查询请求
     
@@ -86,35 +97,52 @@ async def process_query(request: QueryRequest, schema: Optional[Schema] = None,
         request: 查询请求
         schema: 数据库 Schema
         agent_graph: Agent 图
-        db_name: 数据库名称
+        db_name: 数据库名称，None 时按问题路由到最相关的数据库（忽略传入的 schema / agent_graph）
         use_graphrag: 是否使用 GraphRAG
         top_k: GraphRAG 检索的表数量
         use_full_schema: 是否使用完整 Schema（GraphRAG 失败时的回退策略）
         tables_json_path: tables.json 路径
+        graphrag_result: 预先批量检索好的 (schema 文本, 元数据)，提供时跳过单独检索
     """
     try:
         logger.info(f"Received query request: {json.dumps(request.model_dump(), ensure_ascii=False)}")
         
         graphrag_metadata = None
         
+        # ========== 数据库路由 ==========
+        routing = None
+        if db_name is None:
+            from utils.db_router import get_shared_router
+            
+            candidates = get_shared_router(tables_json_path).route(request.question)
+            if not candidates:
+                raise ValueError("没有可路由的数据库")
+            routing = [{"db_id": candidate, "score": score} for candidate, score in candidates]
+            db_name = candidates[0][0]
+            logger.info(f"[路由] 问题路由到数据库: {db_name} (候选: {json.dumps(routing, ensure_ascii=False)})")
+            
+            schemas, _, tables = load_schemas(tables_json_path)
+            schema = Schema(schemas[db_name], tables[db_name]) if db_name in schemas else None
+            agent_graph = create_agent(db_name, use_graphrag=use_graphrag)
+        
         # ========== GraphRAG 检索 Schema ==========
         if use_graphrag and db_name:
-            from utils.graphrag import GraphRAGRetriever
+            from utils.graphrag import get_shared_retriever
             
             logger.info(f"[GraphRAG] 启用检索 (数据库: {db_name}, top_k={top_k})")
             
             try:
-                graphrag_retriever = GraphRAGRetriever(
-                    tables_json_path=tables_json_path,
-                    db_filter=[db_name]
-                )
-                
-                relevant_schema, metadata = graphrag_retriever.retrieve_relevant_schema(
-                    db_id=db_name,
-                    question=request.question,
-                    use_full_schema=use_full_schema,
-                    top_k=top_k
-                )
+                if graphrag_result is not None:
+                    relevant_schema, metadata = graphrag_result
+                else:
+                    graphrag_retriever = get_shared_retriever(tables_json_path)
+                    
+                    relevant_schema, metadata = graphrag_retriever.retrieve_relevant_schema(
+                        db_id=db_name,
+                        question=request.question,
+                        use_full_schema=use_full_schema,
+                        top_k=top_k
+                    )
                 
                 graphrag_metadata = metadata
                 
@@ -152,7 +180,8 @@ async def process_query(request: QueryRequest, schema: Optional[Schema] = None,
         }
 
         # ========== 执行推理 ==========
-        response = QueryResponse(steps=[], graphrag_metadata=graphrag_metadata)
+        response = QueryResponse(steps=[], graphrag_metadata=graphrag_metadata,
+                                 db_name=db_name, routing=routing)
         sql_query = None
         result = None
         
@@ -226,42 +255,10 @@ async def process_query(request: QueryRequest, schema: Optional[Schema] = None,
 def generate_query():
     """从 dev.sql 读取测试数据"""
     dataset = {}
-    current_dataset = None
-    current_db = None
-    question = None
-    gold_sql = None
-    
-    with open("test/dev.sql", "r", encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-                
-            if line.startswith("Question"):
-                parts = line.split("|||")
-                if len(parts) >= 2:
-                    current_db = parts[1].strip()
-                    question = parts[0].split(":", 1)[1].strip()
-                    current_dataset = dataset.get(current_db, None)
-                    if current_dataset:
-                        current_dataset['question'].append(question)
-                    else:
-                        dataset[current_db] = {
-                            'question': [question],
-                            'gold_sql': []
-                        }
-                
-            elif line.startswith("SQL:"):
-                gold_sql = line.split(":", 1)[1].strip()
-                if gold_sql.endswith(';'):
-                    gold_sql = gold_sql[:-1]
-                if current_db:
-                    current_dataset = dataset.get(current_db, None)
-                    if current_dataset:
-                        current_dataset['gold_sql'].append(gold_sql)
-                    current_db = None
-                    question = None
-                    gold_sql = None 
+    for pair in load_sql_pairs("test/dev.sql"):
+        current_dataset = dataset.setdefault(pair["db_id"], {'question': [], 'gold_sql': []})
+        current_dataset['question'].append(pair["question"])
+        current_dataset['gold_sql'].append(pair["query"])
     return dataset
 
 
@@ -352,6 +349,23 @@ async def run():
 
         questions = dataset[db_name]["question"]
         golds = dataset[db_name]["gold_sql"]
+        
+        # ✅ GraphRAG 批量检索：问题向量走共享缓存，对称 Embedding 后端分块批量计算（非对称后端逐条并发请求）
+        graphrag_results = [None] * len(questions)
+        if use_graphrag:
+            from utils.graphrag import get_shared_retriever
+            
+            batch_questions = questions[:eval_limit] if eval_limit else questions
+            try:
+                graphrag_results[:len(batch_questions)] = get_shared_retriever(
+                    tables_json_path
+                ).retrieve_relevant_schema_batch(
+                    [(db_name, question) for question in batch_questions],
+                    use_full_schema=use_full_schema,
+                    top_k=top_k
+                )
+            except Exception as e:
+                logger.error(f"[错误] GraphRAG 批量检索异常: {str(e)}，改为逐个检索")
 
         for i, (question, gold_sql) in enumerate(zip(questions, golds)):
             logger.info(f"\n{'='*50}")
@@ -367,7 +381,8 @@ async def run():
                 use_graphrag=use_graphrag,
                 top_k=top_k,
                 use_full_schema=use_full_schema,
-                tables_json_path=tables_json_path
+                tables_json_path=tables_json_path,
+                graphrag_result=graphrag_results[i]
             )
 
             # ✅ 新增：评估难度级别并统计 Token
@@ -0,0 +1,109 @@
+import itertools
+from typing import Dict, List, Sequence, Tuple
+
+import pytest
+
+from utils.embeddings import HashingEmbeddings
+
+
+def make_entry(db_id: str, tables: Dict[str, List[str]],
+               foreign_keys: Sequence[Tuple[str, str, str, str]] = (),
+               primary_keys: Sequence[Tuple[str, str]] = ()) -> Dict:
+    """
+    构造 tables.json 格式的数据库条目
+
+    Args:
+        tables: 表名 -> 列名列表
+        foreign_keys: (表, 列, 被引用表, 被引用列)
+        primary_keys: (表, 列)
+    """
+    entry = {
+        "db_id": db_id,
+        "table_names_original": list(tables),
+        "table_names": [name.replace("_", " ") for name in tables],
+        "column_names_original": [[-1, "*"]],
+        "column_names": [[-1, "*"]],
+        "column_types": ["text"],
+        "primary_keys": [],
+        "foreign_keys": [],
+    }
+    index = {}
+    for table_idx, (table, columns) in enumerate(tables.items()):
+        for column in columns:
+            index[(table, column)] = len(entry["column_names_original"])
+            entry["column_names_original"].append([table_idx, column])
+            entry["column_names"].append([table_idx, column.replace("_", " ")])
+            entry["column_types"].append("number" if column.endswith("id") else "text")
+    entry["primary_keys"] = [index[key] for key in primary_keys]
+    entry["foreign_keys"] = [[index[(table, column)], index[(ref_table, ref_column)]]
+                             for table, column, ref_table, ref_column in foreign_keys]
+    return entry
+
+
+@pytest.fixture
+def embeddings():
+    return HashingEmbeddings(dimensions=256)
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """记录 embed_query / embed_documents 调用的哈希向量化；模型名各不相同，不会命中其他测试的共享缓存"""
+
+    _ids = itertools.count()
+
+    def __init__(self, dimensions: int = 256):
+        super().__init__(dimensions=dimensions)
+        self.model = f"counting-{next(self._ids)}"
+        self.queries = []
+        self.documents = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def counting_embeddings():
+    return CountingEmbeddings()
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def shop_entry(db_id: str = "shop") -> Dict:
+    """小型商店库：customer -> orders -> product，另有与订单无关的 staff / department"""
+    return make_entry(
+        db_id,
+        {
+            "customer": ["customer_id", "name", "city"],
+            "orders": ["order_id", "customer_id", "product_id", "amount", "order_date"],
+            "product": ["product_id", "title", "price"],
+            "staff": ["staff_id", "name", "department_id"],
+            "department": ["department_id", "title"],
+        },
+        foreign_keys=[("orders", "customer_id", "customer", "customer_id"),
+                      ("orders", "product_id", "product", "product_id"),
+                      ("staff", "department_id", "department", "department_id")],
+        primary_keys=[("customer", "customer_id"), ("orders", "order_id"), ("product", "product_id"),
+                      ("staff", "staff_id"), ("department", "department_id")],
+    )
+
+
+@pytest.fixture
+def tables_json(tmp_path):
+    """写入包含 shop 与 school 两个数据库的 tables.json，返回路径"""
+    import json
+
+    school = make_entry(
+        "school",
+        {"student": ["student_id", "name", "grade"], "teacher": ["teacher_id", "name", "subject"]},
+        primary_keys=[("student", "student_id"), ("teacher", "teacher_id")],
+    )
+    path = tmp_path / "tables.json"
+    path.write_text(json.dumps([shop_entry(), school]), encoding="utf-8")
+    return str(path)
@@ -0,0 +1,49 @@
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+from agent import agent_factory
+
+
+@pytest.fixture
+def fake_builder(monkeypatch):
+    """用假的 agent.agent 模块替换真实的 Agent 构建（不依赖 LLM / langgraph）"""
+    builds = []
+
+    def create_react_agent_graph(db_name):
+        time.sleep(0.01)
+        builds.append(db_name)
+        return object()
+
+    module = types.ModuleType("agent.agent")
+    module.create_react_agent_graph = create_react_agent_graph
+    monkeypatch.setitem(sys.modules, "agent.agent", module)
+    agent_factory.invalidate_agent()
+    yield builds
+    agent_factory.invalidate_agent()
+
+
+def test_concurrent_requests_build_once(fake_builder):
+    agents = []
+    threads = [threading.Thread(target=lambda: agents.append(agent_factory.create_agent("concert_singer")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake_builder == ["concert_singer"]
+    assert len({id(agent) for agent in agents}) == 1
+
+
+def test_build_locks_do_not_outlive_builds(fake_builder):
+    for db_name in ("a", "b", "c"):
+        agent_factory.create_agent(db_name)
+    assert agent_factory._build_locks == {}
+
+    agent_factory.invalidate_agent("a")
+    agent_factory.create_agent("a")
+    assert fake_builder == ["a", "b", "c", "a"]
+    assert agent_factory._build_locks == {}
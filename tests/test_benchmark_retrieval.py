@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("tiktoken")
+
+from benchmark_retrieval import collect_tables, run_benchmark, schema_text_tables
+from process_sql import Schema as SchemaFromProcess, get_sql
+from utils.graphrag import GraphRAGRetriever
+from utils.schema_utils import get_schemas_from_json
+from utils.text_utils import load_sql_pairs
+
+TABLES_JSON = "test/tables.json"
+
+
+class WordEncoding:
+    """按空白切分的 token 计数（代替 tiktoken，不需要下载编码表）"""
+
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(scope="module")
+def schemas():
+    schemas, _, tables = get_schemas_from_json(TABLES_JSON)
+    return schemas, tables
+
+
+def test_collect_tables_follows_subqueries_and_set_operations(schemas):
+    schema = SchemaFromProcess(schemas[0]["concert_singer"])
+    sql = get_sql(schema, "SELECT name FROM singer WHERE singer_id IN (SELECT singer_id FROM singer_in_concert) "
+                          "UNION SELECT name FROM stadium")
+    assert collect_tables(sql) == {"singer", "singer_in_concert", "stadium"}
+    assert schema_text_tables("singer: name, age\nstadium: name\n\nForeign keys") == {"singer", "stadium"}
+
+
+def test_run_benchmark_reports_full_recall_when_k_covers_every_table(schemas, embeddings):
+    examples = [pair for pair in load_sql_pairs("test/dev.sql") if pair["db_id"] == "concert_singer"][:10]
+    retriever = GraphRAGRetriever(TABLES_JSON, db_filter=["concert_singer"], cache_dir=None,
+                                  embeddings=embeddings, result_cache_size=0)
+    report = run_benchmark(retriever, examples, schemas[0], schemas[1], top_ks=[1, 10],
+                           keyword_weight=0.4, embedding_weight=0.6, max_columns_per_table=None,
+                           encoding=WordEncoding())
+
+    assert report["questions"] == 10 and report["skipped"] == 0
+    narrow, wide = report["results"]
+    assert 0 < narrow["recall"] <= wide["recall"] == 1.0
+    assert wide["perfect_recall_rate"] == 1.0
+    assert narrow["token_reduction"] > wide["token_reduction"]
+    assert set(wide["latency_ms"]) == {"p50", "p95", "mean"}
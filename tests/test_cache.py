@@ -0,0 +1,41 @@
+import pytest
+
+from utils import cache as cache_module
+from utils.cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    assert cache.put("c", 3) == [("b", 2)]
+    assert cache.keys() == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_weight_limit_keeps_the_newest_entry():
+    cache = LRUCache(max_weight=10, weigh=len)
+    cache.put("a", "x" * 6)
+    cache.put("b", "x" * 6)
+    assert cache.keys() == ["b"]
+    # 单条超出上限时仍保留最新写入的一条
+    cache.put("c", "x" * 20)
+    assert cache.keys() == ["c"] and cache.total_weight == 20
+
+
+def test_ttl_expiry_and_pop_where(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.put(("shop", "q1"), 1)
+    cache.put(("school", "q2"), 2)
+    now[0] += 11
+    assert cache.get(("shop", "q1")) is None
+    assert cache.stats()["expirations"] == 1
+
+    cache.put(("shop", "q3"), 3)
+    assert cache.pop_where(lambda key: key[0] == "shop") == 1
+    assert len(cache) == 1
+    with pytest.raises(KeyError):
+        cache[("shop", "q3")]
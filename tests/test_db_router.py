@@ -0,0 +1,33 @@
+import json
+
+from tests.conftest import make_entry
+from utils.db_router import DatabaseRouter
+from utils.graphrag import GraphRAGRetriever
+
+
+def test_routes_questions_to_their_database(tables_json, embeddings):
+    router = DatabaseRouter(GraphRAGRetriever(tables_json, cache_dir=None, embeddings=embeddings))
+    assert router.route("Which teacher teaches the math subject?", top_n=1)[0][0] == "school"
+    assert router.route("total order amount per customer", top_n=1)[0][0] == "shop"
+    assert [db_id for db_id, _ in router.route("customers", top_n=5)] == ["shop", "school"]
+
+
+def test_common_words_carry_no_keyword_weight(tables_json, embeddings):
+    router = DatabaseRouter(GraphRAGRetriever(tables_json, cache_dir=None, embeddings=embeddings))
+    # "name" 同时出现在两个库中：IDF 接近 0，不足以区分数据库
+    scores = router.keyword_scores("name")
+    assert scores.max() == scores.min()
+    assert router.keyword_scores("what is the grade of each student").tolist() == [0.0, 1.0]
+
+
+def test_router_rebuilds_after_tables_json_changes(tables_json, embeddings):
+    retriever = GraphRAGRetriever(tables_json, cache_dir=None, embeddings=embeddings, schema_check_interval=0)
+    router = DatabaseRouter(retriever)
+    with open(tables_json, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    entries.append(make_entry("zoo", {"animal": ["animal_id", "species", "keeper"]}))
+    with open(tables_json, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    retriever._tables_mtime = 0
+
+    assert router.route("which species does each keeper look after", top_n=1)[0][0] == "zoo"
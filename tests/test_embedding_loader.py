@@ -0,0 +1,89 @@
+import pytest
+
+from utils.embedding_loader import EmbeddingLoader, RateLimiter, estimate_tokens, is_transient_error
+from utils.embedding_store import EmbeddingStore
+
+
+class FakeEmbeddings:
+    """按文本长度生成向量；fail_on 中的文本所在批次调用时抛出 errors 中的下一个异常"""
+
+    model = "fake"
+
+    def __init__(self, fail_on=(), errors=()):
+        self.fail_on = set(fail_on)
+        self.errors = list(errors)
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.fail_on.intersection(texts) and self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def test_rate_limiter_charges_oversized_requests_in_full():
+    limiter = RateLimiter(rate=100.0, capacity=100.0)
+    limiter.acquire(300)
+    # 超过容量的请求按全额扣除，余额为负，后续请求需等待欠额补足
+    assert limiter._tokens == pytest.approx(-200, abs=1.0)
+
+
+def test_loader_bucket_capacity_is_per_minute_budget():
+    loader = EmbeddingLoader(FakeEmbeddings(), requests_per_minute=3000, tokens_per_minute=1_000_000)
+    assert loader._token_limiter.capacity == 1_000_000
+    assert loader._request_limiter.capacity == 3000
+    assert loader._token_limiter.rate == pytest.approx(1_000_000 / 60)
+
+
+def test_pack_batches_respects_size_and_token_limits():
+    loader = EmbeddingLoader(FakeEmbeddings(), batch_size=2, batch_tokens=10)
+    texts = ["a", "b", "c", "x" * 100]
+    batches = loader.pack_batches(texts)
+    assert batches == [["a", "b"], ["c"], ["x" * 100]]
+    assert all(len(batch) <= 2 for batch in batches)
+    assert estimate_tokens("x" * 100) > 10
+
+
+def test_is_transient_error():
+    assert is_transient_error(TimeoutError())
+    assert is_transient_error(StatusError(429))
+    assert is_transient_error(StatusError(503))
+    assert not is_transient_error(StatusError(400))
+    assert not is_transient_error(ValueError("bad input"))
+    assert not is_transient_error(RuntimeError("cache miss"))
+
+
+def test_non_transient_errors_are_not_retried(tmp_path):
+    embeddings = FakeEmbeddings(fail_on={"a"}, errors=[ValueError("bad input")])
+    loader = EmbeddingLoader(embeddings, max_retries=5, backoff_seconds=10.0)
+    with pytest.raises(ValueError):
+        loader.prefetch(EmbeddingStore(str(tmp_path), "fake"), ["a"])
+    assert embeddings.calls == 1
+
+
+def test_transient_errors_are_retried(tmp_path):
+    embeddings = FakeEmbeddings(fail_on={"a"}, errors=[TimeoutError(), StatusError(500)])
+    loader = EmbeddingLoader(embeddings, max_retries=3, backoff_seconds=0.001)
+    store = EmbeddingStore(str(tmp_path), "fake")
+    assert loader.prefetch(store, ["a"]) == 1
+    assert embeddings.calls == 3
+    assert store.get_many(["a"])[0] is not None
+
+
+def test_prefetch_persists_completed_batches_before_raising(tmp_path):
+    embeddings = FakeEmbeddings(fail_on={"bad"}, errors=[ValueError("bad input")])
+    loader = EmbeddingLoader(embeddings, max_concurrency=1, batch_size=1, max_retries=0)
+    with pytest.raises(ValueError):
+        loader.prefetch(EmbeddingStore(str(tmp_path), "fake"), ["one", "two", "bad"])
+
+    # 已完成的批次已经落盘，新进程重新打开缓存也能读到
+    reopened = EmbeddingStore(str(tmp_path), "fake")
+    one, two, bad = reopened.get_many(["one", "two", "bad"])
+    assert one is not None and two is not None
+    assert bad is None
@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+
+from tests.conftest import CountingEmbeddings, shop_entry
+from utils.embedding_store import EmbeddingStore, QuestionEmbeddingCache
+from utils.graphrag import SchemaGraph
+
+
+class RecordingEmbeddings:
+    """查询向量与文档向量故意不同（如 e5 / instruct 类模型），记录每次调用"""
+
+    model = "recording"
+
+    def __init__(self):
+        self.queries = []
+        self.documents = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 1.0, 0.0]
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return [[0.0, 0.0, 1.0] for _ in texts]
+
+
+def test_question_cache_embeds_original_question_with_embed_query():
+    embeddings = RecordingEmbeddings()
+    cache = QuestionEmbeddingCache(embeddings)
+    vec = cache.embed("How many  Singers are there?")
+    assert embeddings.queries == ["How many  Singers are there?"]
+    assert np.allclose(vec, [28.0, 1.0, 0.0])
+
+    # 归一化只用于缓存键：大小写、空白不同的同一问题命中缓存
+    cache.embed("how many singers are there?")
+    assert len(embeddings.queries) == 1
+
+
+def test_embed_many_matches_embed_and_never_uses_embed_documents():
+    embeddings = RecordingEmbeddings()
+    cache = QuestionEmbeddingCache(embeddings)
+    questions = ["Show all Singers", "show all singers", "Count concerts", "List stadiums"]
+    vecs = cache.embed_many(questions, batch_size=2, max_workers=2)
+
+    assert embeddings.documents == []
+    assert sorted(embeddings.queries) == ["Count concerts", "List stadiums", "Show all Singers"]
+    expected = QuestionEmbeddingCache(RecordingEmbeddings())
+    for question, vec in zip(questions, vecs):
+        assert np.allclose(vec, expected.embed(question))
+
+
+def test_question_cache_persists_to_store(tmp_path):
+    embeddings = RecordingEmbeddings()
+    cache = QuestionEmbeddingCache(embeddings, store=EmbeddingStore(str(tmp_path), "recording"))
+    cache.embed("Count concerts")
+    cache.flush()
+
+    reopened = QuestionEmbeddingCache(RecordingEmbeddings(), store=EmbeddingStore(str(tmp_path), "recording"))
+    assert reopened.lookup_many(["count concerts", "unknown question"])[1] is None
+    assert reopened.lookup_many(["count concerts"])[0] is not None
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_schema_graph_embeddings_are_reused_from_disk(store_dir):
+    first = CountingEmbeddings()
+    graph = SchemaGraph("shop", shop_entry(), first, store=EmbeddingStore(store_dir, first.model))
+    assert len(first.documents) == len(graph.embedding_texts())
+
+    # 新进程（新的 EmbeddingStore 实例、同一模型名）不再调用 Embedding 接口
+    second = CountingEmbeddings()
+    second.model = first.model
+    reloaded = SchemaGraph("shop", shop_entry(), second, store=EmbeddingStore(store_dir, second.model))
+    assert second.documents == []
+    assert np.allclose(reloaded.table_matrix, graph.table_matrix)
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 1e-6), ("float16", 1e-3), ("int8", 2e-2)])
+def test_store_roundtrip_per_dtype_with_dim_truncation(tmp_path, dtype, tolerance):
+    vectors = np.random.default_rng(0).standard_normal((5, 16)).astype(np.float32)
+    texts = [f"text {i}" for i in range(5)]
+    store = EmbeddingStore(str(tmp_path), "model", dtype=dtype, dim=8)
+    store.put_many(texts, vectors)
+    store.flush()
+
+    reopened = EmbeddingStore(str(tmp_path), "model", dtype=dtype, dim=8)
+    assert len(reopened) == 5
+    expected = vectors[:, :8] / np.linalg.norm(vectors[:, :8], axis=1, keepdims=True)
+    assert np.allclose(np.vstack(reopened.get_many(texts)), expected, atol=tolerance)
+    assert reopened.get_many(["unknown"]) == [None]
+
+
+def test_get_matrix_returns_memmap_slice_for_contiguous_rows(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model", dtype="float16")
+    texts = [f"column {i}" for i in range(6)]
+    store.put_many(texts, np.eye(6, dtype=np.float32))
+    assert store.get_matrix(texts) is None  # 尚未落盘
+    store.flush()
+
+    matrix = store.get_matrix(texts[1:4])
+    assert isinstance(matrix, np.memmap) and matrix.shape == (3, 6)
+    shuffled = store.get_matrix([texts[3], texts[0]])
+    assert not isinstance(shuffled, np.memmap)
+    assert np.allclose(shuffled, np.eye(6)[[3, 0]])
+
+
+def test_segments_are_compacted_on_load(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "model")
+    for i in range(4):
+        store.put_many([f"text {i}"], [[float(i + 1), 1.0]])
+        store.flush()
+    assert len(store._segments) == 4
+
+    compacted = EmbeddingStore(str(tmp_path), "model", max_segments=2)
+    assert len(compacted._segments) == 1
+    assert len(EmbeddingStore(str(tmp_path), "model")._segments) == 1
+    assert all(vec is not None for vec in compacted.get_many([f"text {i}" for i in range(4)]))
+
+
+def test_question_cache_is_bounded_and_counts_hits():
+    embeddings = RecordingEmbeddings()
+    cache = QuestionEmbeddingCache(embeddings, maxsize=2)
+    for question in ("q1", "q2", "q1", "q3", "q2"):
+        cache.embed(question)
+    # q2 在 q3 写入时被淘汰，再次访问需要重新计算
+    assert embeddings.queries == ["q1", "q2", "q3", "q2"]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["size"] == 2 and stats["model"] == "recording"
+
+
+def test_question_cache_keeps_stored_width_after_eviction(tmp_path):
+    # 模型输出 512 维、落盘截断为 128 维：LRU 淘汰前后返回的向量应完全一致
+    embeddings = CountingEmbeddings(dimensions=512)
+    store = EmbeddingStore(str(tmp_path), embeddings.model, dim=128)
+    cache = QuestionEmbeddingCache(embeddings, maxsize=2, store=store)
+    first = cache.embed("Count concerts")
+    assert first.shape == (128,)
+    assert np.isclose(np.linalg.norm(first), 1.0)
+
+    for question in ("q1", "q2", "q3"):
+        cache.embed(question)
+    reloaded = cache.embed("Count concerts")
+    assert cache.stats()["disk_hits"] == 1
+    assert len(embeddings.queries) == 4
+    assert np.allclose(reloaded, first, atol=1e-3)
+    assert cache.embed_many(["count concerts", "q4"])[1].shape == (128,)
+
+
+def test_embed_many_batches_symmetric_backends(counting_embeddings, monkeypatch):
+    calls = []
+    embed_documents = counting_embeddings.embed_documents
+    monkeypatch.setattr(counting_embeddings, "embed_documents",
+                        lambda texts: calls.append(texts) or embed_documents(texts))
+    cache = QuestionEmbeddingCache(counting_embeddings)
+    questions = [f"question {i}" for i in range(5)] + ["QUESTION 0"]
+    vecs = cache.embed_many(questions, batch_size=2)
+
+    # 对称后端每块一次 embed_documents，不逐条调用 embed_query；结果与单条 embed 相同
+    assert [len(texts) for texts in calls] == [2, 2, 1]
+    assert counting_embeddings.queries == []
+    assert counting_embeddings.documents == [f"question {i}" for i in range(5)]
+    for question, vec in zip(questions, vecs):
+        assert np.allclose(vec, counting_embeddings.embed_query(question))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utils.embeddings import HashingEmbeddings, get_embeddings
+
+
+def cosine(a, b):
+    return float(np.dot(a, b))
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    embeddings = HashingEmbeddings(dimensions=128)
+    vec = embeddings.embed_query("How many singers are there?")
+    assert len(vec) == 128
+    assert np.linalg.norm(vec) == pytest.approx(1.0)
+    assert HashingEmbeddings(dimensions=128).embed_documents(["How many singers are there?"])[0] == vec
+
+
+def test_hashing_embeddings_rank_lexical_overlap_higher():
+    embeddings = HashingEmbeddings(dimensions=512)
+    question = embeddings.embed_query("list every singer name")
+    singer, flight = embeddings.embed_documents(["singer columns: singer_id, name, age",
+                                                 "flights columns: flight_no, airline, source_airport"])
+    assert cosine(question, singer) > cosine(question, flight)
+
+
+def test_get_embeddings_shares_instances_per_config():
+    config = {"provider": "hashing", "dimensions": 64}
+    embeddings = get_embeddings(config)
+    assert isinstance(embeddings, HashingEmbeddings) and embeddings.dimensions == 64
+    assert get_embeddings(dict(config)) is embeddings
+    with pytest.raises(ValueError):
+        get_embeddings({"provider": "unknown"})
@@ -0,0 +1,102 @@
+import pytest
+
+from utils.embedding_loader import EmbeddingLoader
+from utils.embedding_store import EmbeddingStore, QuestionEmbeddingCache
+from utils.example_store import ExampleStore, StoreExampleSelector
+from utils.vector_index import faiss_available
+
+
+def pair(db_id, question, query, hardness="easy"):
+    return {"db_id": db_id, "question": question, "query": query, "hardness": hardness}
+
+
+EXAMPLES = [
+    pair("singer", "How many singers do we have ?", "select count(*) from singer"),
+    pair("singer", "What is the total number of singers ?", "select count(*) from singer"),
+    pair("singer", "Show the names of singers ordered by age .", "select name from singer order by age",
+         "medium"),
+    pair("concert", "How many concerts are there ?", "select count(*) from concert"),
+    pair("concert", "List the concert names in 2014 .", "select concert_name from concert where year = 2014",
+         "medium"),
+    pair("flight", "Which airlines have the most flights ?",
+         "select airline from flights group by airline order by count(*) desc limit 1", "hard"),
+]
+
+
+@pytest.fixture
+def example_store(embeddings):
+    return ExampleStore(list(EXAMPLES), embeddings, ann_threshold=0)
+
+
+@pytest.mark.skipif(not faiss_available(), reason="需要 faiss-cpu")
+def test_ann_leave_one_out_with_duplicate_questions(embeddings):
+    duplicated = list(EXAMPLES) + [pair("singer", "How many singers do we have?", "select count(*) from singer")]
+    example_store = ExampleStore(duplicated, embeddings, ann_threshold=2, ann_candidates=2)
+    assert example_store.index is not None
+
+    selected = example_store.select("How many singers do we have?", k=3, leave_one_out=True)
+    assert len(selected) == 3
+    assert all("do we have" not in example["question"] for example in selected)
+
+
+def test_filters_by_db_and_hardness(example_store):
+    selected = example_store.select("How many singers?", k=5, db_id="singer", hardness=["medium"])
+    assert [example["query"] for example in selected] == ["select name from singer order by age"]
+    assert example_store.select("How many singers?", k=5, db_id="missing") == []
+    assert example_store.select("How many singers?", k=5, hardness=[]) == []
+
+
+def test_leave_one_out_excludes_paraphrases_with_the_same_gold_sql(example_store):
+    selected = example_store.select("How many singers do we have?", k=6, leave_one_out=True)
+    queries = [example["query"] for example in selected]
+    # 同库同 SQL 的改写问法 "What is the total number of singers ?" 也被排除
+    assert "select count(*) from singer" not in queries
+    # 其他数据库的相同 SQL 形态不受影响
+    assert "select count(*) from concert" in queries
+
+
+def test_exclude_sql_ignores_quoting_and_spacing(example_store):
+    selected = example_store.select("concerts in 2014", k=6,
+                                    exclude_sql=("concert", 'SELECT concert_name FROM concert WHERE year=2014;'))
+    assert all(example["query"] != "select concert_name from concert where year = 2014" for example in selected)
+    assert len(selected) == 5
+
+
+def test_example_questions_are_batched_outside_the_question_cache(counting_embeddings, store_dir):
+    store = EmbeddingStore(store_dir, counting_embeddings.model)
+    question_cache = QuestionEmbeddingCache(counting_embeddings, store=store)
+    loader = EmbeddingLoader(counting_embeddings, batch_size=4, max_concurrency=2)
+    example_store = ExampleStore(list(EXAMPLES), counting_embeddings, store=store, loader=loader,
+                                 question_cache=question_cache, ann_threshold=0)
+    # 示例问题分批走 embed_documents，不逐条调用 embed_query，也不进入查询问题的 LRU
+    assert counting_embeddings.queries == []
+    assert sorted(counting_embeddings.documents) == sorted(example["question"] for example in EXAMPLES)
+    assert question_cache.stats()["size"] == 0
+
+    example_store.select("How many singers do we have ?", k=1)
+    example_store.add(pair("stadium", "How many stadiums are there ?", "select count(*) from stadium"))
+    assert counting_embeddings.queries == ["How many singers do we have ?"]
+    assert len(counting_embeddings.documents) == len(EXAMPLES) + 1
+
+    # 重建时示例向量全部从磁盘读取
+    ExampleStore(list(EXAMPLES), counting_embeddings, store=EmbeddingStore(store_dir, counting_embeddings.model),
+                 loader=loader, question_cache=question_cache, ann_threshold=0)
+    assert len(counting_embeddings.documents) == len(EXAMPLES) + 1
+
+
+@pytest.mark.parametrize("ann_threshold", [0, 2])
+def test_add_example_is_searchable(embeddings, ann_threshold):
+    if ann_threshold and not faiss_available():
+        pytest.skip("需要 faiss-cpu")
+    example_store = ExampleStore(list(EXAMPLES), embeddings, ann_threshold=ann_threshold, ann_candidates=2)
+    selector = StoreExampleSelector(example_store, k=1)
+    selector.add_example({"input": "Database schema:\nstadium(...)\n\nUser question: Which stadium has the largest capacity?",
+                          "query": "select name from stadium order by capacity desc limit 1"})
+
+    assert len(example_store) == len(EXAMPLES) + 1
+    selected = selector.select_examples({"input": "Which stadium has the largest capacity?"})
+    assert selected[0]["query"] == "select name from stadium order by capacity desc limit 1"
+    assert selected[0]["input"].startswith("Database schema:")
+    # 追加的示例同样参与 leave-one-out
+    held_out = example_store.select("Which stadium has the largest capacity?", k=1, leave_one_out=True)
+    assert held_out[0]["query"] != "select name from stadium order by capacity desc limit 1"
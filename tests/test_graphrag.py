@@ -0,0 +1,274 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pytest
+
+from tests.conftest import CountingEmbeddings, make_entry, shop_entry
+from utils.embedding_store import EmbeddingStore
+from utils.graphrag import SchemaGraph
+from utils.text_utils import load_sql_pairs
+from utils.vector_index import faiss_available
+
+
+def wide_entry(n_tables: int = 30, n_columns: int = 12):
+    topics = ["customer", "payment", "region", "order", "invoice", "product", "supplier", "employee"]
+    tables = {}
+    for t in range(n_tables):
+        tables[f"table_{t}"] = ["id"] + [f"{topics[(t + c) % len(topics)]}_{c}" for c in range(n_columns)]
+    return make_entry("wide", tables, primary_keys=[(name, "id") for name in tables])
+
+
+@pytest.mark.skipif(not faiss_available(), reason="需要 faiss-cpu")
+def test_column_pruning_with_ann_index_matches_exact_scoring(embeddings, store_dir):
+    entry = wide_entry()
+    exact = SchemaGraph("wide", entry, embeddings, ann_threshold=0)
+    store = EmbeddingStore(store_dir, embeddings.model)
+    with_ann = SchemaGraph("wide", entry, embeddings, store=store, ann_threshold=10, ann_candidates=5)
+    # 只有表建 ANN 索引并落盘；列在检索到的表内精确打分，不建索引
+    assert with_ann.table_index is not None
+    assert not hasattr(with_ann, "column_index")
+    artifacts = os.listdir(store.artifact_path("ann"))
+    assert any("_tables_" in name for name in artifacts)
+    assert not any("_columns_" in name for name in artifacts)
+    assert np.allclose(with_ann.column_score_matrix(embeddings.embed_query("customer payment")),
+                       exact.column_score_matrix(embeddings.embed_query("customer payment")), atol=1e-2)
+
+    question = "which customer made the largest payment"
+    question_vec = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+    tables = ["table_0", "table_7", "table_13"]
+    expected = exact.get_schema_subgraph(tables, question_vec, max_columns=3, expand_hops=0)
+    assert with_ann.get_schema_subgraph(tables, question_vec, max_columns=3, expand_hops=0) == expected
+
+    # 保留下来的列就是该表中与问题最相似的列（主键额外保留）
+    pos = exact.table_position["table_0"]
+    start, end = exact.column_indptr[pos], exact.column_indptr[pos + 1]
+    query = exact._prepare_queries(question_vec, exact.column_matrix.shape[1])[0]
+    scores = exact.column_matrix[start:end] @ query
+    top = {exact.column_names[start + i] for i in np.argsort(-scores, kind="stable")[:3]}
+    kept = set(expected.splitlines()[0].split(": ", 1)[1].split(", "))
+    assert top | {"id"} == kept
+
+
+def make_retriever(tables_json, embeddings, **kwargs):
+    from utils.graphrag import GraphRAGRetriever
+
+    return GraphRAGRetriever(tables_json, cache_dir=None, embeddings=embeddings, **kwargs)
+
+
+def test_cached_result_is_flagged_and_drops_first_call_timings(tables_json, embeddings):
+    retriever = make_retriever(tables_json, embeddings)
+    question = "What is the total order amount of each customer?"
+    schema_text, first = retriever.retrieve_relevant_schema("shop", question, top_k=2)
+    assert first["cached"] is False
+    assert "embedding_ms" in first["timings"]
+
+    cached_text, cached = retriever.retrieve_relevant_schema("shop", question, top_k=2)
+    assert cached_text == schema_text
+    assert cached["cached"] is True
+    assert "timings" not in cached
+    assert cached["relevant_tables"] == first["relevant_tables"]
+
+
+def test_batch_and_single_retrieval_return_the_same_metadata_shape(tables_json, embeddings):
+    questions = [("shop", "Which products did each customer order?"),
+                 ("school", "List the names of all teachers and their subject.")]
+    batch = make_retriever(tables_json, embeddings, result_cache_size=0)
+    single = make_retriever(tables_json, embeddings, result_cache_size=0)
+
+    batch_results = batch.retrieve_relevant_schema_batch(questions, top_k=2)
+    for (db_id, question), (batch_text, batch_meta) in zip(questions, batch_results):
+        single_text, single_meta = single.retrieve_relevant_schema(db_id, question, top_k=2)
+        assert batch_text == single_text
+        assert set(batch_meta) == set(single_meta)
+        assert set(batch_meta["timings"]) == set(single_meta["timings"])
+        assert batch_meta["relevant_tables"] == single_meta["relevant_tables"]
+
+
+def brute_force_keyword_scores(graph, question):
+    """逐表逐列扫描的关键词打分（倒排索引实现之前的写法，作为对照）"""
+    question_lower = question.lower()
+    question_words = set(re.findall(r'\b\w+\b', question_lower))
+    scores = {}
+    for table_name, table_info in graph.tables.items():
+        score = 0.0
+        if table_name in question_lower:
+            score += 1.0
+        elif set(re.findall(r'\b\w+\b', table_name)) & question_words:
+            score += 0.7
+        column_scores = [0.8 if col in question_lower else 0.5
+                         for col in table_info['columns']
+                         if col in question_lower or set(re.findall(r'\b\w+\b', col)) & question_words]
+        scores[table_name] = score + max(column_scores, default=0.0)
+    max_score = max(scores.values()) or 1.0
+    return {name: score / max_score for name, score in scores.items()}
+
+
+def test_keyword_index_matches_brute_force_scoring(embeddings):
+    with open("test/tables.json", "r", encoding="utf-8") as f:
+        entries = {entry["db_id"]: entry for entry in json.load(f)}
+    pairs = [pair for pair in load_sql_pairs("test/dev.sql") if pair["db_id"] in entries][:300]
+    assert pairs
+
+    graphs = {}
+    for db_id in {pair["db_id"] for pair in pairs}:
+        graphs[db_id] = SchemaGraph(db_id, entries[db_id], embeddings, defer_embeddings=True)
+    for pair in pairs:
+        graph = graphs[pair["db_id"]]
+        expected = brute_force_keyword_scores(graph, pair["question"])
+        scores = graph._compute_keyword_scores(pair["question"])
+        batch = graph.keyword_score_matrix([pair["question"]])[0]
+        assert scores == pytest.approx(expected)
+        assert dict(zip(graph.table_names, batch.tolist())) == pytest.approx(expected)
+
+
+def test_hybrid_scores_match_per_table_loop(embeddings):
+    graph = SchemaGraph("shop", shop_entry(), embeddings)
+    question = "What is the total order amount of each customer?"
+    _, scores = graph.get_relevant_tables_hybrid(question, top_k=3, fk_factor=0)
+
+    keyword_scores = graph._compute_keyword_scores(question)
+    question_vec = np.asarray(embeddings.embed_query(question))
+    for table_name, text in zip(graph.table_names, graph.table_texts()):
+        table_vec = np.asarray(embeddings.embed_documents([text])[0])
+        cosine = table_vec @ question_vec / np.linalg.norm(table_vec) / np.linalg.norm(question_vec)
+        assert scores[table_name] == pytest.approx(0.4 * keyword_scores[table_name] + 0.6 * cosine, abs=1e-5)
+
+
+def test_rank_tables_batch_matches_single_question_ranking(embeddings):
+    graph = SchemaGraph("shop", shop_entry(), embeddings)
+    questions = ["Which products did each customer order?", "List staff in each department", "cities"]
+    vecs = np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+    for question, vec, (tables, scores) in zip(questions, vecs, graph.rank_tables_batch(questions, vecs, top_k=3)):
+        single_tables, single_scores = graph.get_relevant_tables_hybrid(question, top_k=3, question_vec=vec)
+        assert tables == single_tables
+        assert scores == pytest.approx(single_scores, abs=1e-6)
+
+
+def chain_graph(embeddings, n_tables=4):
+    """t0 - t1 - t2 - t3 的外键链"""
+    tables = {f"t{i}": [f"t{i}_id", f"t{i + 1}_id"] for i in range(n_tables)}
+    foreign_keys = [(f"t{i}", f"t{i + 1}_id", f"t{i + 1}", f"t{i + 1}_id") for i in range(n_tables - 1)]
+    return SchemaGraph("chain", make_entry("chain", tables, foreign_keys=foreign_keys), embeddings)
+
+
+def test_fk_propagation_decays_per_hop(embeddings):
+    graph = chain_graph(embeddings)
+    scores = np.array([1.0, 0.0, 0.0, 0.2], dtype=np.float32)
+    assert graph.propagate_scores(scores, factor=0.5, hops=1) == pytest.approx([1.0, 0.5, 0.1, 0.2])
+    assert graph.propagate_scores(scores, factor=0.5, hops=2) == pytest.approx([1.0, 0.5, 0.25, 0.2])
+    assert graph.propagate_scores(scores, factor=0, hops=2) == pytest.approx(scores)
+
+    # 批量 (n_questions, n_tables) 与逐行结果一致
+    batch = np.stack([scores, scores[::-1]])
+    expected = [graph.propagate_scores(row, factor=0.5, hops=2) for row in batch]
+    assert graph.propagate_scores(batch, factor=0.5, hops=2) == pytest.approx(np.stack(expected))
+
+
+def test_expand_neighbors_follows_hops(embeddings):
+    graph = chain_graph(embeddings)
+    assert graph.expand_neighbors(["t0"], hops=1) == ["t1"]
+    assert graph.expand_neighbors(["t0", "t3"], hops=1) == ["t1", "t2"]
+    assert graph.expand_neighbors(["t0"], hops=2) == ["t1", "t2"]
+
+
+def test_join_path_completion_adds_bridge_tables(embeddings):
+    graph = SchemaGraph("shop", shop_entry(), embeddings)
+    assert graph.complete_join_paths(["customer", "product"]) == ["orders"]
+    assert graph.complete_join_paths(["customer", "orders"]) == []
+    # staff / department 与订单子图不连通：不补全
+    assert graph.complete_join_paths(["customer", "department"]) == []
+
+    chain = chain_graph(embeddings, n_tables=5)
+    assert chain.complete_join_paths(["t0", "t2", "t4"]) == ["t1", "t3"]
+    # 结果按终端集合缓存
+    assert chain._join_path_cache.get((0, 2, 4)) == ("t1", "t3")
+
+
+def test_compact_graph_keeps_compatibility_views(embeddings):
+    graph = SchemaGraph("shop", shop_entry(), embeddings)
+    assert graph.table_columns("orders") == ["order_id", "customer_id", "product_id", "amount", "order_date"]
+    assert graph.tables["customer"]["columns"] == ["customer_id", "name", "city"]
+    assert {(fk["from_table"], fk["to_table"]) for fk in graph.foreign_keys} == {
+        ("orders", "customer"), ("orders", "product"), ("staff", "department")}
+    assert graph.key_columns["orders"] == {"order_id", "customer_id", "product_id"}
+    assert graph.column_keys[:3] == [("customer", "customer_id"), ("customer", "name"), ("customer", "city")]
+
+    nx_graph = graph.to_networkx()
+    fk_edges = [edge for edge in nx_graph.edges(data=True) if edge[2]["relation"] == "foreign_key"]
+    assert len(fk_edges) == 3
+    assert graph.fk_adjacency.nnz == 6
+
+
+def test_hierarchical_retrieval_with_all_clusters_matches_flat_ranking(embeddings):
+    entry = wide_entry(n_tables=40)
+    flat = SchemaGraph("wide", entry, embeddings)
+    hierarchical = SchemaGraph("wide", entry, embeddings, hierarchical_threshold=10, n_clusters=6)
+    assert hierarchical.hierarchical
+    assert sorted(hierarchical.cluster_members.tolist()) == list(range(40))
+
+    question = "total payment per customer region"
+    question_vec = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+    expected, _ = flat.get_relevant_tables_hybrid(question, top_k=5, question_vec=question_vec)
+    timings = {}
+    tables, scores = hierarchical.get_relevant_tables_hierarchical(
+        question, top_k=5, question_vec=question_vec, top_clusters=6, timings=timings)
+    assert tables == expected
+    assert set(timings) == {"clusters_ms", "tables_ms"}
+
+    # 只保留一个簇时，候选表 = 该簇的表 + 有关键词命中的表
+    _, narrow_scores = hierarchical.get_relevant_tables_hierarchical(
+        question, top_k=5, question_vec=question_vec, top_clusters=1)
+    assert len(narrow_scores) < len(scores) == 40
+
+
+def test_retriever_loads_lazily_and_evicts_by_memory(tables_json, embeddings):
+    retriever = make_retriever(tables_json, embeddings, lazy=True, max_memory_mb=1e-6)
+    assert len(retriever.schema_graphs) == 0
+
+    shop = retriever.get_schema_graph("shop")
+    assert retriever.get_schema_graph("shop") is shop
+    retriever.get_schema_graph("school")
+    # 超出内存上限：最久未用的 shop 被淘汰，再次访问时重新构建
+    assert retriever.schema_graphs.keys() == ["school"]
+    assert retriever.get_schema_graph("shop") is not shop
+    assert retriever.get_schema_graph("missing") is None
+
+
+def test_slow_build_of_one_database_does_not_block_others(tables_json):
+    class BlockingEmbeddings(CountingEmbeddings):
+        """shop 的 schema 文本在 release 之前一直阻塞"""
+
+        def __init__(self):
+            super().__init__()
+            self.started, self.release = threading.Event(), threading.Event()
+
+        def embed_documents(self, texts):
+            if any("customer" in text for text in texts):
+                self.started.set()
+                assert self.release.wait(timeout=10)
+            return super().embed_documents(texts)
+
+    embeddings = BlockingEmbeddings()
+    retriever = make_retriever(tables_json, embeddings, lazy=True)
+    results = []
+    builders = [threading.Thread(target=lambda: results.append(retriever.get_schema_graph("shop")))
+                for _ in range(2)]
+    for builder in builders:
+        builder.start()
+    assert embeddings.started.wait(timeout=10)
+    try:
+        # shop 构建阻塞期间 school 照常构建
+        assert retriever.get_schema_graph("school") is not None
+    finally:
+        embeddings.release.set()
+        for builder in builders:
+            builder.join(timeout=10)
+
+    # 并发访问同一数据库只构建一次，构建结束后不残留锁
+    assert len(results) == 2 and results[0] is results[1]
+    school = retriever.get_schema_graph("school")
+    assert len(embeddings.documents) == len(results[0].embedding_texts()) + len(school.embedding_texts())
+    assert retriever._db_build_locks == {}
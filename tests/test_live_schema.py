@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from utils import live_schema
+from utils.graphrag import GraphRAGRetriever
+
+
+def create_sqlite(path):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE singer (singer_id INTEGER PRIMARY KEY, name TEXT, birthDate DATE)"))
+        conn.execute(text("CREATE TABLE concert (concert_id INTEGER PRIMARY KEY, year INTEGER)"))
+        conn.execute(text(
+            "CREATE TABLE singer_in_concert (concert_id INTEGER REFERENCES concert(concert_id), "
+            "singer_id INTEGER REFERENCES singer(singer_id), PRIMARY KEY (concert_id, singer_id))"))
+    return engine
+
+
+def test_reflect_entry_matches_tables_json_layout(tmp_path):
+    engine = create_sqlite(tmp_path / "concert_singer.sqlite")
+    entry = live_schema.reflect_entry(engine, "concert_singer")
+
+    assert entry["table_names_original"] == ["concert", "singer", "singer_in_concert"]
+    assert entry["column_names_original"][0] == [-1, "*"]
+    names = {i: tuple(column) for i, column in enumerate(entry["column_names_original"])}
+    assert [1, "birth date"] in entry["column_names"]
+    assert entry["column_types"][entry["column_names_original"].index([1, "singer_id"])] == "number"
+    # 联合主键保留为列表
+    composite = [pk for pk in entry["primary_keys"] if isinstance(pk, list)]
+    assert [[names[i][1] for i in pk] for pk in composite] == [["concert_id", "singer_id"]]
+    fks = {(names[src][1], entry["table_names_original"][names[dst][0]]) for src, dst in entry["foreign_keys"]}
+    assert fks == {("concert_id", "concert"), ("singer_id", "singer")}
+
+
+def test_load_live_entry_uses_cache_until_schema_changes(tmp_path, monkeypatch):
+    engine = create_sqlite(tmp_path / "db.sqlite")
+    cache_dir = str(tmp_path / "cache")
+    first = live_schema.load_live_entry(engine, cache_dir=cache_dir)
+
+    calls = []
+    original = live_schema.reflect_entry
+    monkeypatch.setattr(live_schema, "reflect_entry", lambda *args: calls.append(args) or original(*args))
+    assert live_schema.load_live_entry(engine, cache_dir=cache_dir) == first
+    assert calls == []
+
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE concert ADD COLUMN theme TEXT"))
+    changed = live_schema.load_live_entry(engine, cache_dir=cache_dir)
+    assert len(calls) == 1
+    assert [0, "theme"] in changed["column_names_original"]
+
+
+def test_slow_reflection_does_not_block_other_databases(tmp_path, monkeypatch, embeddings):
+    retriever = GraphRAGRetriever(None, cache_dir=None, embeddings=embeddings)
+    monkeypatch.setattr(live_schema, "get_shared_retriever", lambda path: retriever)
+    monkeypatch.setattr(live_schema, "load_graphrag_config", lambda: {"schema_check_interval": 60})
+    slow_url = f"sqlite:///{tmp_path / 'slow.sqlite'}"
+    fast_url = f"sqlite:///{tmp_path / 'fast.sqlite'}"
+    create_sqlite(tmp_path / "slow.sqlite")
+    create_sqlite(tmp_path / "fast.sqlite")
+
+    release = threading.Event()
+    started = threading.Event()
+    original = live_schema.register_live_database
+
+    def register(retriever, engine, db_id=None, schemas=None, force=False):
+        if db_id == "slow":
+            started.set()
+            release.wait(5)
+        return original(retriever, engine, db_id, schemas, force)
+
+    monkeypatch.setattr(live_schema, "register_live_database", register)
+    slow = threading.Thread(target=live_schema.get_live_retriever, args=(slow_url, "slow", []))
+    slow.start()
+    try:
+        assert started.wait(5)
+        start = time.monotonic()
+        _, db_id = live_schema.get_live_retriever(fast_url, "fast", [])
+        assert db_id == "fast"
+        assert time.monotonic() - start < 2
+    finally:
+        release.set()
+        slow.join()
+    assert {"slow", "fast"} <= set(retriever._entries)
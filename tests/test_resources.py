@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from agent import resources
+from utils import graphrag
+from utils.embedding_store import get_shared_question_cache
+
+EXAMPLES = [
+    {"input": "Database schema:\nsinger(singer_id, name, age)\n\nUser question: How many singers do we have?",
+     "query": "SELECT count(*) FROM singer"},
+    {"input": "Database schema:\nconcert(concert_id, year)\n\nUser question: List the concerts held in 2014.",
+     "query": "SELECT * FROM concert WHERE year = 2014"},
+    {"input": "Database schema:\nstadium(stadium_id, capacity)\n\nUser question: Which stadium is the largest?",
+     "query": "SELECT name FROM stadium ORDER BY capacity DESC LIMIT 1"},
+]
+
+
+@pytest.fixture
+def configured(tmp_path, monkeypatch, counting_embeddings):
+    """用临时缓存目录与计数 Embedding 替换 config.yaml；构建 GraphRAG 检索器即失败"""
+    config = {"graphrag": {"cache_dir": str(tmp_path / "cache")}, "few_shot": {}}
+    monkeypatch.setattr(resources, "load_config", lambda config_path="config.yaml": config)
+    monkeypatch.setattr(graphrag, "get_shared_retriever",
+                        lambda *args, **kwargs: pytest.fail("示例选择不应构建 GraphRAG 检索器"))
+    factory = resources._factories["embeddings"]
+    resources.register("embeddings", lambda: counting_embeddings)
+    yield config
+    resources.register("embeddings", factory)
+
+
+def test_example_selector_persists_index_and_embeds_only_questions(configured, counting_embeddings):
+    pytest.importorskip("langchain_community.vectorstores")
+    selector = resources.example_selector(EXAMPLES, k=1)
+    # 只嵌入问题部分（哈希后端对称，示例问题分块走 embed_documents）
+    assert sorted(counting_embeddings.documents + counting_embeddings.queries) == [
+        "How many singers do we have?", "List the concerts held in 2014.", "Which stadium is the largest?"]
+    selected = selector.select_examples({"input": "Database schema:\n...\n\nUser question: Count the singers."})
+    assert selected == [EXAMPLES[0]]
+
+    # 重启后（内存中的问题向量缓存也清空）直接 load_local，不再计算示例向量
+    cache = resources.question_cache()
+    cache._cache.clear()
+    cache.store = None
+    calls = len(counting_embeddings.queries)
+    reloaded = resources.example_selector(EXAMPLES, k=1)
+    assert len(counting_embeddings.queries) == calls
+    assert reloaded.select_examples({"input": "User question: Count the singers."}) == [EXAMPLES[0]]
+
+
+def test_question_cache_is_shared_with_graphrag(configured, counting_embeddings):
+    store = resources.embedding_store()
+    assert store is graphrag.get_shared_embedding_store(configured["graphrag"]["cache_dir"],
+                                                        counting_embeddings.model)
+    assert resources.question_cache() is get_shared_question_cache(counting_embeddings, store=store)
+
+
+def test_mined_example_selector_does_not_need_the_retriever(configured, tmp_path, counting_embeddings):
+    source = tmp_path / "examples.sql"
+    source.write_text("Question 1:  How many singers do we have ? ||| concert_singer\n"
+                      "SQL:  SELECT count(*) FROM singer\n"
+                      "Question 2:  List all airlines . ||| flight_2\n"
+                      "SQL:  SELECT airline FROM airlines\n", encoding="utf-8")
+    configured["few_shot"] = {"source": str(source), "k": 1}
+
+    selector = resources.mined_example_selector(k=3)
+    assert selector.select_examples({"input": "User question: Show every airline"}) == [
+        {"input": "List all airlines .", "query": "SELECT airline FROM airlines"}]
+
+
+def test_registry_builds_lazily_once_and_resets():
+    calls = []
+    resources.register("test.resource", lambda: calls.append(1) or object())
+    try:
+        assert not resources.is_initialized("test.resource")
+        first = resources.get("test.resource")
+        assert resources.get("test.resource") is first and calls == [1]
+
+        resources.reset("test.resource")
+        assert resources.get("test.resource") is not first and calls == [1, 1]
+
+        module_getattr = resources.module_getattr("agent.fake", {"thing": "test.resource"})
+        assert module_getattr("thing") is resources.get("test.resource")
+        with pytest.raises(AttributeError):
+            module_getattr("other")
+        with pytest.raises(KeyError):
+            resources.get("test.missing")
+    finally:
+        with resources._registry_lock:
+            resources._factories.pop("test.resource", None)
+            resources._instances.pop("test.resource", None)
+            resources._locks.pop("test.resource", None)
+
+
+def test_concurrent_first_access_constructs_once():
+    calls = []
+
+    def factory():
+        time.sleep(0.01)
+        calls.append(1)
+        return object()
+
+    resources.register("test.slow", factory)
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(resources.get("test.slow"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert calls == [1] and len({id(result) for result in results}) == 1
+    finally:
+        with resources._registry_lock:
+            resources._factories.pop("test.slow", None)
+            resources._instances.pop("test.slow", None)
+            resources._locks.pop("test.slow", None)
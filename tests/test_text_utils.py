@@ -0,0 +1,26 @@
+import numpy as np
+
+from utils.text_utils import load_sql_pairs
+from utils.vector_index import normalize_rows
+
+
+def test_load_sql_pairs_strips_semicolons_and_skips_orphan_sql(tmp_path):
+    path = tmp_path / "dev.sql"
+    path.write_text(
+        "SQL: select 1;\n"
+        "Question 1:  How many singers do we have ? ||| concert_singer\n"
+        "SQL:  SELECT count(*) FROM singer;\n"
+        "\n"
+        "Question 2:  List all airlines . ||| flight_2\n"
+        "SQL:  SELECT airline FROM airlines\n",
+        encoding="utf-8")
+    assert load_sql_pairs(str(path)) == [
+        {"db_id": "concert_singer", "question": "How many singers do we have ?",
+         "query": "SELECT count(*) FROM singer"},
+        {"db_id": "flight_2", "question": "List all airlines .", "query": "SELECT airline FROM airlines"},
+    ]
+
+
+def test_normalize_rows_keeps_zero_rows():
+    matrix = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32))
+    assert np.allclose(matrix, [[0.6, 0.8], [0.0, 0.0]])
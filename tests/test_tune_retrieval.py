@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("streamlit")
+
+from benchmark_retrieval import collect_tables
+from process_sql import Schema as SchemaFromProcess, get_sql
+from tune_retrieval import parse_ints, precompute, stable_ranks, sweep
+from utils.graphrag import GraphRAGRetriever
+from utils.schema_utils import get_schemas_from_json
+from utils.text_utils import load_sql_pairs
+
+TABLES_JSON = "test/tables.json"
+DBS = ["concert_singer", "pets_1"]
+
+
+def test_parse_ints_and_stable_ranks():
+    assert parse_ints("1-3, 5") == [1, 2, 3, 5]
+    assert stable_ranks(np.array([[0.2, 0.5, 0.2]])).tolist() == [[1, 0, 2]]
+
+
+def test_sweep_matches_direct_ranking(embeddings):
+    schemas, _, _ = get_schemas_from_json(TABLES_JSON)
+    pairs = load_sql_pairs("test/dev.sql")
+    examples = [pair for db_id in DBS for pair in [pair for pair in pairs if pair["db_id"] == db_id][:20]]
+    retriever = GraphRAGRetriever(TABLES_JSON, db_filter=DBS, cache_dir=None, embeddings=embeddings)
+    groups, skipped = precompute(retriever, examples, schemas)
+    keyword_weights, fk_factors, fk_hops, top_ks = [0.0, 0.4], [0.0, 0.3], [1, 2], [1, 2, 3]
+    recall, perfect, n_questions = sweep(groups, keyword_weights, fk_factors, fk_hops, top_ks)
+    assert n_questions + skipped == len(examples)
+    assert recall.shape == perfect.shape == (2, 2, 2, 3)
+
+    # 与逐库调用 rank_tables_batch（检索时的排序路径）得到的召回一致
+    by_db = {}
+    for example in examples:
+        try:
+            gold = collect_tables(get_sql(SchemaFromProcess(schemas[example["db_id"]]), example["query"]))
+        except Exception:
+            continue
+        if gold:
+            questions, golds = by_db.setdefault(example["db_id"], ([], []))
+            questions.append(example["question"])
+            golds.append(gold)
+    labeled = [(retriever.get_schema_graph(db_id), questions, golds)
+               for db_id, (questions, golds) in by_db.items()]
+    for w_idx, keyword_weight in enumerate(keyword_weights):
+        for f_idx, factor in enumerate(fk_factors):
+            for h_idx, hops in enumerate(fk_hops):
+                for k_idx, top_k in enumerate(top_ks):
+                    recalls = []
+                    for graph, questions, gold_tables in labeled:
+                        vecs = np.vstack(retriever.question_cache.embed_many(questions))
+                        ranked = graph.rank_tables_batch(questions, vecs, top_k=top_k,
+                                                         keyword_weight=keyword_weight,
+                                                         embedding_weight=1 - keyword_weight,
+                                                         fk_factor=factor, fk_hops=hops)
+                        recalls.extend(len(set(tables) & gold) / len(gold)
+                                       for (tables, _), gold in zip(ranked, gold_tables))
+                    assert recall[w_idx, f_idx, h_idx, k_idx] == pytest.approx(np.mean(recalls))
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from utils.vector_index import VectorIndex, faiss_available, normalize_rows
+
+pytestmark = pytest.mark.skipif(not faiss_available(), reason="需要 faiss-cpu")
+
+
+def random_matrix(n, dim=32, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32))
+
+
+@pytest.mark.parametrize("n, kind", [(50, "IndexFlatIP"), (300, "IndexHNSWFlat"), (2000, "IndexIVFFlat")])
+def test_build_picks_index_type_and_finds_exact_matches(n, kind):
+    matrix = random_matrix(n)
+    index = VectorIndex.build(matrix, flat_threshold=100, ivf_threshold=1000)
+    assert type(index.index).__name__ == kind
+
+    sims, ids = index.search(matrix[:5], k=3)
+    assert ids[:, 0].tolist() == [0, 1, 2, 3, 4]
+    assert sims[:, 0] == pytest.approx(np.ones(5), abs=1e-4)
+
+
+def test_search_caps_k_and_add_appends_rows():
+    index = VectorIndex.build(random_matrix(4))
+    assert index.search(random_matrix(1, seed=1), k=10)[1].shape == (1, 4)
+
+    extra = random_matrix(2, seed=2)
+    index.add(extra)
+    assert index.size == 6
+    assert index.search(extra, k=1)[1][:, 0].tolist() == [4, 5]
+
+
+def test_load_or_build_reuses_saved_index_of_the_same_size(tmp_path, monkeypatch):
+    path = str(tmp_path / "ann" / "table.faiss")
+    matrix = random_matrix(20)
+    VectorIndex.load_or_build(matrix, path)
+
+    monkeypatch.setattr(VectorIndex, "build", classmethod(lambda cls, *args, **kwargs: pytest.fail("不应重建")))
+    assert VectorIndex.load_or_build(matrix, path).size == 20
+    assert VectorIndex.load(str(tmp_path / "missing.faiss")) is None
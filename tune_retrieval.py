@@ -0,0 +1,264 @@
+"""
+GraphRAG 混合检索参数的离线网格搜索
+对 test/dev.sql 的全部问题只计算一次关键词分数矩阵与 Embedding 相似度矩阵（来自 Embedding 磁盘缓存），
+随后以纯 NumPy 运算遍历 keyword_weight / embedding_weight / fk_propagation_factor / fk_hops / top_k 网格，
+输出可直接粘贴进 config.yaml 的最优 graphrag 配置块。
+
+默认只读缓存、不发起任何网络请求：缓存未命中时报错，先运行一次 benchmark_retrieval.py
+（或加 --embed-missing）即可把问题与 Schema 向量写入缓存。
+
+用法：
+    python tune_retrieval.py
+    python tune_retrieval.py --fk-factors 0,0.2,0.4 --top-k 1-8 --target-recall 0.97 --output logs/tuned.yaml
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import yaml
+from langchain_core.embeddings import Embeddings
+
+from benchmark_retrieval import collect_tables
+from process_sql import Schema as SchemaFromProcess, get_sql
+from utils.embedding_loader import EmbeddingLoader
+from utils.embedding_store import embedding_model_name
+from utils.embeddings import get_embeddings
+from utils.graphrag import GraphRAGRetriever, SchemaGraph, retriever_options
+from utils.schema_utils import get_schemas_from_json
+from utils.text_utils import load_sql_pairs
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCacheMiss(LookupError):
+    """只读缓存模式下 Embedding 缓存未命中（EmbeddingLoader 不会重试此类错误）"""
+
+
+class CacheOnlyEmbeddings(Embeddings):
+    """只读缓存模式：保留原模型名（缓存命名空间一致），任何 Embedding 请求都直接报错"""
+
+    def __init__(self, embeddings: Embeddings):
+        self.model = embedding_model_name(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise EmbeddingCacheMiss(f"Embedding 缓存未命中 {len(texts)} 条（模型 {self.model}），"
+                           f"请先运行 benchmark_retrieval.py 或使用 --embed-missing")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def parse_floats(value: str) -> List[float]:
+    return [float(item) for item in value.split(",") if item.strip()]
+
+
+def parse_ints(value: str) -> List[int]:
+    """解析 "1,3,5" 或 "1-10" 形式的整数列表"""
+    result = []
+    for item in value.split(","):
+        item = item.strip()
+        if "-" in item:
+            low, high = item.split("-", 1)
+            result.extend(range(int(low), int(high) + 1))
+        elif item:
+            result.append(int(item))
+    return result
+
+
+def stable_ranks(scores: np.ndarray) -> np.ndarray:
+    """每行分数降序的名次（0 起），同分按表序号先后，与 rank_tables_batch 的稳定排序一致"""
+    order = np.argsort(-scores, axis=-1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.broadcast_to(np.arange(scores.shape[-1]), scores.shape), axis=-1)
+    return ranks
+
+
+def precompute(retriever: GraphRAGRetriever,
+               examples: List[Dict[str, str]],
+               schemas: Dict[str, Dict]) -> Tuple[List[Tuple], int]:
+    """
+    按数据库汇总 (图, 关键词分数矩阵, 相似度矩阵, 标准表掩码, 标准表数量)
+
+    Returns:
+        (各数据库的打分数据, 无法解析而跳过的题目数)
+    """
+    by_db: Dict[str, List[Tuple[str, set]]] = {}
+    skipped = 0
+    for example in examples:
+        db_id = example["db_id"]
+        try:
+            gold_tables = collect_tables(get_sql(SchemaFromProcess(schemas[db_id]), example["query"]))
+        except Exception as e:
+            logger.warning(f"[跳过] 无法解析标准 SQL ({db_id}): {str(e)}")
+            skipped += 1
+            continue
+        if gold_tables:
+            by_db.setdefault(db_id, []).append((example["question"], gold_tables))
+
+    groups = []
+    for db_id, items in by_db.items():
+        graph: SchemaGraph = retriever.get_schema_graph(db_id)
+        if graph is None:
+            skipped += len(items)
+            continue
+        questions = [question for question, _ in items]
+        vecs = retriever.question_cache.lookup_many(questions)
+        missing = sum(vec is None for vec in vecs)
+        if missing:
+            vecs = retriever.question_cache.embed_many(questions)
+        keyword_scores = graph.keyword_score_matrix(questions).astype(np.float32)
+        similarities = graph.embedding_score_matrix(np.vstack(vecs)).astype(np.float32)
+        gold_mask = np.zeros(keyword_scores.shape, dtype=bool)
+        gold_counts = np.zeros(len(items), dtype=np.float32)
+        for i, (_, gold_tables) in enumerate(items):
+            gold_counts[i] = len(gold_tables)
+            for table in gold_tables:
+                if table in graph.table_position:
+                    gold_mask[i, graph.table_position[table]] = True
+        groups.append((graph, keyword_scores, similarities, gold_mask, gold_counts))
+    return groups, skipped
+
+
+def sweep(groups: List[Tuple], keyword_weights: List[float], fk_factors: List[float],
+          fk_hops_grid: List[int], top_ks: List[int]) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    遍历网格，embedding_weight = 1 - keyword_weight（加权和整体缩放不改变排序）
+
+    Returns:
+        (平均召回, 全部命中率)，形状均为 (n_keyword_weights, n_fk_factors, n_fk_hops, n_top_k)，以及题目数
+    """
+    kw = np.asarray(keyword_weights, dtype=np.float32)[:, None, None]
+    ks = np.asarray(top_ks)
+    shape = (len(keyword_weights), len(fk_factors), len(fk_hops_grid), len(top_ks))
+    recall_sum = np.zeros(shape)
+    perfect_sum = np.zeros(shape)
+    n_questions = 0
+
+    for graph, keyword_scores, similarities, gold_mask, gold_counts in groups:
+        n_q, n_t = keyword_scores.shape
+        n_questions += n_q
+        hybrid = (kw * keyword_scores[None] + (1 - kw) * similarities[None]).reshape(-1, n_t)
+        gold = np.broadcast_to(gold_mask[None], (len(keyword_weights), n_q, n_t)).reshape(-1, n_t)
+        for f_idx, factor in enumerate(fk_factors):
+            for h_idx, hops in enumerate(fk_hops_grid):
+                ranks = stable_ranks(graph.propagate_scores(hybrid, factor=factor, hops=hops))
+                # 非标准表的名次置为无穷大，统计每个 (问题, k) 下 top_k 内命中的标准表数量
+                gold_ranks = np.where(gold, ranks, np.iinfo(ranks.dtype).max)
+                hits = (gold_ranks[:, :, None] < ks[None, None, :]).sum(axis=1)
+                hits = hits.reshape(len(keyword_weights), n_q, len(top_ks))
+                recall_sum[:, f_idx, h_idx, :] += (hits / gold_counts[None, :, None]).sum(axis=1)
+                perfect_sum[:, f_idx, h_idx, :] += (hits == gold_counts[None, :, None]).sum(axis=1)
+
+    n = max(n_questions, 1)
+    return recall_sum / n, perfect_sum / n, n_questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GraphRAG 混合检索参数的离线网格搜索")
+    parser.add_argument("--config", default="config.yaml", help="配置文件路径")
+    parser.add_argument("--dev", default="test/dev.sql", help="dev.sql 路径")
+    parser.add_argument("--tables", default=None, help="tables.json 路径，默认读取 database.tables_json_path")
+    parser.add_argument("--dbs", default=None, help="只使用这些数据库的问题（逗号分隔）")
+    parser.add_argument("--kw-step", type=float, default=0.05, help="keyword_weight 在 [0, 1] 上的步长")
+    parser.add_argument("--fk-factors", default="0,0.1,0.2,0.3,0.4,0.5", help="外键传播衰减系数网格")
+    parser.add_argument("--fk-hops", default="1,2", help="外键传播跳数网格")
+    parser.add_argument("--top-k", default="1-10", help="top_k 网格，如 1-10 或 3,5,8")
+    parser.add_argument("--metric", choices=("recall", "perfect"), default="recall",
+                        help="优化目标：平均召回率，或标准表全部命中的题目比例")
+    parser.add_argument("--target-recall", type=float, default=0.95,
+                        help="选取目标指标达到该值的最小 top_k（都达不到时取最大 top_k）")
+    parser.add_argument("--embed-missing", action="store_true", help="允许为缓存未命中的文本调用 Embedding 接口")
+    parser.add_argument("--output", default="logs/tuned_graphrag.yaml", help="最优配置块的输出路径")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    graphrag_config = config.get("graphrag", {}) or {}
+    tables_json_path = args.tables or config.get("database", {}).get("tables_json_path", "test/tables.json")
+
+    examples = load_sql_pairs(args.dev)
+    if args.dbs:
+        db_filter = {db.strip() for db in args.dbs.split(",") if db.strip()}
+        examples = [example for example in examples if example["db_id"] in db_filter]
+    schemas, _, _ = get_schemas_from_json(tables_json_path)
+    examples = [example for example in examples if example["db_id"] in schemas]
+
+    embedding_config = config.get("embeddings", {}) or {}
+    embeddings = get_embeddings(embedding_config)
+    if not args.embed_missing:
+        embeddings = CacheOnlyEmbeddings(embeddings)
+        # 缓存未命中不是暂时性错误，不做退避重试，立即报错
+        embedding_config = dict(embedding_config, max_retries=0)
+
+    start = time.perf_counter()
+    options = retriever_options(graphrag_config)
+    options.update(result_cache_size=0, ann_threshold=0, hierarchical_threshold=0)
+    retriever = GraphRAGRetriever(
+        tables_json_path,
+        db_filter=sorted({example["db_id"] for example in examples}),
+        cache_dir=graphrag_config.get("cache_dir", ".cache/graphrag"),
+        embeddings=embeddings,
+        embedding_loader=EmbeddingLoader.from_config(embeddings, embedding_config),
+        **options
+    )
+    groups, skipped = precompute(retriever, examples, schemas)
+    precompute_seconds = time.perf_counter() - start
+
+    keyword_weights = [round(w, 4) for w in np.arange(0, 1 + 1e-9, args.kw_step)]
+    fk_factors = parse_floats(args.fk_factors)
+    fk_hops_grid = parse_ints(args.fk_hops)
+    top_ks = parse_ints(args.top_k)
+
+    start = time.perf_counter()
+    recall, perfect, n_questions = sweep(groups, keyword_weights, fk_factors, fk_hops_grid, top_ks)
+    sweep_seconds = time.perf_counter() - start
+    objective = recall if args.metric == "recall" else perfect
+
+    # 每个 top_k 下的最优 (keyword_weight, fk_factor, fk_hops)
+    print("=" * 80)
+    print(f"GraphRAG 检索参数网格搜索（{n_questions} 题，跳过 {skipped}；"
+          f"预计算 {precompute_seconds:.1f}s，搜索 {sweep_seconds:.2f}s，"
+          f"{objective.size} 组参数）")
+    print("=" * 80)
+    print(f"  {'top_k':>5} | {'keyword':>7} | {'embedding':>9} | {'fk_factor':>9} | {'fk_hops':>7} | "
+          f"{'Recall':>6} | {'全部命中':>8}")
+    best_per_k = []
+    for k_idx, top_k in enumerate(top_ks):
+        w_idx, f_idx, h_idx = np.unravel_index(np.argmax(objective[..., k_idx]), objective.shape[:3])
+        best_per_k.append((top_k, w_idx, f_idx, h_idx))
+        print(f"  {top_k:>5} | {keyword_weights[w_idx]:>7.2f} | {1 - keyword_weights[w_idx]:>9.2f} | "
+              f"{fk_factors[f_idx]:>9.2f} | {fk_hops_grid[h_idx]:>7} | "
+              f"{recall[w_idx, f_idx, h_idx, k_idx]:>6.3f} | {perfect[w_idx, f_idx, h_idx, k_idx]:>8.3f}")
+
+    chosen = next(((k_idx, item) for k_idx, item in enumerate(best_per_k)
+                   if objective[item[1], item[2], item[3], k_idx] >= args.target_recall),
+                  (len(best_per_k) - 1, best_per_k[-1]))
+    k_idx, (top_k, w_idx, f_idx, h_idx) = chosen
+    best = {
+        "top_k_tables": int(top_k),
+        "keyword_weight": float(keyword_weights[w_idx]),
+        "embedding_weight": float(round(1 - keyword_weights[w_idx], 4)),
+        "fk_propagation_factor": float(fk_factors[f_idx]),
+        "fk_hops": int(fk_hops_grid[h_idx]),
+    }
+
+    header = (f"# tune_retrieval.py: {n_questions} 题, metric={args.metric}, target={args.target_recall}\n"
+              f"# Recall@{top_k}={recall[w_idx, f_idx, h_idx, k_idx]:.4f}, "
+              f"全部命中={perfect[w_idx, f_idx, h_idx, k_idx]:.4f}\n")
+    block = header + yaml.safe_dump({"graphrag": best}, allow_unicode=True, sort_keys=False)
+    print("-" * 80)
+    print(block)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(block)
+    print(f"最优配置已写入 {args.output}（合并到 config.yaml 的 graphrag 段即可生效）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+通用进程内缓存
+线程安全的 LRU 缓存，支持按条目数或按权重（如内存占用）淘汰，以及可选的过期时间（TTL）
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, List, Optional, Tuple
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存"""
+
+    def __init__(self, maxsize: Optional[int] = None,
+                 max_weight: Optional[float] = None,
+                 weigh: Optional[Callable[[Any], float]] = None,
+                 ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: 最大条目数，None 表示不限制
+            max_weight: 最大总权重，None 表示不限制
+            weigh: 计算单个条目权重的函数（默认每条权重为 1）
+            ttl: 条目写入后的有效期（秒），None 表示永不过期
+        """
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.weigh = weigh or (lambda value: 1)
+        self.ttl = ttl
+        # key -> (value, weight, 过期时刻)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, float]]" = OrderedDict()
+        self._total_weight = 0.0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _lookup(self, key: Hashable) -> Optional[Tuple[Any, float, float]]:
+        """取出未过期的条目，已过期的条目顺带删除（调用方需持有锁）"""
+        item = self._data.get(key)
+        if item is not None and item[2] <= time.monotonic():
+            del self._data[key]
+            self._total_weight -= item[1]
+            self.expirations += 1
+            return None
+        return item
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._lookup(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value: Any) -> List[Tuple[Hashable, Any]]:
+        """写入条目，返回被淘汰的 (key, value) 列表"""
+        weight = self.weigh(value)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if key in self._data:
+                self._total_weight -= self._data.pop(key)[1]
+            self._data[key] = (value, weight, expires_at)
+            self._total_weight += weight
+            return self._evict()
+
+    def _evict(self) -> List[Tuple[Hashable, Any]]:
+        evicted = []
+        # 至少保留最新写入的一条
+        while len(self._data) > 1 and (
+            (self.maxsize is not None and len(self._data) > self.maxsize) or
+            (self.max_weight is not None and self._total_weight > self.max_weight)
+        ):
+            key, (value, weight, _) = self._data.popitem(last=False)
+            self._total_weight -= weight
+            self.evictions += 1
+            evicted.append((key, value))
+        return evicted
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self._total_weight -= item[1]
+            return item[0]
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除所有 key 满足 predicate 的条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._total_weight -= self._data.pop(key)[1]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._total_weight = 0.0
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        with self._lock:
+            return [(key, item[0]) for key, item in self._data.items()]
+
+    @property
+    def total_weight(self) -> float:
+        return self._total_weight
+
+    def stats(self) -> dict:
+        """命中/未命中/淘汰/过期统计"""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "weight": self._total_weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._lookup(key)
+            if item is None:
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            return item[0]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.keys())
@@ -0,0 +1,222 @@
+"""
+问题 -> 数据库路由
+调用方不知道问题属于哪个数据库时，在 GraphRAG 表检索之前先选出候选数据库：
+- 每个数据库一条摘要文本（数据库名 + 表名 + 列名，来自 tables.json），整个目录共用一个向量矩阵
+- 关键词部分为 单词 x 数据库 的稀疏 IDF 矩阵，"id" / "name" 这类到处出现的词权重接近 0
+- 单次路由 = 一次矩阵向量乘 + 一次稀疏查表，与数据库数量线性相关，毫秒级
+
+摘要向量与问题向量复用 GraphRAG 检索器的 EmbeddingStore / 问题向量缓存，
+路由时算过的问题向量在随后的表检索中直接命中缓存。
+"""
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from scipy import sparse
+
+from utils.embedding_loader import estimate_tokens
+from utils.graphrag import GraphRAGRetriever, get_shared_retriever
+from utils.text_utils import WORD_RE
+from utils.vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+# 问句中的功能词：偶尔出现在列名里（如 "how to get there"），不能作为路由依据
+_STOPWORDS = frozenset("""
+a an the of in on at to for from by with and or not no is are was were be been do does did
+have has had what which who whom whose when where why how many much that this these those
+all each every any their its it we us our you your me my i they them there than as
+list show give find return
+""".split())
+
+
+def _stem(word: str) -> str:
+    """极简词形归一：复数还原为单数（singers -> singer, cities -> city）"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _name_words(name: str) -> List[str]:
+    """名称（或问题）拆成归一化的小写单词，下划线也作为分隔符，去除功能词"""
+    return [_stem(word) for word in WORD_RE.findall(name.lower().replace("_", " "))
+            if word not in _STOPWORDS]
+
+
+class DatabaseRouter:
+    """基于数据库摘要的混合（关键词 + Embedding）路由索引"""
+
+    def __init__(self, retriever: GraphRAGRetriever,
+                 keyword_weight: float = 0.4,
+                 embedding_weight: float = 0.6,
+                 max_summary_tokens: int = 2000):
+        """
+        Args:
+            retriever: GraphRAG 检索器，提供 tables.json 条目、Embedding 实例、向量缓存与问题向量缓存
+            keyword_weight: 关键词匹配权重
+            embedding_weight: Embedding 语义权重
+            max_summary_tokens: 单个数据库摘要的估算 token 上限（列名超出部分截断，表名全部保留）
+        """
+        self.retriever = retriever
+        self.keyword_weight = keyword_weight
+        self.embedding_weight = embedding_weight
+        self.max_summary_tokens = max_summary_tokens
+        self._build_lock = threading.Lock()
+        self._fingerprints: Optional[Dict[str, str]] = None
+        self._build()
+
+    def summary_text(self, entry: Dict) -> str:
+        """数据库摘要：数据库名、全部表名，以及去重后的列名（按 max_summary_tokens 截断）"""
+        tables = entry.get("table_names") or entry.get("table_names_original") or []
+        text = f"database {entry['db_id'].replace('_', ' ')}; tables: {', '.join(tables)}; columns: "
+        budget = self.max_summary_tokens - estimate_tokens(text)
+        columns = []
+        for _, column in entry.get("column_names", []):
+            if column == "*" or column in columns:
+                continue
+            budget -= estimate_tokens(column) + 1
+            if budget < 0:
+                break
+            columns.append(column)
+        return text + ", ".join(columns)
+
+    def _build(self):
+        """根据检索器当前的 tables.json 条目构建关键词矩阵与摘要向量矩阵"""
+        fingerprints = self.retriever._fingerprints
+        entries = self.retriever._entries
+        db_ids = list(entries)
+
+        # 单词 x 数据库 的 0/1 矩阵，按 IDF 加权
+        vocab: Dict[str, int] = {}
+        rows, cols = [], []
+        for db_idx, db_id in enumerate(db_ids):
+            entry = entries[db_id]
+            names = [db_id]
+            for key in ("table_names", "table_names_original"):
+                names.extend(entry.get(key, []))
+            for key in ("column_names", "column_names_original"):
+                names.extend(column for _, column in entry.get(key, []) if column != "*")
+            words = {word for name in names for word in _name_words(name)}
+            for word in words:
+                rows.append(vocab.setdefault(word, len(vocab)))
+                cols.append(db_idx)
+        hits = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                 shape=(len(vocab), len(db_ids)))
+        doc_freq = np.asarray(hits.sum(axis=1)).ravel()
+        idf = np.log((len(db_ids) + 1) / (doc_freq + 1)).astype(np.float32)
+
+        summaries = [self.summary_text(entries[db_id]) for db_id in db_ids]
+        matrix = self._embed_summaries(summaries) if summaries else np.zeros((0, 0), dtype=np.float32)
+
+        # 整体替换，构建期间并发的路由请求看到的始终是完整的一份
+        self.db_ids, self.summaries = db_ids, summaries
+        self._vocab, self._idf, self._word_db_matrix = vocab, idf, hits
+        self.summary_matrix = matrix
+        self._fingerprints = fingerprints
+        logger.info(f"[路由] 构建数据库路由索引: {len(db_ids)} 个数据库, {len(vocab)} 个单词")
+
+    def _embed_summaries(self, summaries: List[str]) -> np.ndarray:
+        """计算（或从缓存读取）摘要向量，返回按行归一化的矩阵"""
+        store = self.retriever.store
+        if store is not None:
+            if self.retriever.loader is not None:
+                self.retriever.loader.prefetch(store, summaries)
+            return store.embed_matrix(self.retriever.embeddings, summaries)
+        vecs = self.retriever.embeddings.embed_documents(summaries)
+        return normalize_rows(np.asarray(vecs, dtype=np.float32))
+
+    def _sync(self):
+        """tables.json 变化时（检索器重新解析后）重建路由索引；未变化的摘要向量直接命中缓存"""
+        self.retriever.refresh_if_changed()
+        if self.retriever._fingerprints is self._fingerprints:
+            return
+        with self._build_lock:
+            if self.retriever._fingerprints is not self._fingerprints:
+                self._build()
+
+    def keyword_scores(self, question: str) -> np.ndarray:
+        """问题命中的单词 IDF 之和 / 问题中可匹配单词的 IDF 之和，取值 [0, 1]"""
+        word_ids = {self._vocab[word] for word in _name_words(question) if word in self._vocab}
+        if not word_ids:
+            return np.zeros(len(self.db_ids), dtype=np.float32)
+        word_ids = np.fromiter(word_ids, dtype=np.int64)
+        weights = self._idf[word_ids]
+        total = weights.sum()
+        if total <= 0:
+            return np.zeros(len(self.db_ids), dtype=np.float32)
+        return (weights @ self._word_db_matrix[word_ids]) / total
+
+    def embedding_scores(self, question_vec: np.ndarray) -> np.ndarray:
+        """问题与每个数据库摘要的余弦相似度"""
+        dim = self.summary_matrix.shape[1]
+        query = normalize_rows(np.atleast_2d(np.asarray(question_vec, dtype=np.float32))[:, :dim])
+        return np.asarray(self.summary_matrix @ query[0], dtype=np.float32)
+
+    def route(self, question: str, top_n: int = 3,
+              question_vec: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        为问题选出最可能的数据库
+
+        Args:
+            question: 用户问题
+            top_n: 返回的候选数量
+            question_vec: 预先计算好的问题向量，None 时从问题向量缓存获取
+
+        Returns:
+            [(db_id, 分数), ...]，按分数降序
+        """
+        self._sync()
+        if not self.db_ids or top_n <= 0:
+            return []
+
+        scores = self.keyword_weight * self.keyword_scores(question)
+        if self.embedding_weight:
+            if question_vec is None:
+                question_vec = self.retriever.question_cache.embed(question)
+            scores = scores + self.embedding_weight * self.embedding_scores(question_vec)
+
+        top_n = min(top_n, len(self.db_ids))
+        top = np.argpartition(-scores, top_n - 1)[:top_n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.db_ids[i], float(scores[i])) for i in top]
+
+
+# ========== 进程级路由器注册表 ==========
+_shared_routers: Dict[str, DatabaseRouter] = {}
+_shared_lock = threading.Lock()
+
+
+def load_router_config(config_path: str = "config.yaml") -> Dict:
+    """读取 config.yaml 中的 router 配置段"""
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    return config.get("router", {}) or {}
+
+
+def get_shared_router(tables_json_path: str) -> DatabaseRouter:
+    """
+    获取进程内共享的数据库路由器
+
+    建立在同一个 tables.json 的共享 GraphRAG 检索器之上，参数从 config.yaml 的 router 段读取。
+    """
+    key = os.path.abspath(tables_json_path)
+    with _shared_lock:
+        router = _shared_routers.get(key)
+        if router is None:
+            router_config = load_router_config()
+            router = DatabaseRouter(
+                get_shared_retriever(tables_json_path),
+                keyword_weight=router_config.get("keyword_weight", 0.4),
+                embedding_weight=router_config.get("embedding_weight", 0.6),
+                max_summary_tokens=router_config.get("max_summary_tokens", 2000)
+            )
+            _shared_routers[key] = router
+    return router
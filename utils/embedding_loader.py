@@ -0,0 +1,211 @@
+"""
+并发批量 Embedding 加载器
+冷启动加载整个目录（如 tables.json 的全部数据库）时使用：
+- 跨数据库去重，按文本条数与估算 token 数把待计算文本打包成有上限的批次
+- 线程池并发请求，令牌桶同时限制每分钟请求数与 token 数
+- 只对暂时性错误（限流、超时、连接失败、5xx）按指数退避（带随机抖动）重试，其他错误立即抛出
+- 某个批次最终失败时，已完成批次的向量先写入 store 再抛出异常，重跑时不再重复计算
+结果写入 EmbeddingStore，后续 SchemaGraph 构建全部命中缓存。
+"""
+import random
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本 token 数（约 4 个字符 1 个 token）"""
+    return len(text) // 4 + 1
+
+
+# 视为暂时性错误的 HTTP 状态码与异常类名（openai / httpx / requests 等客户端的限流、超时、连接错误）
+_TRANSIENT_STATUS_CODES = frozenset({408, 409, 429})
+_TRANSIENT_ERROR_NAMES = frozenset({
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "ServiceUnavailableError", "Timeout", "TimeoutException", "ReadTimeout", "ConnectTimeout",
+    "ConnectError", "RemoteProtocolError",
+})
+
+
+def is_transient_error(error: Exception) -> bool:
+    """判断 Embedding 请求的错误是否值得重试（限流、超时、连接失败、5xx）"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in _TRANSIENT_STATUS_CODES or status >= 500
+    return type(error).__name__ in _TRANSIENT_ERROR_NAMES
+
+
+class RateLimiter:
+    """线程安全的令牌桶：每秒补充 rate 个令牌，最多累积 capacity 个"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        """
+        取走 amount 个令牌，不足时阻塞等待
+
+        超过容量的请求在令牌桶装满后放行，并按全额扣除（余额变为负数），之后的请求等待欠额补足，
+        长期速率不会超过 rate。
+        """
+        required = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= required:
+                    self._tokens -= amount
+                    return
+                wait = (required - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingLoader:
+    """并发、限速、带重试的批量 Embedding 计算，结果写入 EmbeddingStore"""
+
+    def __init__(self, embeddings,
+                 max_concurrency: int = 8,
+                 batch_size: int = 512,
+                 batch_tokens: int = 100000,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 5,
+                 backoff_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0):
+        """
+        Args:
+            embeddings: LangChain Embeddings 实例
+            max_concurrency: 并发请求数
+            batch_size: 每个批次最多包含的文本数
+            batch_tokens: 每个批次最多包含的估算 token 数
+            requests_per_minute: 每分钟请求数上限，None 表示不限制
+            tokens_per_minute: 每分钟 token 数上限，None 表示不限制
+            max_retries: 单个批次遇到暂时性错误后的最大重试次数
+            backoff_seconds: 首次重试的等待时间，之后每次翻倍
+            max_backoff_seconds: 单次重试等待时间上限
+        """
+        self.embeddings = embeddings
+        self.max_concurrency = max(1, max_concurrency)
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        # 桶容量即每分钟预算：与服务端按分钟计的配额一致，单个批次不会超过容量而被少计
+        self._request_limiter = (RateLimiter(requests_per_minute / 60.0, max(1.0, requests_per_minute))
+                                 if requests_per_minute else None)
+        self._token_limiter = (RateLimiter(tokens_per_minute / 60.0, tokens_per_minute)
+                               if tokens_per_minute else None)
+
+    @classmethod
+    def from_config(cls, embeddings, embedding_config: Dict) -> "EmbeddingLoader":
+        """按 config.yaml 的 embeddings 段创建"""
+        return cls(
+            embeddings,
+            max_concurrency=embedding_config.get("max_concurrency", 8),
+            batch_size=embedding_config.get("batch_size", 512),
+            batch_tokens=embedding_config.get("batch_tokens", 100000),
+            requests_per_minute=embedding_config.get("requests_per_minute"),
+            tokens_per_minute=embedding_config.get("tokens_per_minute"),
+            max_retries=embedding_config.get("max_retries", 5)
+        )
+
+    def pack_batches(self, texts: Sequence[str]) -> List[List[str]]:
+        """按文本条数与估算 token 数把文本顺序打包成批次（单条超限的文本独占一个批次）"""
+        batches, current, current_tokens = [], [], 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        """限速后调用 embed_documents，暂时性错误按指数退避重试"""
+        tokens = sum(estimate_tokens(text) for text in batch)
+        for attempt in range(self.max_retries + 1):
+            if self._request_limiter is not None:
+                self._request_limiter.acquire()
+            if self._token_limiter is not None:
+                self._token_limiter.acquire(tokens)
+            try:
+                return self.embeddings.embed_documents(batch)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_transient_error(e):
+                    raise
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"[Embedding] 批次 ({len(batch)} 条) 失败，{delay:.1f}s 后第 {attempt + 1} 次重试: {str(e)}")
+                time.sleep(delay)
+
+    def prefetch(self, store: EmbeddingStore, texts: Sequence[str]) -> int:
+        """
+        计算 store 中尚不存在的文本向量并写入 store（所有批次完成后一次落盘）
+
+        新向量按 texts 中首次出现的顺序写入同一个分段，
+        同一数据库的表/列文本在分段中保持连续，可直接以 memmap 切片读取。
+
+        Returns:
+            新计算的文本数量
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        missing = [text for text, vec in zip(unique_texts, store.get_many(unique_texts)) if vec is None]
+        if not missing:
+            return 0
+
+        batches = self.pack_batches(missing)
+        logger.info(f"[Embedding] 计算 {len(missing)} 条新文本: {len(batches)} 个批次, "
+                    f"并发 {self.max_concurrency}")
+        start = time.perf_counter()
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        error: Optional[Exception] = None
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = {executor.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    # 不再提交新批次，等待进行中的批次结束后保存已完成的结果
+                    error = e
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        finally:
+            executor.shutdown(wait=True)
+        if error is not None:
+            for future, i in futures.items():
+                if results[i] is None and future.done() and not future.cancelled() and future.exception() is None:
+                    results[i] = future.result()
+
+        done = [i for i, batch_vecs in enumerate(results) if batch_vecs is not None]
+        if done:
+            store.put_many([text for i in done for text in batches[i]],
+                           np.vstack([np.asarray(results[i], dtype=np.float32) for i in done]))
+            store.flush()
+        if error is not None:
+            logger.error(f"[Embedding] 批次失败，已保存 {len(done)}/{len(batches)} 个完成的批次: {str(error)}")
+            raise error
+        logger.info(f"[Embedding] 完成 {len(missing)} 条，耗时 {time.perf_counter() - start:.2f}s")
+        return len(missing)
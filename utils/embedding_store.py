@@ -0,0 +1,442 @@
+"""
+Embedding 持久化缓存
+按 "Embedding 模型名 + 文本哈希" 做内容寻址，跨进程复用已计算的向量；
+另提供问题向量的 LRU 缓存（QuestionEmbeddingCache），以及两者的进程级注册表
+（get_shared_embedding_store / get_shared_question_cache，不依赖 GraphRAG 检索器）
+
+目录结构（{layout} 形如 float16-full、int8-256）：
+    {cache_dir}/{model_slug}/{layout}/seg-*.json   分段清单：维度与各行的文本哈希
+    {cache_dir}/{model_slug}/{layout}/seg-*.bin    分段向量（行主序，np.memmap 只读映射）
+    {cache_dir}/{model_slug}/{layout}/seg-*.scale  int8 存储时每行的反量化系数
+"""
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.embeddings import is_symmetric
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_model_name(embeddings) -> str:
+    """获取 Embedding 模型名称（用作缓存命名空间）"""
+    for attr in ("model", "model_name"):
+        name = getattr(embeddings, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    return embeddings.__class__.__name__
+
+
+def text_hash(text: str) -> str:
+    """计算文本的内容哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _Segment:
+    """一个不可变的向量分段：vectors 为只读 memmap，int8 存储时附带每行缩放系数"""
+
+    def __init__(self, name: str, vectors: np.ndarray, scales: Optional[np.ndarray]):
+        self.name = name
+        self.vectors = vectors
+        self.scales = scales
+
+
+class EmbeddingStore:
+    """
+    内容寻址的 Embedding 磁盘缓存（线程安全）
+
+    向量经 L2 归一化（可选 Matryoshka 截断维度）后以 float32 / float16 / int8 存入不可变的分段文件，
+    通过 np.memmap 只读映射：多个 worker 进程经由操作系统页缓存共享同一份数据，
+    每次 flush 只新写一个分段，不改写已有文件，因此多进程并发写入也不会互相破坏。
+    """
+
+    DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+    def __init__(self, cache_dir: str, model_name: str,
+                 dtype: str = "float16",
+                 dim: Optional[int] = None,
+                 max_segments: int = 64):
+        """
+        Args:
+            cache_dir: 缓存根目录
+            model_name: Embedding 模型名（命名空间）
+            dtype: 存储精度 float32 / float16 / int8
+            dim: 截断后的维度（仅适用于 Matryoshka 类模型，如 text-embedding-3），None 表示不截断
+            max_segments: 分段数量超过该值时在加载时合并
+        """
+        if dtype not in self.DTYPES:
+            raise ValueError(f"不支持的存储精度: {dtype}")
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dtype = dtype
+        self.dim = dim
+        self.max_segments = max_segments
+        self.model_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", model_name),
+                                      f"{dtype}-{dim or 'full'}")
+        self._lock = threading.RLock()
+        self._segments: List[_Segment] = []
+        self._index: Dict[str, Tuple[int, int]] = {}   # 文本哈希 -> (分段序号, 行号)
+        self._pending: Dict[str, np.ndarray] = {}      # 尚未落盘的向量（已归一化、float32）
+        self._load()
+
+    def _load(self):
+        """映射磁盘上所有已提交的分段"""
+        if not os.path.isdir(self.model_dir):
+            return
+        manifests = sorted(name for name in os.listdir(self.model_dir)
+                           if name.startswith("seg-") and name.endswith(".json"))
+        for manifest in manifests:
+            try:
+                self._open_segment(manifest[:-len(".json")])
+            except Exception as e:
+                logger.warning(f"[缓存] 跳过损坏的分段 {manifest}: {str(e)}")
+        if self._index:
+            logger.info(f"[缓存] 映射 {len(self._index)} 条 Embedding "
+                        f"({self.model_name}, {self.dtype}, {len(self._segments)} 个分段)")
+        if len(self._segments) > self.max_segments:
+            self.compact()
+
+    def _open_segment(self, name: str):
+        with open(os.path.join(self.model_dir, f"{name}.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        keys, dim = manifest["keys"], manifest["dim"]
+        if not keys:
+            return
+        self.dim = self.dim or dim
+        vectors = np.memmap(os.path.join(self.model_dir, f"{name}.bin"),
+                            dtype=self.DTYPES[self.dtype], mode="r", shape=(len(keys), dim))
+        scales = None
+        if self.dtype == "int8":
+            scales = np.memmap(os.path.join(self.model_dir, f"{name}.scale"),
+                               dtype=np.float32, mode="r", shape=(len(keys),))
+        seg_idx = len(self._segments)
+        self._segments.append(_Segment(name, vectors, scales))
+        for row, key in enumerate(keys):
+            self._index.setdefault(key, (seg_idx, row))
+
+    def artifact_path(self, *parts: str) -> str:
+        """缓存目录下派生文件（如 ANN 索引）的路径"""
+        return os.path.join(self.model_dir, *parts)
+
+    def __len__(self) -> int:
+        return len(self._index) + len(self._pending)
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """截断维度并按行 L2 归一化（与落盘的向量一致）"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.dim:
+            vectors = vectors[:, :self.dim]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _decode(self, seg_idx: int, rows) -> np.ndarray:
+        """读取分段中的行，int8 存储时反量化"""
+        segment = self._segments[seg_idx]
+        data = segment.vectors[rows]
+        if segment.scales is not None:
+            return data.astype(np.float32) * np.asarray(segment.scales[rows], dtype=np.float32)[..., None]
+        return data
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """批量查询缓存（返回归一化后的 float32 向量），未命中的位置返回 None"""
+        with self._lock:
+            results = []
+            for text in texts:
+                key = text_hash(text)
+                if key in self._pending:
+                    results.append(self._pending[key])
+                elif key in self._index:
+                    seg_idx, row = self._index[key]
+                    results.append(np.asarray(self._decode(seg_idx, row), dtype=np.float32))
+                else:
+                    results.append(None)
+            return results
+
+    def get_matrix(self, texts: Sequence[str]) -> Optional[np.ndarray]:
+        """
+        以矩阵形式读取一组文本的向量，任一未命中（或尚未落盘）时返回 None
+
+        这组文本若位于同一分段的连续行（同一次 flush 写入的数据），
+        且以 float 格式存储，则直接返回 memmap 切片，不占用进程私有内存。
+        """
+        with self._lock:
+            locations = [self._index.get(text_hash(text)) for text in texts]
+            if not locations or any(loc is None for loc in locations):
+                return None
+            seg_idx, first_row = locations[0]
+            contiguous = all(loc == (seg_idx, first_row + i) for i, loc in enumerate(locations))
+            if contiguous:
+                return self._decode(seg_idx, slice(first_row, first_row + len(locations)))
+            return np.vstack([np.asarray(self._decode(s, r), dtype=np.float32)[None, :]
+                              for s, r in locations])
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """批量写入缓存（写入内存，调用 flush 落盘）"""
+        if len(texts) == 0:
+            return
+        prepared = self.prepare(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            for text, vec in zip(texts, prepared):
+                key = text_hash(text)
+                if key not in self._index:
+                    self._pending.setdefault(key, vec)
+
+    def flush(self):
+        """将新增向量写成一个新的分段（先写数据，最后原子地写入清单文件作为提交标记）"""
+        with self._lock:
+            if not self._pending:
+                return
+            keys = list(self._pending.keys())
+            matrix = np.vstack([self._pending[key] for key in keys])
+            self._write_segment(keys, matrix)
+            self._pending = {}
+            logger.info(f"[缓存] 已保存 {len(keys)} 条新 Embedding ({self.model_name}, 共 {len(self._index)} 条)")
+
+    def _write_segment(self, keys: List[str], matrix: np.ndarray):
+        os.makedirs(self.model_dir, exist_ok=True)
+        name = f"seg-{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        base = os.path.join(self.model_dir, name)
+
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            data = np.round(matrix / scales[:, None]).astype(np.int8)
+            scales.astype(np.float32).tofile(f"{base}.scale")
+        else:
+            data = matrix.astype(self.DTYPES[self.dtype])
+        data.tofile(f"{base}.bin")
+
+        tmp_manifest = f"{base}.json.tmp"
+        with open(tmp_manifest, "w", encoding="utf-8") as f:
+            json.dump({"dim": int(matrix.shape[1]), "dtype": self.dtype, "keys": keys}, f)
+        os.replace(tmp_manifest, f"{base}.json")
+        self._open_segment(name)
+
+    def compact(self):
+        """把所有分段合并为一个，减少需要映射的文件数量"""
+        with self._lock:
+            self.flush()
+            if len(self._segments) <= 1:
+                return
+            keys = list(self._index.keys())
+            matrix = np.vstack([np.asarray(self._decode(*self._index[key]), dtype=np.float32)[None, :]
+                                for key in keys])
+            old_segments = self._segments
+            self._segments, self._index = [], {}
+            self._write_segment(keys, matrix)
+            for segment in old_segments:
+                # 先删清单（其他进程不再加载该分段），数据文件删除失败（如 Windows 下仍被映射）时忽略
+                for suffix in (".json", ".bin", ".scale"):
+                    try:
+                        os.remove(os.path.join(self.model_dir, segment.name + suffix))
+                    except OSError:
+                        pass
+            logger.info(f"[缓存] 合并 {len(old_segments)} 个分段 -> 1 ({len(keys)} 条)")
+
+    def embed_documents(self, embeddings, texts: Sequence[str]) -> List[np.ndarray]:
+        """
+        带缓存的 embed_documents：只对未命中的文本调用 Embedding 接口
+
+        Args:
+            embeddings: LangChain Embeddings 实例
+            texts: 待计算的文本
+
+        Returns:
+            归一化（及截断）后的 float32 向量
+        """
+        self._fill_missing(embeddings, texts)
+        return self.get_many(texts)
+
+    def embed_matrix(self, embeddings, texts: Sequence[str]) -> np.ndarray:
+        """带缓存地计算一组文本的向量，尽量以 memmap 切片返回（见 get_matrix）"""
+        self._fill_missing(embeddings, texts)
+        matrix = self.get_matrix(texts)
+        if matrix is None:
+            matrix = np.vstack(self.get_many(texts))
+        return matrix
+
+    def _fill_missing(self, embeddings, texts: Sequence[str]):
+        cached = self.get_many(texts)
+        missing_texts = list(dict.fromkeys(text for text, vec in zip(texts, cached) if vec is None))
+        if missing_texts:
+            logger.info(f"[缓存] 命中 {len(texts) - len(missing_texts)}/{len(texts)}，"
+                        f"计算 {len(missing_texts)} 条新 Embedding")
+            self.put_many(missing_texts, embeddings.embed_documents(missing_texts))
+            self.flush()
+
+
+def normalize_question(question: str) -> str:
+    """问题文本归一化：小写并合并空白"""
+    return " ".join(question.lower().split())
+
+
+class QuestionEmbeddingCache:
+    """
+    问题向量缓存（线程安全）
+
+    以 (模型名, 归一化问题) 为键做有界 LRU 缓存，可选落盘到 EmbeddingStore 以跨进程、跨重启复用。
+    """
+
+    # 落盘时为问题文本加前缀，与 schema 文本的向量区分
+    STORE_PREFIX = "query: "
+
+    def __init__(self, embeddings, maxsize: int = 4096,
+                 store: Optional[EmbeddingStore] = None,
+                 flush_every: int = 32):
+        """
+        Args:
+            embeddings: LangChain Embeddings 实例
+            maxsize: 内存中最多缓存的问题数
+            store: 落盘用的 EmbeddingStore，None 表示只缓存在内存
+            flush_every: 每新增多少条落盘一次（进程退出时也会落盘）
+        """
+        self.embeddings = embeddings
+        self.model_name = embedding_model_name(embeddings)
+        self.symmetric = is_symmetric(embeddings)
+        self.store = store
+        self.flush_every = flush_every
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self.disk_hits = 0
+        if store is not None:
+            atexit.register(self.flush)
+
+    def _lookup(self, normalized: str) -> Optional[np.ndarray]:
+        vec = self._cache.get((self.model_name, normalized))
+        if vec is None and self.store is not None:
+            vec = self.store.get_many([self.STORE_PREFIX + normalized])[0]
+            if vec is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._cache.put((self.model_name, normalized), vec)
+        return vec
+
+    def _remember(self, normalized_list: List[str], vectors: Sequence[Sequence[float]]) -> List[np.ndarray]:
+        # 有落盘时内存中保存与落盘相同的（截断、归一化后的）向量，LRU 淘汰后从磁盘读回的维度不变
+        if self.store is not None:
+            arrays = list(self.store.prepare(np.asarray(vectors, dtype=np.float32)))
+        else:
+            arrays = [np.asarray(vec, dtype=np.float32) for vec in vectors]
+        for normalized, vec in zip(normalized_list, arrays):
+            self._cache.put((self.model_name, normalized), vec)
+        if self.store is not None:
+            self.store.put_many([self.STORE_PREFIX + q for q in normalized_list], arrays)
+            with self._lock:
+                self._unflushed += len(arrays)
+                should_flush = self._unflushed >= self.flush_every
+            if should_flush:
+                self.flush()
+        return arrays
+
+    def embed(self, question: str) -> np.ndarray:
+        """获取单个问题的向量（归一化文本只用作缓存键，未命中时以原始问题调用 embed_query）"""
+        normalized = normalize_question(question)
+        vec = self._lookup(normalized)
+        if vec is None:
+            vec = self._remember([normalized], [self.embeddings.embed_query(question)])[0]
+        return vec
+
+    def lookup_many(self, questions: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """只查缓存（内存 + 磁盘）不调用 Embedding 接口，未命中的位置返回 None"""
+        return [self._lookup(normalize_question(q)) for q in questions]
+
+    def embed_many(self, questions: Sequence[str], batch_size: int = 64,
+                   max_workers: int = 8) -> List[np.ndarray]:
+        """
+        批量获取问题向量
+
+        未命中的问题按归一化文本去重后以原始问题计算，每 batch_size 条为一块、写入一次缓存：
+        - 对称后端（见 utils.embeddings.is_symmetric）每块一次 embed_documents 请求，结果与 embed_query 相同
+        - 非对称后端（e5 / instruct 类）只能逐条调用 embed_query 才能得到查询向量，
+          以 max_workers 个线程并发请求，请求数仍等于未命中的问题数
+        """
+        originals: Dict[str, str] = {}
+        for question in questions:
+            originals.setdefault(normalize_question(question), question)
+        found = {q: self._lookup(q) for q in originals}
+        missing = [q for q, vec in found.items() if vec is None]
+        if missing and self.symmetric:
+            for start in range(0, len(missing), batch_size):
+                chunk = missing[start:start + batch_size]
+                vectors = self.embeddings.embed_documents([originals[q] for q in chunk])
+                found.update(zip(chunk, self._remember(chunk, vectors)))
+        elif missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+                for start in range(0, len(missing), batch_size):
+                    chunk = missing[start:start + batch_size]
+                    vectors = list(executor.map(self.embeddings.embed_query, [originals[q] for q in chunk]))
+                    found.update(zip(chunk, self._remember(chunk, vectors)))
+        return [found[normalize_question(q)] for q in questions]
+
+    def flush(self):
+        """将新增的问题向量落盘"""
+        if self.store is None:
+            return
+        with self._lock:
+            self._unflushed = 0
+        self.store.flush()
+
+    def stats(self) -> Dict:
+        """命中/未命中统计（misses 为内存未命中次数，其中 disk_hits 次由磁盘命中）"""
+        stats = self._cache.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["model"] = self.model_name
+        return stats
+
+
+# ========== 进程级问题向量缓存注册表 ==========
+_shared_question_caches: Dict[Tuple[str, Optional[str]], QuestionEmbeddingCache] = {}
+_shared_question_lock = threading.Lock()
+
+
+def get_shared_question_cache(embeddings, store: Optional[EmbeddingStore] = None,
+                              maxsize: int = 4096) -> QuestionEmbeddingCache:
+    """
+    获取进程内共享的问题向量缓存
+
+    按 (模型名, 落盘目录) 共享：数据库路由、GraphRAG 检索与 Few-shot 示例选择拿到同一个实例，
+    一次请求中同一个问题只调用一次 Embedding 接口。maxsize 以首次创建时为准。
+    """
+    key = (embedding_model_name(embeddings), store.model_dir if store is not None else None)
+    with _shared_question_lock:
+        cache = _shared_question_caches.get(key)
+        if cache is None:
+            cache = QuestionEmbeddingCache(embeddings, maxsize=maxsize, store=store)
+            _shared_question_caches[key] = cache
+    return cache
+
+
+# ========== 进程级 Embedding 缓存注册表 ==========
+_shared_stores: Dict[Tuple, EmbeddingStore] = {}
+_shared_store_lock = threading.Lock()
+
+
+def get_shared_embedding_store(cache_dir: str, model_name: str,
+                               dtype: str = "float16",
+                               dim: Optional[int] = None) -> EmbeddingStore:
+    """
+    获取进程内共享的 Embedding 磁盘缓存
+
+    按 (缓存目录, 模型名, 存储精度, 截断维度) 共享：GraphRAG 检索器与 Few-shot 示例选择拿到同一个实例，
+    同一目录下的分段只映射一次。
+    """
+    key = (os.path.abspath(cache_dir), model_name, dtype, dim)
+    with _shared_store_lock:
+        store = _shared_stores.get(key)
+        if store is None:
+            store = EmbeddingStore(cache_dir, model_name, dtype=dtype, dim=dim)
+            _shared_stores[key] = store
+    return store
@@ -0,0 +1,155 @@
+"""
+可插拔的 Embedding 后端
+通过 config.yaml 的 embeddings 段选择：
+- openai：OpenAI 兼容接口（默认，需要网络）
+- sentence_transformers：本地 sentence-transformers 模型
+- hashing：确定性哈希向量化，无需模型与网络，适合离线环境与 CI
+"""
+import hashlib
+import os
+import re
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_CONFIG = {
+    "provider": "openai",
+    "model": "text-embedding-3-large",
+    "dimensions": 1024,
+    "device": None,
+}
+
+_instances: Dict[Tuple, Embeddings] = {}
+_instances_lock = threading.Lock()
+
+# embed_query 与 embed_documents 结果一致的第三方 Embedding 类（查询不加指令前缀）
+_SYMMETRIC_CLASSES = frozenset({"OpenAIEmbeddings", "AzureOpenAIEmbeddings"})
+
+
+def is_symmetric(embeddings) -> bool:
+    """
+    判断 Embedding 后端的查询向量与文档向量是否相同（对称）
+
+    对称后端可以用一次 embed_documents 批量计算多个问题的查询向量；
+    e5 / instruct 类模型的 embed_query 会加查询前缀，未知后端按非对称处理。
+    """
+    symmetric = getattr(embeddings, "symmetric", None)
+    if isinstance(symmetric, bool):
+        return symmetric
+    return type(embeddings).__name__ in _SYMMETRIC_CLASSES
+
+
+class HashingEmbeddings(Embeddings):
+    """确定性哈希向量化：单词 + 字符 n-gram 经哈希映射到固定维度，L2 归一化"""
+
+    symmetric = True
+
+    def __init__(self, dimensions: int = 1024, ngram_range: Tuple[int, int] = (3, 5)):
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+        self.model = f"hashing-{dimensions}"
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r"\w+", text.lower())
+        features = [f"w:{word}" for word in words]
+        low, high = self.ngram_range
+        for word in words:
+            padded = f"<{word}>"
+            for n in range(low, high + 1):
+                features.extend(f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+        return features
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """本地 sentence-transformers 模型（embed_query 与 embed_documents 相同，不加查询前缀）"""
+
+    symmetric = True
+
+    def __init__(self, model: str, device: Optional[str] = None, batch_size: int = 64):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = model
+        self.batch_size = batch_size
+        self.client = SentenceTransformer(model, device=device)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.client.encode(list(texts), batch_size=self.batch_size,
+                                     normalize_embeddings=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def load_embedding_config(config_path: str = "config.yaml") -> Dict:
+    """读取 config.yaml 中的 embeddings 配置段（缺省项使用默认值）"""
+    embedding_config = dict(DEFAULT_EMBEDDING_CONFIG)
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+        embedding_config.update(config.get("embeddings", {}) or {})
+    return embedding_config
+
+
+def get_embeddings(embedding_config: Optional[Dict] = None) -> Embeddings:
+    """
+    按配置创建 Embedding 实例（同一配置在进程内只创建一次）
+
+    Args:
+        embedding_config: embeddings 配置段，None 时从 config.yaml 读取
+    """
+    if embedding_config is None:
+        embedding_config = load_embedding_config()
+    else:
+        embedding_config = {**DEFAULT_EMBEDDING_CONFIG, **embedding_config}
+
+    provider = embedding_config["provider"]
+    key = (provider, embedding_config["model"], embedding_config["dimensions"], embedding_config["device"])
+
+    with _instances_lock:
+        embeddings = _instances.get(key)
+        if embeddings is not None:
+            return embeddings
+
+        if provider == "openai":
+            from langchain_openai import OpenAIEmbeddings
+            embeddings = OpenAIEmbeddings(
+                model=embedding_config["model"],
+                base_url=os.getenv("base_url"),
+                openai_api_key=os.getenv("api_key")
+            )
+        elif provider == "sentence_transformers":
+            embeddings = SentenceTransformerEmbeddings(embedding_config["model"],
+                                                       device=embedding_config["device"])
+        elif provider == "hashing":
+            embeddings = HashingEmbeddings(dimensions=int(embedding_config["dimensions"]))
+        else:
+            raise ValueError(f"不支持的 Embedding 后端: {provider}")
+
+        logger.info(f"[Embedding] 使用 {provider} 后端 ({getattr(embeddings, 'model', '')})")
+        _instances[key] = embeddings
+        return embeddings
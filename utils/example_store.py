@@ -0,0 +1,412 @@
+"""
+可扩展的 Few-shot 示例库
+从 dev.sql 格式（Question ... ||| db_id / SQL: ...）的问答对文件中挖掘示例，支持数千到数十万条：
+- 示例问题以原始文本分批调用 embed_documents（经 EmbeddingLoader 并发、限速、重试），落盘到 EmbeddingStore；
+  与问题向量缓存（"query: " 键、embed_query）分开存放，不占用查询问题的内存 LRU
+- 每条示例带数据库与难度（evaluation.Evaluator.eval_hardness）元数据，解析结果按文件内容哈希落盘
+- 按数据库 / 难度过滤：预先分组为行号数组，过滤后只对子集打分
+- 规模达到 ann_threshold 时使用持久化的 FAISS 索引，无过滤条件的查询走 ANN
+- add 追加的示例立即参与检索（只在内存中，不写回问答对文件）
+- leave-one-out：评测时排除与当前问题相同的示例，以及与其标准 SQL 相同（同库同 SQL 的改写问法）的示例，
+  避免标准答案泄漏到 prompt
+"""
+import os
+import re
+import json
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.example_selectors.base import BaseExampleSelector
+
+from utils.embeddings import load_embedding_config
+from utils.embedding_loader import EmbeddingLoader
+from utils.embedding_store import (EmbeddingStore, QuestionEmbeddingCache, embedding_model_name,
+                                   get_shared_question_cache, normalize_question, text_hash)
+from utils.text_utils import load_sql_pairs
+from utils.vector_index import VectorIndex, faiss_available, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+HARDNESS_LEVELS = ("easy", "medium", "hard", "extra", "unknown")
+
+
+def _question_key(question: str) -> str:
+    """leave-one-out 的比较键：只保留单词（Spider 的问题文本在标点前带空格，"have ?" 与 "have?" 视为相同）"""
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+
+def _sql_key(db_id: Optional[str], query: str) -> Tuple[Optional[str], str]:
+    """leave-one-out 的 SQL 比较键：(数据库, 小写并按单词/符号重新分隔的 SQL)，引号与空白差异视为相同"""
+    return db_id, " ".join(re.findall(r"\w+|[^\w\s]", query.lower().replace('"', "'").rstrip("; ")))
+
+
+def extract_question(text: str) -> str:
+    """从 "Database schema: ...\n\nUser question: ..." 形式的输入中取出问题部分（没有该前缀时原样返回）"""
+    marker = "User question:"
+    return text.rsplit(marker, 1)[1].strip() if marker in text else text.strip()
+
+
+def label_hardness(pairs: List[Dict[str, str]], tables_json_path: str):
+    """用 Spider 的难度规则为每条示例标注 hardness（SQL 无法解析时为 unknown）"""
+    from evaluation import Evaluator
+    from process_sql import Schema as SchemaFromProcess, get_sql
+    from utils.schema_utils import get_schemas_from_json
+
+    schemas, _, _ = get_schemas_from_json(tables_json_path)
+    evaluator = Evaluator()
+    process_schemas = {}
+    for pair in pairs:
+        hardness = "unknown"
+        schema = schemas.get(pair["db_id"])
+        if schema is not None:
+            if pair["db_id"] not in process_schemas:
+                process_schemas[pair["db_id"]] = SchemaFromProcess(schema)
+            try:
+                hardness = evaluator.eval_hardness(get_sql(process_schemas[pair["db_id"]], pair["query"]))
+            except Exception:
+                pass
+        pair["hardness"] = hardness
+
+
+class ExampleStore:
+    """带元数据过滤的 Few-shot 示例向量库（线程安全，支持追加示例）"""
+
+    def __init__(self, examples: List[Dict[str, str]], embeddings,
+                 store: Optional[EmbeddingStore] = None,
+                 loader: Optional[EmbeddingLoader] = None,
+                 question_cache: Optional[QuestionEmbeddingCache] = None,
+                 ann_threshold: int = 20000,
+                 ann_candidates: int = 256):
+        """
+        Args:
+            examples: 示例列表，每条包含 question / query，可选 db_id / hardness / input（输出到 prompt 的原始输入）
+            embeddings: LangChain Embeddings 实例
+            store: Embedding 磁盘缓存（存放示例向量、ANN 索引与解析结果），None 表示不缓存
+            loader: 并发批量 Embedding 加载器（需配合 store 使用），None 时按 config.yaml 的 embeddings 段创建
+            question_cache: 查询问题的向量缓存，None 时使用进程级共享缓存（与 GraphRAG 检索器共用）
+            ann_threshold: 示例数达到该值时使用 FAISS ANN 索引（0 表示禁用）
+            ann_candidates: ANN 召回的候选数量（过滤与排除在召回结果上进行，不足时回退到精确打分）
+        """
+        self.examples = examples
+        self.embeddings = embeddings
+        self.store = store
+        if store is not None and loader is None:
+            loader = EmbeddingLoader.from_config(embeddings, load_embedding_config())
+        self.loader = loader if store is not None else None
+        self.ann_candidates = ann_candidates
+        self.question_cache = question_cache or get_shared_question_cache(embeddings, store=store)
+        self._lock = threading.Lock()
+
+        # 元数据：数据库 / 难度 -> 行号数组，问题比较键、SQL 比较键 -> 行号（leave-one-out）
+        db_rows, hardness_rows = defaultdict(list), defaultdict(list)
+        question_rows, sql_rows = defaultdict(list), defaultdict(list)
+        self._row_sql_keys = []
+        normalized = []
+        for row, example in enumerate(examples):
+            question = normalize_question(example["question"])
+            normalized.append(question)
+            db_rows[example.get("db_id")].append(row)
+            hardness_rows[example.get("hardness", "unknown")].append(row)
+            question_rows[_question_key(question)].append(row)
+            sql_key = _sql_key(example.get("db_id"), example["query"])
+            sql_rows[sql_key].append(row)
+            self._row_sql_keys.append(sql_key)
+        self._db_rows = {key: np.asarray(rows, dtype=np.int64) for key, rows in db_rows.items()}
+        self._hardness_rows = {key: np.asarray(rows, dtype=np.int64) for key, rows in hardness_rows.items()}
+        self._question_rows = {key: np.asarray(rows, dtype=np.int64) for key, rows in question_rows.items()}
+        self._sql_rows = {key: np.asarray(rows, dtype=np.int64) for key, rows in sql_rows.items()}
+
+        self.matrix = self._embed_questions([example["question"] for example in examples])
+        self.index: Optional[VectorIndex] = None
+        if ann_threshold and len(examples) >= ann_threshold:
+            if faiss_available():
+                path = None
+                if store is not None:
+                    fingerprint = text_hash("\n".join(normalized))[:16]
+                    path = store.artifact_path("examples", f"{fingerprint}.faiss")
+                self.index = VectorIndex.load_or_build(self.matrix, path)
+            else:
+                logger.warning("[示例] 未安装 faiss-cpu，使用精确打分")
+        logger.info(f"[示例] 示例库就绪: {len(examples)} 条, {len(self._db_rows)} 个数据库"
+                    f"{'，ANN 索引' if self.index is not None else ''}")
+
+    def _embed_questions(self, questions: List[str]) -> np.ndarray:
+        """
+        分批计算示例问题向量，返回常驻内存的 float32 归一化矩阵
+
+        有 store 时以原始问题文本为键（与 schema 文本同为 embed_documents 向量，不与 "query: " 键混用），
+        缺失的部分由 loader 打包成批次并发计算；没有 store 时直接调用 embed_documents。
+        """
+        if not questions:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self.store is not None:
+            if self.loader is not None:
+                self.loader.prefetch(self.store, questions)
+            matrix = self.store.embed_matrix(self.embeddings, questions)
+        else:
+            matrix = normalize_rows(np.asarray(self.embeddings.embed_documents(list(questions)), dtype=np.float32))
+        # 打分是热点路径：转成连续的 float32（float16 矩阵乘法没有 BLAS 加速）
+        return np.ascontiguousarray(matrix, dtype=np.float32)
+
+    @classmethod
+    def from_sql_file(cls, path: str, embeddings,
+                      tables_json_path: Optional[str] = None,
+                      store: Optional[EmbeddingStore] = None,
+                      **kwargs) -> "ExampleStore":
+        """
+        从 dev.sql 格式文件构建示例库
+
+        提供 tables_json_path 时标注难度；解析与标注结果按 (文件内容, tables.json 内容) 哈希缓存到 store 目录。
+        """
+        with open(path, "rb") as f:
+            source = f.read()
+        if tables_json_path:
+            with open(tables_json_path, "rb") as f:
+                source += f.read()
+        cache_path = (store.artifact_path("examples", f"{text_hash(source.decode('utf-8', 'replace'))[:16]}.json")
+                      if store is not None else None)
+
+        examples = None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as f:
+                examples = json.load(f)
+        if examples is None:
+            examples = load_sql_pairs(path)
+            if tables_json_path:
+                label_hardness(examples, tables_json_path)
+            if cache_path:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(examples, f, ensure_ascii=False)
+                os.replace(tmp_path, cache_path)
+            logger.info(f"[示例] 从 {path} 解析 {len(examples)} 条示例")
+        return cls(examples, embeddings, store=store, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.examples)
+
+    def add(self, example: Dict[str, str]) -> int:
+        """
+        追加一条示例（需包含 question / query，可选 db_id / hardness / input），返回其行号
+
+        示例只加入内存中的矩阵、元数据与 ANN 索引，不写回问答对文件，也不改动已落盘的索引。
+        """
+        vec = self._embed_questions([example["question"]])
+        with self._lock:
+            row = len(self.examples)
+            matrix = np.vstack([self.matrix, vec]) if row else vec
+            # 先追加示例与矩阵，再更新元数据：并发的 search 只会看到完整的行
+            self.examples.append(example)
+            self.matrix = np.ascontiguousarray(matrix)
+            if self.index is not None:
+                self.index.add(vec)
+            sql_key = _sql_key(example.get("db_id"), example["query"])
+            self._row_sql_keys.append(sql_key)
+            for mapping, key in ((self._db_rows, example.get("db_id")),
+                                 (self._hardness_rows, example.get("hardness", "unknown")),
+                                 (self._question_rows, _question_key(normalize_question(example["question"]))),
+                                 (self._sql_rows, sql_key)):
+                mapping[key] = np.append(mapping.get(key, np.zeros(0, dtype=np.int64)), row)
+        return row
+
+    def _candidate_rows(self, db_id: Optional[str], hardness: Optional[Sequence[str]]) -> Optional[np.ndarray]:
+        """满足过滤条件的行号（升序），无过滤条件时返回 None"""
+        rows = None
+        if db_id is not None:
+            rows = self._db_rows.get(db_id, np.zeros(0, dtype=np.int64))
+        if hardness is not None:
+            levels = [hardness] if isinstance(hardness, str) else list(hardness)
+            hardness_rows = np.concatenate([self._hardness_rows.get(level, np.zeros(0, dtype=np.int64))
+                                            for level in levels]) if levels else np.zeros(0, dtype=np.int64)
+            rows = (np.sort(hardness_rows) if rows is None
+                    else np.intersect1d(rows, hardness_rows, assume_unique=True))
+        return rows
+
+    def _excluded_rows(self, exclude_question: Optional[str],
+                       exclude_sql: Optional[Tuple[str, str]]) -> Optional[np.ndarray]:
+        """leave-one-out 要排除的行号（升序），没有需要排除的行时返回 None"""
+        rows, sql_keys = [], set()
+        if exclude_question is not None:
+            question_rows = self._question_rows.get(_question_key(exclude_question))
+            if question_rows is not None:
+                rows.append(question_rows)
+                # 问题本身在库中（如用 dev 集挖掘、又在 dev 集上评测）：同库同 SQL 的改写问法一并排除
+                sql_keys.update(self._row_sql_keys[row] for row in question_rows)
+        if exclude_sql is not None:
+            sql_keys.add(_sql_key(*exclude_sql))
+        rows.extend(self._sql_rows[key] for key in sql_keys if key in self._sql_rows)
+        return np.unique(np.concatenate(rows)) if rows else None
+
+    def search(self, question_vec: np.ndarray, k: int = 3,
+               db_id: Optional[str] = None,
+               hardness: Optional[Sequence[str]] = None,
+               exclude_question: Optional[str] = None,
+               exclude_sql: Optional[Tuple[str, str]] = None) -> List[Tuple[int, float]]:
+        """
+        按余弦相似度检索示例
+
+        Args:
+            question_vec: 查询问题向量
+            k: 返回数量
+            db_id: 只检索该数据库的示例
+            hardness: 只检索这些难度的示例（单个字符串或列表）
+            exclude_question: 排除与该问题（忽略大小写、空白与标点）相同的示例，
+                              以及与这些示例同库同 SQL 的示例（leave-one-out）
+            exclude_sql: 评测条目的 (db_id, 标准 SQL)，排除同库同 SQL 的示例（问题不在库中时使用）
+
+        Returns:
+            [(示例行号, 相似度), ...]，按相似度降序
+        """
+        if k <= 0 or not self.examples:
+            return []
+        excluded = self._excluded_rows(exclude_question, exclude_sql)
+        rows = self._candidate_rows(db_id, hardness)
+        # 元数据先于矩阵读取：与并发的 add 交错时，行号不会超出矩阵
+        matrix = self.matrix
+        query = normalize_rows(np.atleast_2d(np.asarray(question_vec, dtype=np.float32))[:, :matrix.shape[1]])[0]
+
+        n_excluded = 0 if excluded is None else len(excluded)
+        if rows is None and self.index is not None:
+            with self._lock:
+                sims, ids = self.index.search(query[None, :], max(self.ann_candidates, k + n_excluded))
+            excluded_set = set() if excluded is None else set(excluded.tolist())
+            hits = [(int(i), float(s)) for i, s in zip(ids[0], sims[0])
+                    if i >= 0 and int(i) not in excluded_set]
+            if len(hits) >= k or len(hits) + n_excluded >= len(self.examples):
+                return hits[:k]
+
+        if rows is not None and excluded is not None:
+            rows = np.setdiff1d(rows, excluded, assume_unique=True)
+        scores = matrix @ query if rows is None else matrix[rows] @ query
+        if rows is None and excluded is not None:
+            scores[excluded] = -np.inf
+        n_valid = len(scores) - (n_excluded if rows is None else 0)
+        k = min(k, n_valid)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ids = top if rows is None else rows[top]
+        return [(int(i), float(s)) for i, s in zip(ids, scores[top])]
+
+    def select(self, question: str, k: int = 3,
+               db_id: Optional[str] = None,
+               hardness: Optional[Sequence[str]] = None,
+               leave_one_out: bool = False,
+               question_vec: Optional[np.ndarray] = None,
+               exclude_sql: Optional[Tuple[str, str]] = None) -> List[Dict[str, str]]:
+        """
+        为问题选择最相似的 k 条示例
+
+        Args:
+            question: 用户问题
+            leave_one_out: 为 True 时排除与该问题相同的示例及其同库同 SQL 的改写问法
+            question_vec: 预先计算好的问题向量，None 时从问题向量缓存获取
+            exclude_sql: 评测条目的 (db_id, 标准 SQL)，同库同 SQL 的示例不会被选中
+            其余参数见 search
+
+        Returns:
+            示例字典列表（db_id / question / query / hardness）
+        """
+        if question_vec is None:
+            question_vec = self.question_cache.embed(question)
+        hits = self.search(question_vec, k, db_id=db_id, hardness=hardness,
+                           exclude_question=question if leave_one_out else None,
+                           exclude_sql=exclude_sql)
+        return [self.examples[row] for row, _ in hits]
+
+
+class StoreExampleSelector(BaseExampleSelector):
+    """基于 ExampleStore 的 LangChain Example Selector，输出与手写示例相同的 input / query 字段"""
+
+    def __init__(self, example_store: ExampleStore, k: int = 3,
+                 db_id: Optional[str] = None,
+                 hardness: Optional[Sequence[str]] = None,
+                 leave_one_out: bool = False):
+        self.example_store = example_store
+        self.k = k
+        self.db_id = db_id
+        self.hardness = hardness
+        self.leave_one_out = leave_one_out
+
+    def add_example(self, example: Dict[str, str]):
+        """追加示例（input / query 形式的手写示例从 input 中取出问题部分）"""
+        if "question" not in example:
+            example = dict(example, question=extract_question(example["input"]))
+        self.example_store.add(example)
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[Dict]:
+        question = extract_question(input_variables["input"])
+        examples = self.example_store.select(
+            question, k=self.k,
+            db_id=input_variables.get("db_id", self.db_id),
+            hardness=self.hardness,
+            leave_one_out=self.leave_one_out
+        )
+        # 手写示例保留原始 input（含 Schema），挖掘的示例只有问题
+        return [{"input": example.get("input", example["question"]), "query": example["query"]}
+                for example in examples]
+
+
+class VectorStoreExampleSelector(BaseExampleSelector):
+    """
+    基于 LangChain 向量库（如持久化的 FAISS）的 Example Selector
+
+    向量库中每条示例只索引问题部分；查询时同样只嵌入用户问题，向量来自问题向量缓存。
+    返回示例的完整元数据（与 SemanticSimilarityExampleSelector 一致）。
+    """
+
+    def __init__(self, vectorstore, question_cache: QuestionEmbeddingCache, k: int = 3):
+        self.vectorstore = vectorstore
+        self.question_cache = question_cache
+        self.k = k
+
+    def _question_vec(self, question: str) -> List[float]:
+        """问题向量截到索引维度后归一化（与建库时的示例向量一致）"""
+        vec = np.asarray(self.question_cache.embed(question), dtype=np.float32)[:self.vectorstore.index.d]
+        return normalize_rows(vec[None, :])[0].tolist()
+
+    def add_example(self, example: Dict[str, str]):
+        question = example.get("question") or extract_question(example["input"])
+        self.vectorstore.add_embeddings([(question, self._question_vec(question))], metadatas=[example])
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[Dict]:
+        question = extract_question(input_variables["input"])
+        documents = self.vectorstore.similarity_search_by_vector(self._question_vec(question), k=self.k)
+        return [dict(document.metadata) for document in documents]
+
+
+# ========== 进程级示例库注册表 ==========
+_shared_stores: Dict[Tuple, ExampleStore] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_example_store(source: str, embeddings,
+                             store: Optional[EmbeddingStore] = None,
+                             question_cache: Optional[QuestionEmbeddingCache] = None,
+                             tables_json_path: Optional[str] = None,
+                             ann_threshold: int = 20000) -> ExampleStore:
+    """
+    获取进程内共享的示例库（同一问答对文件只解析、加载一次）
+
+    store / question_cache 传入与 GraphRAG 检索器相同的共享实例（见 agent.resources），
+    检索表时算过的问题向量在选择示例时直接命中；tables.json 只在首次标注难度时读取。
+    """
+    key = (os.path.abspath(source), embedding_model_name(embeddings),
+           store.model_dir if store is not None else None)
+    with _shared_lock:
+        example_store = _shared_stores.get(key)
+        if example_store is None:
+            example_store = ExampleStore.from_sql_file(
+                source, embeddings,
+                tables_json_path=tables_json_path,
+                store=store,
+                question_cache=question_cache,
+                ann_threshold=ann_threshold
+            )
+            _shared_stores[key] = example_store
+    return example_store
@@ -6,177 +6,634 @@ GraphRAG module for Text-to-SQL task
 1. 延迟加载：只在需要时加载指定数据库
 2. 使用 Keyword Matching + Embedding 混合检索
 3. 移除 Emoji，解决 Windows GBK 编码问题
+4. Embedding 磁盘缓存：按模型名 + 文本哈希复用表向量，热启动不再调用 Embedding 接口
+5. 向量化打分：表向量预归一化为连续矩阵，单问题/批量问题打分均为一次矩阵乘法
+6. 大型 Schema 可选 FAISS ANN 索引，索引文件与 Embedding 缓存存放在一起
+7. 列级 Embedding 与列裁剪：每张表只保留最相关的列及主键/外键列
+8. 关键词倒排索引：建图时一次构建，打分为问题单词查表，批量打分走稀疏矩阵乘法
+9. 外键图存为稀疏邻接矩阵，分数传播与邻居扩展均为矩阵运算，支持 k 跳衰减
+10. 连接路径补全：对 Top-K 表求近似 Steiner 树，自动加入 JOIN 所需的桥接表
+11. 批量检索：问题向量分块计算，同一数据库的问题以矩阵运算一次打分
+12. 问题向量 LRU 缓存：重复/仅大小写空白不同的问题不再请求 Embedding 接口
+13. 向量以 float16 / int8（可选 Matryoshka 截断）存于 memmap 分段文件，多个 worker 共享页缓存
+14. 检索结果缓存（LRU + TTL）：相同的 (数据库, 问题, 参数) 直接返回，Schema 变更时按数据库失效
+15. Schema 图改为数组存储：名称驻留 + 整数 ID + CSR（表->列、外键），不再为每个表/列创建 networkx 节点
+16. 分层检索：超大 Schema 先按簇/命名空间质心选簇，再在簇内排表、对选中表排列，各阶段耗时写入元数据
+17. 冷启动批量加载：跨数据库打包 Embedding 批次，并发、限速、指数退避重试
 """
+import copy
 import json
-import networkx as nx
+import sys
+import time
 from typing import Dict, List, Set, Tuple, Optional
 from collections import defaultdict
 import numpy as np
-from langchain_openai import OpenAIEmbeddings
+from scipy import sparse
+from scipy.sparse import csgraph
+from langchain_core.embeddings import Embeddings
 import os
+import yaml
 from dotenv import load_dotenv
 import logging
-from sklearn.metrics.pairwise import cosine_similarity
-import re
+import threading
+from utils.cache import LRUCache
+from utils.embeddings import get_embeddings, load_embedding_config
+from utils.embedding_loader import EmbeddingLoader
+from utils.embedding_store import (EmbeddingStore, embedding_model_name, get_shared_embedding_store,
+                                   get_shared_question_cache, normalize_question, text_hash)
+from utils.text_utils import WORD_RE
+from utils.vector_index import VectorIndex, faiss_available, normalize_rows
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 
+def _spherical_kmeans(matrix: np.ndarray, n_clusters: int, iterations: int = 20,
+                      seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    球面 k-means（余弦距离）：k-means++ 初始化，质心每轮重新归一化
+    
+    Returns:
+        (labels (n,), centroids (n_clusters, d))，空簇会被丢弃并重新编号
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    n = len(matrix)
+    centers = [int(rng.integers(n))]
+    closest = 1.0 - matrix @ matrix[centers[0]]
+    for _ in range(1, n_clusters):
+        weights = np.clip(closest, 0, None)
+        total = weights.sum()
+        idx = int(rng.choice(n, p=weights / total)) if total > 0 else int(rng.integers(n))
+        centers.append(idx)
+        closest = np.minimum(closest, 1.0 - matrix @ matrix[idx])
+    centroids = matrix[centers].copy()
+    
+    labels = np.full(n, -1, dtype=np.int64)
+    for _ in range(iterations):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, matrix)
+        centroids = normalize_rows(sums)
+    
+    used, labels = np.unique(labels, return_inverse=True)
+    return labels.astype(np.int32), centroids[used]
+
+
+def _neighbor_max(adjacency: sparse.csr_matrix, scores: np.ndarray) -> np.ndarray:
+    """对每张表取其邻居分数的最大值（无邻居为 -inf），支持 (n,) 与 (batch, n) 输入"""
+    batch = np.atleast_2d(scores)
+    result = np.full(batch.shape, -np.inf, dtype=np.float32)
+    has_neighbors = np.diff(adjacency.indptr) > 0
+    if adjacency.nnz:
+        gathered = batch[:, adjacency.indices]
+        result[:, has_neighbors] = np.maximum.reduceat(
+            gathered, adjacency.indptr[:-1][has_neighbors], axis=1)
+    return result.reshape(np.shape(scores))
+
+
 class SchemaGraph:
     """数据库 Schema 图结构"""
     
-    def __init__(self, db_id: str, tables_data: Dict, embeddings: OpenAIEmbeddings):
+    def __init__(self, db_id: str, tables_data: Dict, embeddings: Embeddings,
+                 store: Optional[EmbeddingStore] = None,
+                 ann_threshold: int = 0,
+                 ann_candidates: int = 200,
+                 hierarchical_threshold: int = 0,
+                 n_clusters: int = 0,
+                 loader: Optional[EmbeddingLoader] = None,
+                 defer_embeddings: bool = False):
+        """
+        Args:
+            db_id: 数据库 ID
+            tables_data: tables.json 中该数据库的条目
+            embeddings: Embedding 模型
+            store: Embedding 磁盘缓存，None 表示不缓存
+            ann_threshold: 表数量达到该值时启用 FAISS ANN 索引（0 表示禁用）
+            ann_candidates: ANN 检索召回的候选数量
+            hierarchical_threshold: 表数量达到该值时构建表簇、启用分层检索（0 表示禁用）
+            n_clusters: 表簇数量，0 表示取 sqrt(表数量)；表名带命名空间前缀（schema.table）时按命名空间分簇
+            loader: 并发批量 Embedding 加载器（需配合 store 使用），None 时直接调用 embed_documents
+            defer_embeddings: 为 True 时只构建图结构，由调用方在批量预取后再调用 _compute_embeddings
+        """
         self.db_id = db_id
-        self.graph = nx.DiGraph()
-        self.tables = {}
-        self.columns = {}
-        self.foreign_keys = []
         self.embeddings = embeddings
-        
-        # 存储 Embedding 向量
-        self.table_embeddings = {}
-        self.column_embeddings = {}
+        self.store = store
+        self.ann_threshold = ann_threshold
+        self.ann_candidates = ann_candidates
+        self.hierarchical_threshold = hierarchical_threshold
+        self.n_clusters = n_clusters
+        self.loader = loader
+        self.table_index: Optional[VectorIndex] = None
+        # 表簇：簇 -> 表 的 CSR（cluster_indptr / cluster_members），质心已归一化
+        self.cluster_centroids: Optional[np.ndarray] = None
+        self.cluster_indptr: Optional[np.ndarray] = None
+        self.cluster_members: Optional[np.ndarray] = None
+        # 连接路径补全结果缓存：表序号元组 -> 桥接表
+        self._join_path_cache = LRUCache(maxsize=1024)
         
         self._build_graph(tables_data)
-        self._compute_embeddings()
+        if not defer_embeddings:
+            self._compute_embeddings()
     
     def _build_graph(self, tables_data: Dict):
-        """从 tables.json 数据构建图结构"""
+        """
+        从 tables.json 数据构建数组形式的图结构
+        
+        - 表：table_names / table_original_names，下标即表序号
+        - 列：按所属表分组连续存放，column_indptr 为 表 -> 列 的 CSR 行指针，
+          表 t 的列为 [column_indptr[t], column_indptr[t + 1])
+        - 外键：fk_columns 为 (n_fk, 2) 的列序号对，表级邻接见 fk_adjacency
+        名称字符串经 sys.intern 驻留，不同数据库中的同名表/列共享同一个字符串对象。
+        """
         column_names_original = tables_data.get('column_names_original', [])
         table_names_original = tables_data.get('table_names_original', [])
         foreign_keys = tables_data.get('foreign_keys', [])
+        column_types = tables_data.get('column_types', [])
+        primary_keys = tables_data.get('primary_keys', [])
         
-        # 添加表节点
+        # 表（小写名重复时只保留第一次出现的位置）
+        self.table_names: List[str] = []
+        self.table_original_names: List[str] = []
+        self.table_position: Dict[str, int] = {}
+        table_ids = []
+        source_position = {}  # tables.json 中的表序号 -> 表位置
         for i, table_name in enumerate(table_names_original):
-            table_name_lower = table_name.lower()
-            self.graph.add_node(f"table_{i}", 
-                              type="table", 
-                              name=table_name_lower,
-                              original_name=table_name)
-            self.tables[table_name_lower] = {
-                'id': i,
-                'name': table_name_lower,
-                'original_name': table_name,
-                'columns': []
+            table_name_lower = sys.intern(table_name.lower())
+            if table_name_lower not in self.table_position:
+                self.table_position[table_name_lower] = len(self.table_names)
+                self.table_names.append(table_name_lower)
+                self.table_original_names.append(sys.intern(table_name))
+                table_ids.append(i)
+            source_position[i] = self.table_position[table_name_lower]
+        self.table_ids = np.asarray(table_ids, dtype=np.int32)
+        
+        # 列（跳过 table_id 为 -1 的 "*"），按表位置稳定排序形成 CSR
+        col_source, col_table = [], []
+        for col_idx, (table_id, _) in enumerate(column_names_original):
+            if table_id != -1:
+                col_source.append(col_idx)
+                col_table.append(source_position[table_id])
+        order = np.argsort(np.asarray(col_table, dtype=np.int32), kind="stable")
+        self.column_ids = np.asarray(col_source, dtype=np.int32)[order]
+        self.column_table = np.asarray(col_table, dtype=np.int32)[order]
+        self.column_indptr = np.searchsorted(self.column_table, np.arange(len(self.table_names) + 1)).astype(np.int64)
+        self.column_names: List[str] = [sys.intern(column_names_original[i][1].lower()) for i in self.column_ids]
+        self.column_original_names: List[str] = [sys.intern(column_names_original[i][1]) for i in self.column_ids]
+        self.column_types: List[str] = [sys.intern(column_types[i]) if i < len(column_types) else ''
+                                        for i in self.column_ids]
+        column_position = {int(col_idx): pos for pos, col_idx in enumerate(self.column_ids)}
+        
+        # 主键/外键列，列裁剪时始终保留（复合主键在 tables.json 中为列表）
+        self.column_is_key = np.zeros(len(self.column_ids), dtype=bool)
+        for pk in primary_keys:
+            for col_idx in (pk if isinstance(pk, list) else [pk]):
+                if col_idx in column_position:
+                    self.column_is_key[column_position[col_idx]] = True
+        
+        fk_pairs = [(column_position[col1_idx], column_position[col2_idx])
+                    for col1_idx, col2_idx in foreign_keys
+                    if col1_idx in column_position and col2_idx in column_position]
+        self.fk_columns = np.asarray(fk_pairs, dtype=np.int32).reshape(-1, 2)
+        self.column_is_key[self.fk_columns.ravel()] = True
+        
+        self._build_fk_adjacency()
+        self._build_keyword_index()
+    
+    def table_columns(self, table_name: str) -> List[str]:
+        """表的列名（小写，tables.json 中的顺序）"""
+        pos = self.table_position[table_name]
+        return self.column_names[self.column_indptr[pos]:self.column_indptr[pos + 1]]
+    
+    @property
+    def tables(self) -> Dict[str, Dict]:
+        """表名 -> {id, name, original_name, columns}（按需生成的兼容视图）"""
+        return {
+            name: {
+                'id': int(self.table_ids[pos]),
+                'name': name,
+                'original_name': self.table_original_names[pos],
+                'columns': self.table_columns(name)
             }
+            for pos, name in enumerate(self.table_names)
+        }
+    
+    @property
+    def columns(self) -> Dict[str, List[Dict]]:
+        """表名 -> [{id, name, original_name, type}]（按需生成的兼容视图，不含无列的表）"""
+        columns = {}
+        for pos, table_name in enumerate(self.table_names):
+            start, end = self.column_indptr[pos], self.column_indptr[pos + 1]
+            if start < end:
+                columns[table_name] = [
+                    {
+                        'id': int(self.column_ids[c]),
+                        'name': self.column_names[c],
+                        'original_name': self.column_original_names[c],
+                        'type': self.column_types[c]
+                    }
+                    for c in range(start, end)
+                ]
+        return columns
+    
+    @property
+    def foreign_keys(self) -> List[Dict[str, str]]:
+        """外键列表 [{from_table, from_column, to_table, to_column}]（按需生成的兼容视图）"""
+        return [
+            {
+                'from_table': self.table_names[self.column_table[from_col]],
+                'from_column': self.column_names[from_col],
+                'to_table': self.table_names[self.column_table[to_col]],
+                'to_column': self.column_names[to_col]
+            }
+            for from_col, to_col in self.fk_columns.tolist()
+        ]
+    
+    @property
+    def key_columns(self) -> Dict[str, Set[str]]:
+        """表名 -> 主键/外键列名集合"""
+        key_columns: Dict[str, Set[str]] = defaultdict(set)
+        for c in np.flatnonzero(self.column_is_key):
+            key_columns[self.table_names[self.column_table[c]]].add(self.column_names[c])
+        return key_columns
+    
+    @property
+    def column_keys(self) -> List[Tuple[str, str]]:
+        """(表名, 列名) 列表，顺序与 column_matrix 的行一致"""
+        return [(self.table_names[t], name) for t, name in zip(self.column_table.tolist(), self.column_names)]
+    
+    @property
+    def table_embeddings(self) -> Dict[str, np.ndarray]:
+        """表名 -> 表向量（table_matrix 的行视图）"""
+        return {name: self.table_matrix[i] for i, name in enumerate(self.table_names)}
+    
+    @property
+    def column_embeddings(self) -> Dict[str, np.ndarray]:
+        """"表名.列名" -> 列向量（column_matrix 的行视图）"""
+        return {f"{table_name}.{col_name}": self.column_matrix[i]
+                for i, (table_name, col_name) in enumerate(self.column_keys)}
+    
+    def to_networkx(self):
+        """导出为 networkx.DiGraph（表/列节点 + has_column/foreign_key 边），仅用于调试与可视化"""
+        import networkx as nx
         
-        # 添加列节点和边
-        for col_idx, (table_id, col_name) in enumerate(column_names_original):
-            if table_id == -1:
-                continue
-            
-            table_name = table_names_original[table_id].lower()
-            col_name_lower = col_name.lower()
-            col_node_id = f"col_{col_idx}"
-            
-            self.graph.add_node(col_node_id,
-                              type="column",
-                              name=col_name_lower,
-                              original_name=col_name,
-                              table_id=table_id)
-            
-            self.graph.add_edge(f"table_{table_id}", col_node_id, 
-                              relation="has_column")
-            
-            if table_name not in self.columns:
-                self.columns[table_name] = []
-            self.columns[table_name].append({
-                'id': col_idx,
-                'name': col_name_lower,
-                'original_name': col_name
-            })
-            self.tables[table_name]['columns'].append(col_name_lower)
-        
-        # 添加外键关系
-        for fk in foreign_keys:
-            col1_idx, col2_idx = fk
-            col1_info = column_names_original[col1_idx]
-            col2_info = column_names_original[col2_idx]
-            
-            table1_id, col1_name = col1_info
-            table2_id, col2_name = col2_info
-            
-            if table1_id != -1 and table2_id != -1:
-                table1_name = table_names_original[table1_id].lower()
-                table2_name = table_names_original[table2_id].lower()
-                
-                self.graph.add_edge(f"table_{table1_id}", f"table_{table2_id}",
-                                  relation="foreign_key",
-                                  from_column=col1_name.lower(),
-                                  to_column=col2_name.lower())
-                
-                self.foreign_keys.append({
-                    'from_table': table1_name,
-                    'from_column': col1_name.lower(),
-                    'to_table': table2_name,
-                    'to_column': col2_name.lower()
-                })
+        graph = nx.DiGraph()
+        for pos, table_name in enumerate(self.table_names):
+            graph.add_node(f"table_{self.table_ids[pos]}", type="table", name=table_name,
+                           original_name=self.table_original_names[pos])
+        for c, col_idx in enumerate(self.column_ids.tolist()):
+            table_id = int(self.table_ids[self.column_table[c]])
+            graph.add_node(f"col_{col_idx}", type="column", name=self.column_names[c],
+                           original_name=self.column_original_names[c], table_id=table_id)
+            graph.add_edge(f"table_{table_id}", f"col_{col_idx}", relation="has_column")
+        for from_col, to_col in self.fk_columns.tolist():
+            graph.add_edge(f"table_{self.table_ids[self.column_table[from_col]]}",
+                           f"table_{self.table_ids[self.column_table[to_col]]}",
+                           relation="foreign_key",
+                           from_column=self.column_names[from_col],
+                           to_column=self.column_names[to_col])
+        return graph
+    
+    def _build_fk_adjacency(self):
+        """外键关系的表级邻接矩阵（无向、CSR 稀疏格式，不含自环）"""
+        n_tables = len(self.table_names)
+        pairs = set(zip(self.column_table[self.fk_columns[:, 0]].tolist(),
+                        self.column_table[self.fk_columns[:, 1]].tolist()))
+        pairs |= {(j, i) for i, j in pairs}
+        pairs = sorted((i, j) for i, j in pairs if i != j)
+        rows = [i for i, _ in pairs]
+        cols = [j for _, j in pairs]
+        self.fk_adjacency = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)), shape=(n_tables, n_tables))
+    
+    def table_texts(self) -> List[str]:
+        """表的 Embedding 文本："表名 columns: 列1, 列2, ..."（顺序与 table_names 一致）"""
+        return [f"{table_name} columns: {', '.join(self.table_columns(table_name))}"
+                for table_name in self.table_names]
+    
+    def column_texts(self) -> List[str]:
+        """列的 Embedding 文本："表名.列名 (类型)"（顺序与 column_keys 一致）"""
+        column_texts = []
+        for (table_name, col_name), col_type in zip(self.column_keys, self.column_types):
+            col_type = f" ({col_type})" if col_type else ""
+            column_texts.append(f"{table_name}.{col_name}{col_type}")
+        return column_texts
+    
+    def embedding_texts(self) -> List[str]:
+        """该图需要计算 Embedding 的全部文本（表文本在前，列文本在后）"""
+        return self.table_texts() + self.column_texts()
     
     def _compute_embeddings(self):
         """计算所有表名和列名的 Embedding 向量"""
         logger.info(f"[计算] {self.db_id} 数据库的 Schema Embeddings...")
         
-        # 计算表名 Embeddings
-        table_texts = []
-        table_names = []
-        for table_name, table_info in self.tables.items():
-            # 将表名和列名组合成文本
-            text = f"{table_name} columns: {', '.join(table_info['columns'])}"
-            table_texts.append(text)
-            table_names.append(table_name)
+        # 计算表名 Embeddings（表名和列名组合成文本）
+        table_texts = self.table_texts()
         
+        self.table_matrix = np.zeros((0, 0), dtype=np.float32)
         if table_texts:
-            table_vecs = self.embeddings.embed_documents(table_texts)
-            for name, vec in zip(table_names, table_vecs):
-                self.table_embeddings[name] = np.array(vec)
+            # 预先归一化为连续矩阵：余弦相似度退化为一次矩阵乘法
+            self.table_matrix = self._embed_texts(table_texts)
+            self.table_index = self._build_index("tables", self.table_matrix, table_texts)
+            if self.hierarchical_threshold and len(table_texts) >= self.hierarchical_threshold:
+                self._build_clusters(table_texts)
+        
+        # 计算列 Embeddings（"表名.列名 (类型)"）
+        column_texts = self.column_texts()
         
-        logger.info(f"[完成] {len(self.table_embeddings)} 个表的 Embeddings")
+        self.column_matrix = np.zeros((0, 0), dtype=np.float32)
+        if column_texts:
+            # 列只在输出的表内按切片精确打分（见 get_schema_subgraph），不建 ANN 索引
+            self.column_matrix = self._embed_texts(column_texts)
+        
+        logger.info(f"[完成] {len(self.table_names)} 个表、"
+                    f"{len(self.column_names)} 个列的 Embeddings")
     
-    def _compute_keyword_scores(self, question: str) -> Dict[str, float]:
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        计算（或从缓存读取）文本向量，返回按行归一化的矩阵
+        
+        使用磁盘缓存时直接返回 memmap 切片（float16 等存储精度），不占用进程私有内存
+        """
+        if self.store is not None:
+            if self.loader is not None:
+                self.loader.prefetch(self.store, texts)
+            return self.store.embed_matrix(self.embeddings, texts)
+        vecs = self.embeddings.embed_documents(texts)
+        return normalize_rows(np.asarray(vecs, dtype=np.float32))
+    
+    @property
+    def hierarchical(self) -> bool:
+        """是否已构建表簇（可使用分层检索）"""
+        return self.cluster_centroids is not None
+    
+    def _build_clusters(self, table_texts: List[str]):
         """
-        基于关键词匹配计算分数
+        将表分簇并计算质心：表名带命名空间前缀时按命名空间分组，否则做球面 k-means
+        
+        聚类结果按表文本指纹缓存在 Embedding 缓存目录下，热启动不再重复聚类。
+        """
+        namespaces = [name.split('.', 1)[0] if '.' in name else '' for name in self.table_names]
+        use_namespaces = len(set(namespaces)) > 1
+        n_clusters = self.n_clusters or max(1, int(np.sqrt(len(self.table_names))))
+        
+        path = None
+        if self.store is not None:
+            fingerprint = text_hash("\n".join(table_texts))[:16]
+            layout = "ns" if use_namespaces else f"k{n_clusters}"
+            path = self.store.artifact_path("clusters", f"{self.db_id}_{layout}_{fingerprint}.npz")
+        
+        labels = None
+        if path and os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    labels, centroids = data["labels"], data["centroids"]
+            except Exception as e:
+                logger.warning(f"[分簇] 加载 {path} 失败: {str(e)}")
+                labels = None
+        
+        if labels is None or len(labels) != len(self.table_names):
+            matrix = np.asarray(self.table_matrix, dtype=np.float32)
+            if use_namespaces:
+                _, labels = np.unique(namespaces, return_inverse=True)
+                labels = labels.astype(np.int32)
+                sums = np.zeros((labels.max() + 1, matrix.shape[1]), dtype=np.float32)
+                np.add.at(sums, labels, matrix)
+                centroids = normalize_rows(sums)
+            else:
+                labels, centroids = _spherical_kmeans(matrix, min(n_clusters, len(matrix)))
+            if path:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+                np.savez(tmp_path, labels=labels, centroids=centroids)
+                os.replace(tmp_path, path)
+        
+        self.cluster_members = np.argsort(labels, kind="stable").astype(np.int32)
+        self.cluster_indptr = np.searchsorted(labels[self.cluster_members],
+                                              np.arange(len(centroids) + 1)).astype(np.int64)
+        self.cluster_centroids = np.asarray(centroids, dtype=np.float32)
+        logger.info(f"[分簇] {self.db_id}: {len(self.table_names)} 个表 -> {len(centroids)} 个簇"
+                    f"{'（按命名空间）' if use_namespaces else ''}")
+    
+    def _prepare_queries(self, question_vecs: np.ndarray, dim: int) -> np.ndarray:
+        """将问题向量截断到矩阵维度（Matryoshka 截断存储时）并按行归一化，返回 (n, dim)"""
+        question_vecs = np.atleast_2d(np.asarray(question_vecs, dtype=np.float32))
+        return normalize_rows(question_vecs[:, :dim])
+    
+    def _build_index(self, kind: str, matrix: np.ndarray, texts: List[str]) -> Optional[VectorIndex]:
+        """规模达到 ann_threshold 时构建（或从缓存目录加载）FAISS 索引"""
+        if not self.ann_threshold or len(texts) < self.ann_threshold:
+            return None
+        if not faiss_available():
+            logger.warning(f"[索引] 未安装 faiss-cpu，{self.db_id} 使用暴力打分")
+            return None
+        
+        path = None
+        if self.store is not None:
+            fingerprint = text_hash("\n".join(texts))[:16]
+            path = self.store.artifact_path("ann", f"{self.db_id}_{kind}_{fingerprint}.faiss")
+        return VectorIndex.load_or_build(matrix, path)
+    
+    def _ann_score_matrix(self, index: VectorIndex, question_vecs: np.ndarray, size: int) -> np.ndarray:
+        """
+        通过 ANN 索引计算相似度：只有召回的候选有分数，其余置 0
+        
+        Returns:
+            (n_questions, size) 的相似度矩阵
+        """
+        queries = self._prepare_queries(question_vecs, index.index.d)
+        sims, ids = index.search(queries, self.ann_candidates)
+        scores = np.zeros((len(queries), size), dtype=np.float32)
+        rows = np.repeat(np.arange(len(queries)), ids.shape[1])
+        valid = ids.ravel() >= 0
+        scores[rows[valid], ids.ravel()[valid]] = sims.ravel()[valid]
+        return scores
+    
+    def embedding_score_matrix(self, question_vecs: np.ndarray) -> np.ndarray:
+        """
+        计算问题与所有表的余弦相似度
+        
+        Args:
+            question_vecs: 单个问题向量 (d,) 或一批问题向量 (n_questions, d)
+        
+        Returns:
+            (n_tables,) 或 (n_questions, n_tables) 的相似度矩阵，列顺序与 self.table_names 一致
+        """
+        question_vecs = np.asarray(question_vecs, dtype=np.float32)
+        if len(self.table_names) == 0:
+            return np.zeros(question_vecs.shape[:-1] + (0,), dtype=np.float32)
+        queries = self._prepare_queries(question_vecs, self.table_matrix.shape[1])
+        if question_vecs.ndim == 1:
+            return self.table_matrix @ queries[0]
+        return queries @ self.table_matrix.T
+    
+    def _build_keyword_index(self):
+        """
+        构建关键词倒排索引（只在建图时执行一次）
+        
+        - 名称索引：完整的表名/列名 -> [(表序号, 列名或 None)]，用于精确匹配
+        - 单词索引：表名/列名中的单词 -> [(表序号, 列名或 None)]，用于部分匹配
+        
+        仅由单词字符组成的名称若出现在问题中，必然是某个问题单词的子串，
+        因此精确匹配只需枚举问题单词的子串查表；含空格等字符的名称数量很少，单独做子串扫描。
+        """
+        self._name_vocab: Dict[str, int] = {}
+        self._token_vocab: Dict[str, int] = {}
+        self._complex_names: List[Tuple[str, int, bool]] = []
+        name_entries = defaultdict(set)   # (name_id, is_column) -> 表序号集合
+        token_entries = defaultdict(set)  # (token_id, is_column) -> 表序号集合
+        self.keyword_index: Dict[str, List[Tuple[str, Optional[str], str]]] = defaultdict(list)
+        
+        def add_name(name: str, table_idx: int, column: Optional[str]):
+            is_column = column is not None
+            if WORD_RE.fullmatch(name):
+                name_id = self._name_vocab.setdefault(name, len(self._name_vocab))
+                name_entries[(name_id, is_column)].add(table_idx)
+            elif name:
+                self._complex_names.append((name, table_idx, is_column))
+            for token in set(WORD_RE.findall(name)):
+                token_id = self._token_vocab.setdefault(token, len(self._token_vocab))
+                token_entries[(token_id, is_column)].add(table_idx)
+                self.keyword_index[token].append(
+                    (self.table_names[table_idx], column, "column" if is_column else "table"))
+        
+        for table_idx, table_name in enumerate(self.table_names):
+            add_name(table_name, table_idx, None)
+            for col in self.table_columns(table_name):
+                add_name(col, table_idx, col)
+        
+        self._name_lengths = sorted({len(name) for name in self._name_vocab})
+        # 倒排表：词项 ID -> [(表序号, 是否为列)]，单问题打分直接查表
+        self._name_postings = defaultdict(list)
+        self._token_postings = defaultdict(list)
+        for postings, entries in ((self._name_postings, name_entries),
+                                  (self._token_postings, token_entries)):
+            for (term_id, is_column), table_ids in entries.items():
+                postings[term_id].extend((table_idx, is_column) for table_idx in table_ids)
+        n_tables = len(self.table_names)
+        
+        def entry_matrix(entries: Dict, vocab_size: int, is_column: bool) -> sparse.csr_matrix:
+            rows, cols = [], []
+            for (term_id, entry_is_column), table_ids in entries.items():
+                if entry_is_column == is_column:
+                    rows.extend([term_id] * len(table_ids))
+                    cols.extend(table_ids)
+            return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                     shape=(vocab_size, n_tables))
+        
+        # 词项 x 表 的稀疏矩阵，批量打分时与 问题 x 词项 矩阵相乘
+        self._name_table_matrix = entry_matrix(name_entries, len(self._name_vocab), False)
+        self._name_column_matrix = entry_matrix(name_entries, len(self._name_vocab), True)
+        self._token_table_matrix = entry_matrix(token_entries, len(self._token_vocab), False)
+        self._token_column_matrix = entry_matrix(token_entries, len(self._token_vocab), True)
+    
+    def _match_terms(self, question_words: Set[str]) -> Tuple[Set[int], Set[int]]:
+        """返回问题命中的名称 ID 与单词 ID"""
+        name_ids = set()
+        for word in question_words:
+            for length in self._name_lengths:
+                if length > len(word):
+                    break
+                for start in range(len(word) - length + 1):
+                    name_id = self._name_vocab.get(word[start:start + length])
+                    if name_id is not None:
+                        name_ids.add(name_id)
+        token_ids = {self._token_vocab[word] for word in question_words if word in self._token_vocab}
+        return name_ids, token_ids
+    
+    def keyword_score_matrix(self, questions: List[str]) -> np.ndarray:
+        """
+        批量计算关键词匹配分数
         
         匹配规则：
         1. 表名精确匹配：1.0
         2. 表名部分匹配：0.7
         3. 列名精确匹配：0.8
         4. 列名部分匹配：0.5
+        
+        Returns:
+            (n_questions, n_tables) 的分数矩阵，每行归一化到 [0, 1]
+        """
+        n_questions, n_tables = len(questions), len(self.table_names)
+        name_rows, name_cols, token_rows, token_cols = [], [], [], []
+        complex_table_hits = np.zeros((n_questions, n_tables), dtype=bool)
+        complex_column_hits = np.zeros((n_questions, n_tables), dtype=bool)
+        
+        for q_idx, question in enumerate(questions):
+            question_lower = question.lower()
+            # 提取所有单词（去除标点）
+            question_words = set(WORD_RE.findall(question_lower))
+            name_ids, token_ids = self._match_terms(question_words)
+            name_rows.extend([q_idx] * len(name_ids))
+            name_cols.extend(name_ids)
+            token_rows.extend([q_idx] * len(token_ids))
+            token_cols.extend(token_ids)
+            for name, table_idx, is_column in self._complex_names:
+                if name in question_lower:
+                    hits = complex_column_hits if is_column else complex_table_hits
+                    hits[q_idx, table_idx] = True
+        
+        def hit_matrix(rows, cols, vocab_size, term_matrix) -> np.ndarray:
+            if vocab_size == 0:
+                return np.zeros((n_questions, n_tables), dtype=bool)
+            query_terms = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                            shape=(n_questions, vocab_size))
+            return (query_terms @ term_matrix).toarray() > 0
+        
+        table_exact = hit_matrix(name_rows, name_cols, len(self._name_vocab),
+                                 self._name_table_matrix) | complex_table_hits
+        column_exact = hit_matrix(name_rows, name_cols, len(self._name_vocab),
+                                  self._name_column_matrix) | complex_column_hits
+        table_partial = hit_matrix(token_rows, token_cols, len(self._token_vocab), self._token_table_matrix)
+        column_partial = hit_matrix(token_rows, token_cols, len(self._token_vocab), self._token_column_matrix)
+        
+        scores = (np.where(table_exact, 1.0, np.where(table_partial, 0.7, 0.0)) +
+                  np.where(column_exact, 0.8, np.where(column_partial, 0.5, 0.0)))
+        
+        # 归一化到 [0, 1]
+        max_scores = scores.max(axis=1, keepdims=True) if n_tables else np.ones((n_questions, 1))
+        max_scores[max_scores == 0] = 1.0
+        return scores / max_scores
+    
+    def _keyword_hits(self, question: str) -> Dict[int, float]:
+        """
+        只返回有关键词命中的表：表序号 -> 未归一化的分数（规则见 keyword_score_matrix）
+        
+        开销只与命中的倒排项数量有关，与表总数无关
         """
         question_lower = question.lower()
-        # 提取所有单词（去除标点）
-        question_words = set(re.findall(r'\b\w+\b', question_lower))
-        
-        scores = {}
-        
-        for table_name, table_info in self.tables.items():
-            score = 0.0
-            
-            # 1. 表名匹配
-            table_words = set(re.findall(r'\b\w+\b', table_name))
-            
-            # 精确匹配（整个表名出现在问题中）
-            if table_name in question_lower:
-                score += 1.0
-            # 部分匹配（表名的任意单词出现）
-            elif table_words & question_words:
-                score += 0.7
-            
-            # 2. 列名匹配
-            column_match_scores = []
-            for col in table_info['columns']:
-                col_words = set(re.findall(r'\b\w+\b', col))
-                
-                if col in question_lower:
-                    column_match_scores.append(0.8)
-                elif col_words & question_words:
-                    column_match_scores.append(0.5)
-            
-            # 取最高的列匹配分数
-            if column_match_scores:
-                score += max(column_match_scores)
-            
-            scores[table_name] = score
+        question_words = set(WORD_RE.findall(question_lower))
+        name_ids, token_ids = self._match_terms(question_words)
+        
+        table_scores: Dict[int, float] = defaultdict(float)
+        column_scores: Dict[int, float] = defaultdict(float)
+        
+        # 精确匹配优先于部分匹配
+        exact_hits = [posting for name_id in name_ids for posting in self._name_postings[name_id]]
+        exact_hits += [(table_idx, is_column) for name, table_idx, is_column in self._complex_names
+                       if name in question_lower]
+        for table_idx, is_column in exact_hits:
+            if is_column:
+                column_scores[table_idx] = 0.8
+            else:
+                table_scores[table_idx] = 1.0
+        for token_id in token_ids:
+            for table_idx, is_column in self._token_postings[token_id]:
+                if is_column:
+                    column_scores[table_idx] = max(column_scores[table_idx], 0.5)
+                else:
+                    table_scores[table_idx] = max(table_scores[table_idx], 0.7)
+        
+        return {table_idx: table_scores[table_idx] + column_scores[table_idx]
+                for table_idx in table_scores.keys() | column_scores.keys()}
+    
+    def _compute_keyword_scores(self, question: str) -> Dict[str, float]:
+        """基于关键词倒排索引计算单个问题的匹配分数（规则见 keyword_score_matrix）"""
+        hits = self._keyword_hits(question)
+        scores = {name: hits.get(i, 0.0) for i, name in enumerate(self.table_names)}
         
         # 归一化到 [0, 1]
         max_score = max(scores.values()) if scores else 1.0
@@ -187,7 +644,10 @@ class SchemaGraph:
     
     def get_relevant_tables_hybrid(self, question: str, top_k: int = 5,
                                    keyword_weight: float = 0.4,
-                                   embedding_weight: float = 0.6) -> Tuple[List[str], Dict[str, float]]:
+                                   embedding_weight: float = 0.6,
+                                   question_vec: Optional[np.ndarray] = None,
+                                   fk_factor: float = 0.3,
+                                   fk_hops: int = 1) -> Tuple[List[str], Dict[str, float]]:
         """
         使用 Keyword + Embedding 混合检索获取相关表
         
@@ -196,6 +656,9 @@ class SchemaGraph:
             top_k: 返回前 K 个表
             keyword_weight: 关键词匹配权重
             embedding_weight: Embedding 语义权重
+            question_vec: 预先计算好的问题向量，None 时调用 embed_query
+            fk_factor: 外键传播的每跳衰减系数
+            fk_hops: 外键传播的跳数
         """
         logger.info(f"[检索] 混合检索相关表 (Keyword={keyword_weight}, Embedding={embedding_weight})")
         logger.info(f"[问题] {question}")
@@ -203,40 +666,22 @@ class SchemaGraph:
         # 1. 关键词匹配分数
         keyword_scores = self._compute_keyword_scores(question)
         
-        # 2. Embedding 语义分数
-        question_vec = np.array(self.embeddings.embed_query(question))
-        embedding_scores = {}
-        for table_name, table_vec in self.table_embeddings.items():
-            similarity = cosine_similarity(
-                question_vec.reshape(1, -1), 
-                table_vec.reshape(1, -1)
-            )[0][0]
-            embedding_scores[table_name] = float(similarity)
+        # 2. Embedding 语义分数（一次矩阵-向量乘法）
+        if question_vec is None:
+            question_vec = self.embeddings.embed_query(question)
+        if self.table_index is not None:
+            similarities = self._ann_score_matrix(self.table_index, question_vec, len(self.table_names))[0]
+        else:
+            similarities = self.embedding_score_matrix(question_vec)
+        embedding_scores = dict(zip(self.table_names, similarities.tolist()))
         
         # 3. 加权融合
-        hybrid_scores = {}
-        for table_name in self.tables.keys():
-            kw_score = keyword_scores.get(table_name, 0.0)
-            emb_score = embedding_scores.get(table_name, 0.0)
-            hybrid_scores[table_name] = (
-                keyword_weight * kw_score + embedding_weight * emb_score
-            )
+        keyword_array = np.array([keyword_scores[name] for name in self.table_names], dtype=np.float32)
+        hybrid_scores = keyword_weight * keyword_array + embedding_weight * similarities
         
-        # 4. 基于外键关系传播分数（权重 0.3）
-        propagated_scores = hybrid_scores.copy()
-        for fk in self.foreign_keys:
-            from_table = fk['from_table']
-            to_table = fk['to_table']
-            if from_table in hybrid_scores:
-                propagated_scores[to_table] = max(
-                    propagated_scores.get(to_table, 0),
-                    hybrid_scores[from_table] * 0.3
-                )
-            if to_table in hybrid_scores:
-                propagated_scores[from_table] = max(
-                    propagated_scores.get(from_table, 0),
-                    hybrid_scores[to_table] * 0.3
-                )
+        # 4. 基于外键关系做 k 跳衰减传播
+        propagated = self.propagate_scores(hybrid_scores, factor=fk_factor, hops=fk_hops)
+        propagated_scores = dict(zip(self.table_names, propagated.tolist()))
         
         # 5. 返回 top_k 表
         sorted_tables = sorted(propagated_scores.items(), key=lambda x: x[1], reverse=True)
@@ -251,45 +696,256 @@ class SchemaGraph:
         
         return top_tables, propagated_scores
     
-    def get_schema_subgraph(self, table_names: List[str]) -> str:
-        """获取子图的 schema 文本表示"""
+    def rank_tables_batch(self, questions: List[str], question_vecs: np.ndarray,
+                          top_k: int = 5,
+                          keyword_weight: float = 0.4,
+                          embedding_weight: float = 0.6,
+                          fk_factor: float = 0.3,
+                          fk_hops: int = 1) -> List[Tuple[List[str], Dict[str, float]]]:
+        """
+        批量混合检索：关键词、Embedding、外键传播均以 (问题数 x 表数) 矩阵一次计算
+        
+        Returns:
+            每个问题的 (top_k 表, 全部表分数)，与 get_relevant_tables_hybrid 的返回一致
+        """
+        keyword_scores = self.keyword_score_matrix(questions)
+        question_vecs = np.atleast_2d(np.asarray(question_vecs, dtype=np.float32))
+        if self.table_index is not None:
+            similarities = self._ann_score_matrix(self.table_index, question_vecs, len(self.table_names))
+        else:
+            similarities = self.embedding_score_matrix(question_vecs)
+        
+        hybrid_scores = keyword_weight * keyword_scores + embedding_weight * similarities
+        propagated = self.propagate_scores(hybrid_scores, factor=fk_factor, hops=fk_hops)
+        
+        results = []
+        for row in propagated:
+            order = np.argsort(-row, kind="stable")[:top_k]
+            results.append(([self.table_names[i] for i in order], dict(zip(self.table_names, row.tolist()))))
+        return results
+    
+    def get_relevant_tables_hierarchical(self, question: str, top_k: int = 5,
+                                         keyword_weight: float = 0.4,
+                                         embedding_weight: float = 0.6,
+                                         question_vec: Optional[np.ndarray] = None,
+                                         fk_factor: float = 0.3,
+                                         fk_hops: int = 1,
+                                         top_clusters: int = 3,
+                                         timings: Optional[Dict[str, float]] = None
+                                         ) -> Tuple[List[str], Dict[str, float]]:
+        """
+        分层（由粗到细）检索：先按簇质心选出 top_clusters 个簇，再只对簇内的表（以及有关键词命中的表）打分
+        
+        簇数量约为 sqrt(表数量)，单个问题的开销随 Schema 规模亚线性增长。
+        外键传播只在候选表之间进行。未构建表簇时退化为 get_relevant_tables_hybrid。
+        
+        Args:
+            top_clusters: 第一阶段保留的簇数量
+            timings: 传入字典时写入各阶段耗时（毫秒）：clusters_ms / tables_ms
+            其余参数同 get_relevant_tables_hybrid
+        
+        Returns:
+            (top_k 表, 候选表的分数)
+        """
+        if not self.hierarchical:
+            return self.get_relevant_tables_hybrid(question, top_k, keyword_weight, embedding_weight,
+                                                   question_vec, fk_factor, fk_hops)
+        if question_vec is None:
+            question_vec = self.embeddings.embed_query(question)
+        
+        # 1. 选簇：问题与簇质心的相似度
+        start = time.perf_counter()
+        query = self._prepare_queries(question_vec, self.cluster_centroids.shape[1])[0]
+        cluster_sims = self.cluster_centroids @ query
+        n_selected = min(top_clusters, len(cluster_sims))
+        selected = np.argpartition(-cluster_sims, n_selected - 1)[:n_selected]
+        keyword_hits = self._keyword_hits(question)
+        candidates = np.unique(np.concatenate(
+            [self.cluster_members[self.cluster_indptr[c]:self.cluster_indptr[c + 1]] for c in selected] +
+            [np.fromiter(keyword_hits.keys(), dtype=np.int32, count=len(keyword_hits))]
+        ))
+        cluster_ms = (time.perf_counter() - start) * 1000
+        
+        # 2. 簇内排表：关键词 + Embedding 加权融合，候选子图上做外键传播
+        start = time.perf_counter()
+        max_keyword = max(keyword_hits.values(), default=0.0) or 1.0
+        keyword_array = np.array([keyword_hits.get(int(i), 0.0) / max_keyword for i in candidates],
+                                 dtype=np.float32)
+        similarities = self.table_matrix[candidates] @ query
+        hybrid_scores = keyword_weight * keyword_array + embedding_weight * similarities
+        
+        propagated = np.array(hybrid_scores, dtype=np.float32)
+        if fk_factor > 0 and fk_hops > 0 and self.fk_adjacency.nnz:
+            sub_adjacency = self.fk_adjacency[candidates][:, candidates].tocsr()
+            frontier = propagated
+            for _ in range(fk_hops):
+                frontier = fk_factor * _neighbor_max(sub_adjacency, frontier)
+                propagated = np.maximum(propagated, frontier)
+        
+        order = np.argsort(-propagated, kind="stable")[:top_k]
+        top_tables = [self.table_names[candidates[i]] for i in order]
+        scores = {self.table_names[t]: score for t, score in zip(candidates.tolist(), propagated.tolist())}
+        table_ms = (time.perf_counter() - start) * 1000
+        
+        if timings is not None:
+            timings["clusters_ms"] = round(cluster_ms, 3)
+            timings["tables_ms"] = round(table_ms, 3)
+        logger.info(f"[分层] 选中 {n_selected}/{len(cluster_sims)} 个簇，"
+                    f"候选 {len(candidates)}/{len(self.table_names)} 个表，检索到 {len(top_tables)} 个相关表")
+        return top_tables, scores
+    
+    def propagate_scores(self, scores: np.ndarray, factor: float = 0.3, hops: int = 1) -> np.ndarray:
+        """
+        沿外键图做 k 跳衰减传播：第 h 跳邻居贡献 factor^h * 邻居分数，每张表取各跳最大值
+        
+        Args:
+            scores: (n_tables,) 或 (n_questions, n_tables) 的分数
+            factor: 每跳衰减系数
+            hops: 传播跳数
+        """
+        result = np.array(scores, dtype=np.float32)
+        if factor <= 0 or hops <= 0 or self.fk_adjacency.nnz == 0:
+            return result
+        frontier = result
+        for _ in range(hops):
+            frontier = factor * _neighbor_max(self.fk_adjacency, frontier)
+            result = np.maximum(result, frontier)
+        return result
+    
+    def expand_neighbors(self, table_names: List[str], hops: int = 1) -> List[str]:
+        """返回与给定表在 hops 跳外键距离内、但不在给定表中的邻居表（按表序号排序）"""
+        reached = np.zeros(len(self.table_names), dtype=bool)
+        for name in table_names:
+            if name in self.table_position:
+                reached[self.table_position[name]] = True
+        selected = reached.copy()
+        for _ in range(hops):
+            reached = reached | (self.fk_adjacency @ reached.astype(np.float32) > 0)
+        return [self.table_names[i] for i in np.flatnonzero(reached & ~selected)]
+    
+    def complete_join_paths(self, table_names: List[str]) -> List[str]:
+        """
+        连接路径补全：在外键图上求覆盖给定表的近似 Steiner 树，返回需要额外加入的桥接表
+        
+        采用 KMB 近似：终端之间的最短路构成度量闭包，取其最小生成树后展开为原图路径。
+        结果按表集合缓存。
+        """
+        terminals = sorted({self.table_position[name] for name in table_names
+                            if name in self.table_position})
+        if len(terminals) < 2 or self.fk_adjacency.nnz == 0:
+            return []
+        
+        key = tuple(terminals)
+        cached = self._join_path_cache.get(key)
+        if cached is not None:
+            return list(cached)
+        
+        dist, predecessors = csgraph.shortest_path(
+            self.fk_adjacency, directed=False, unweighted=True,
+            indices=terminals, return_predecessors=True)
+        
+        # 终端间度量闭包（不连通的终端对不连边）
+        closure = dist[:, terminals]
+        closure[~np.isfinite(closure)] = 0
+        spanning_tree = csgraph.minimum_spanning_tree(sparse.csr_matrix(closure))
+        
+        nodes = set(terminals)
+        for i, j in zip(*spanning_tree.nonzero()):
+            # 沿以 terminals[i] 为源的最短路前驱，从 terminals[j] 回溯
+            node = predecessors[i, terminals[j]]
+            while node >= 0 and node != terminals[i]:
+                nodes.add(node)
+                node = predecessors[i, node]
+        
+        bridges = tuple(self.table_names[idx] for idx in sorted(nodes - set(terminals)))
+        self._join_path_cache.put(key, bridges)
+        if bridges:
+            logger.info(f"[路径] 补全桥接表: {', '.join(bridges)}")
+        return list(bridges)
+    
+    def column_score_matrix(self, question_vec: np.ndarray) -> np.ndarray:
+        """
+        计算问题与所有列的余弦相似度（精确打分），顺序与 self.column_keys 一致
+        """
+        if len(self.column_names) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return self.column_matrix @ self._prepare_queries(question_vec, self.column_matrix.shape[1])[0]
+    
+    def _prune_columns(self, table_name: str, column_scores: Optional[np.ndarray],
+                       max_columns: int) -> List[str]:
+        """
+        保留得分最高的 max_columns 个列以及主键/外键列，保持原始列顺序
+        
+        Args:
+            column_scores: 该表各列的相似度（与 table_columns(table_name) 对齐）
+        """
+        pos = self.table_position[table_name]
+        start, end = self.column_indptr[pos], self.column_indptr[pos + 1]
+        columns = self.column_names[start:end]
+        if not max_columns or column_scores is None or len(columns) <= max_columns:
+            return columns
+        
+        keep = self.column_is_key[start:end].copy()
+        keep[np.argsort(-column_scores, kind="stable")[:max_columns]] = True
+        return [col for col, kept in zip(columns, keep) if kept]
+    
+    def get_schema_subgraph(self, table_names: List[str],
+                            question_vec: Optional[np.ndarray] = None,
+                            max_columns: int = 0,
+                            expand_hops: int = 1) -> str:
+        """
+        获取子图的 schema 文本表示
+        
+        Args:
+            table_names: 检索到的表
+            question_vec: 问题向量（列裁剪时需要）
+            max_columns: 每张表最多保留的相关列数（主键/外键列额外保留），0 表示不裁剪
+            expand_hops: 额外加入的外键邻居跳数，0 表示不扩展
+        """
         schema_text = []
         visited_tables = set()
         
+        query = None
+        if max_columns and question_vec is not None and len(self.column_names):
+            # 只对输出的表精确计算列相似度（列切片 @ 问题向量），开销与 Schema 总列数无关
+            query = self._prepare_queries(question_vec, self.column_matrix.shape[1])[0]
+        
+        def table_line(table_name: str) -> str:
+            pos = self.table_position[table_name]
+            start, end = self.column_indptr[pos], self.column_indptr[pos + 1]
+            scores = None
+            if query is not None:
+                scores = self.column_matrix[start:end] @ query
+            cols = ", ".join(self._prune_columns(table_name, scores, max_columns))
+            return f"{table_name}: {cols}"
+        
         # 添加直接相关的表
         for table_name in table_names:
-            if table_name in self.tables:
+            if table_name in self.table_position:
                 visited_tables.add(table_name)
-                table_info = self.tables[table_name]
-                cols = ", ".join(table_info['columns'])
-                schema_text.append(f"{table_name}: {cols}")
+                schema_text.append(table_line(table_name))
         
         # 添加通过外键连接的邻居表
-        for fk in self.foreign_keys:
-            from_table = fk['from_table']
-            to_table = fk['to_table']
-            
-            if from_table in visited_tables and to_table not in visited_tables:
-                if to_table in self.tables:
-                    visited_tables.add(to_table)
-                    table_info = self.tables[to_table]
-                    cols = ", ".join(table_info['columns'])
-                    schema_text.append(f"{to_table}: {cols}")
-            elif to_table in visited_tables and from_table not in visited_tables:
-                if from_table in self.tables:
-                    visited_tables.add(from_table)
-                    table_info = self.tables[from_table]
-                    cols = ", ".join(table_info['columns'])
-                    schema_text.append(f"{from_table}: {cols}")
+        for table_name in self.expand_neighbors(list(visited_tables), hops=expand_hops):
+            visited_tables.add(table_name)
+            schema_text.append(table_line(table_name))
         
         logger.info(f"[子图] 包含 {len(visited_tables)} 个表: {', '.join(visited_tables)}")
         return "\n".join(schema_text)
     
+    def memory_bytes(self) -> int:
+        """估算该图常驻内存（私有的 Embedding 向量 + 结构数组 + 每个表/列约 256B 的名称与关键词索引开销，memmap 映射的向量不计入）"""
+        vec_bytes = sum(matrix.nbytes for matrix in (self.table_matrix, self.column_matrix)
+                        if not isinstance(matrix, np.memmap))
+        array_bytes = sum(array.nbytes for array in (self.table_ids, self.column_ids, self.column_table,
+                                                     self.column_indptr, self.column_is_key, self.fk_columns))
+        return vec_bytes + array_bytes + 256 * (len(self.table_names) + len(self.column_names))
+    
     def get_full_schema(self) -> str:
         """获取完整的 schema 文本"""
         schema_text = []
-        for table_name, table_info in self.tables.items():
-            cols = ", ".join(table_info['columns'])
+        for table_name in self.table_names:
+            cols = ", ".join(self.table_columns(table_name))
             schema_text.append(f"{table_name}: {cols}")
         return "\n".join(schema_text)
 
@@ -297,47 +953,299 @@ class SchemaGraph:
 class GraphRAGRetriever:
     """基于图的检索器（延迟加载版本）"""
     
-    def __init__(self, tables_json_path: str, db_filter: Optional[List[str]] = None):
+    def __init__(self, tables_json_path: Optional[str], db_filter: Optional[List[str]] = None,
+                 cache_dir: Optional[str] = ".cache/graphrag",
+                 lazy: bool = False,
+                 max_memory_mb: Optional[float] = None,
+                 ann_threshold: int = 0,
+                 ann_candidates: int = 200,
+                 max_columns_per_table: int = 0,
+                 fk_factor: float = 0.3,
+                 fk_hops: int = 1,
+                 join_path_completion: bool = True,
+                 embeddings: Optional[Embeddings] = None,
+                 question_cache_size: int = 4096,
+                 question_cache_persist: bool = True,
+                 embedding_dtype: str = "float16",
+                 embedding_dim: Optional[int] = None,
+                 result_cache_size: int = 1024,
+                 result_cache_ttl: Optional[float] = 3600,
+                 schema_check_interval: Optional[float] = 10,
+                 hierarchical_threshold: int = 0,
+                 n_clusters: int = 0,
+                 top_clusters: int = 3,
+                 embedding_loader: Optional[EmbeddingLoader] = None):
         """
         初始化 GraphRAG 检索器
         
         Args:
-            tables_json_path: tables.json 路径
+            tables_json_path: tables.json 路径，None 表示只使用 register_schema 注册的条目（如在线数据库反射结果）
             db_filter: 只加载指定的数据库列表（如 ['concert_singer']），None 表示加载所有
+            cache_dir: Embedding 磁盘缓存目录，None 表示不使用缓存
+            lazy: 为 True 时只解析 tables.json，SchemaGraph 在首次使用时再构建
+            max_memory_mb: 常驻 SchemaGraph 的内存上限，超出时按 LRU 淘汰，None 表示不限制
+            ann_threshold: 表数量达到该值的数据库启用 FAISS ANN 索引（0 表示禁用）
+            ann_candidates: ANN 检索召回的候选数量
+            max_columns_per_table: 默认每张表保留的相关列数（主键/外键列额外保留），0 表示不裁剪
+            fk_factor: 外键分数传播的每跳衰减系数
+            fk_hops: 外键分数传播与邻居表扩展的跳数
+            join_path_completion: 是否补全连接检索结果所需的桥接表（近似 Steiner 树）
+            embeddings: Embedding 实例，None 时按 config.yaml 的 embeddings 段创建
+            question_cache_size: 问题向量 LRU 缓存的容量
+            question_cache_persist: 是否将问题向量落盘到 Embedding 缓存目录（跨重启复用）
+            embedding_dtype: 磁盘缓存中向量的存储精度（float32 / float16 / int8）
+            embedding_dim: 向量截断维度（Matryoshka 模型如 text-embedding-3 可用），None 表示不截断
+            result_cache_size: 检索结果缓存的容量，0 表示不缓存
+            result_cache_ttl: 检索结果的有效期（秒），None 表示永不过期
+            schema_check_interval: 检查 tables.json 是否被修改的最小间隔（秒），None 表示不检查
+            hierarchical_threshold: 表数量达到该值的数据库使用分层检索（0 表示禁用）
+            n_clusters: 分层检索的表簇数量，0 表示取 sqrt(表数量)
+            top_clusters: 分层检索第一阶段保留的簇数量
+            embedding_loader: 并发批量 Embedding 加载器，None 时按 config.yaml 的 embeddings 段创建（仅在使用磁盘缓存时生效）
         """
         self.tables_json_path = tables_json_path
         self.db_filter = db_filter
-        self.schema_graphs: Dict[str, SchemaGraph] = {}
-        self.embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-large",
-            base_url=os.getenv("base_url"),
-            openai_api_key=os.getenv("api_key")
+        self.max_columns_per_table = max_columns_per_table
+        self.fk_factor = fk_factor
+        self.fk_hops = fk_hops
+        self.join_path_completion = join_path_completion
+        self.top_clusters = top_clusters
+        self.schema_graphs = LRUCache(
+            max_weight=max_memory_mb * 1024 * 1024 if max_memory_mb else None,
+            weigh=lambda graph: graph.memory_bytes()
+        )
+        self._entries: Dict[str, Dict] = {}
+        self._fingerprints: Dict[str, str] = {}
+        self._registered: Dict[str, Dict] = {}
+        self.result_cache = (LRUCache(maxsize=result_cache_size, ttl=result_cache_ttl)
+                             if result_cache_size else None)
+        self.schema_check_interval = schema_check_interval
+        self._tables_mtime: Optional[float] = None
+        self._last_schema_check = 0.0
+        self.graph_options = {
+            "ann_threshold": ann_threshold,
+            "ann_candidates": ann_candidates,
+            "hierarchical_threshold": hierarchical_threshold,
+            "n_clusters": n_clusters,
+        }
+        # 全局锁只保护注册表 / LRU 的短暂更新；构建（含 Embedding 计算）按数据库加锁，互不阻塞
+        self._build_lock = threading.Lock()
+        self._db_build_locks: Dict[str, threading.Lock] = {}   # 只包含正在构建的数据库
+        self.embeddings = embeddings if embeddings is not None else get_embeddings()
+        self.store = (get_shared_embedding_store(cache_dir, embedding_model_name(self.embeddings),
+                                                 dtype=embedding_dtype, dim=embedding_dim)
+                      if cache_dir else None)
+        if self.store is not None and embedding_loader is None:
+            embedding_loader = EmbeddingLoader.from_config(self.embeddings, load_embedding_config())
+        self.loader = embedding_loader if self.store is not None else None
+        self.graph_options["loader"] = self.loader
+        # 同一模型、同一缓存目录的检索器与 Few-shot 示例库共用一个问题向量缓存
+        self.question_cache = get_shared_question_cache(
+            self.embeddings,
+            store=self.store if question_cache_persist else None,
+            maxsize=question_cache_size
         )
-        self._load_schemas()
+        self._load_entries()
+        if not lazy:
+            self._load_schemas()
     
-    def _load_schemas(self):
-        """从 tables.json 加载指定数据库的 schema 图"""
-        logger.info(f"[加载] 从 {self.tables_json_path} 加载 Schema...")
-        
-        with open(self.tables_json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    def _load_entries(self):
+        """解析 tables.json，仅保存原始条目（不构建图、不计算 Embedding）；register_schema 注册的条目优先"""
+        data, mtime = [], None
+        if self.tables_json_path is not None:
+            logger.info(f"[加载] 从 {self.tables_json_path} 加载 Schema...")
+            mtime = os.path.getmtime(self.tables_json_path)
+            with open(self.tables_json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         
+        entries, fingerprints = {}, {}
         for entry in data:
             db_id = entry['db_id']
-            
             if self.db_filter and db_id not in self.db_filter:
                 continue
-            
-            logger.info(f"[加载] 正在加载数据库: {db_id}")
-            self.schema_graphs[db_id] = SchemaGraph(db_id, entry, self.embeddings)
+            entries[db_id] = entry
+            fingerprints[db_id] = self._schema_fingerprint(entry)
+        for db_id, entry in self._registered.items():
+            entries[db_id] = entry
+            fingerprints[db_id] = self._schema_fingerprint(entry)
+        # 整体替换，刷新期间并发的读取方看到的始终是完整的一份
+        self._entries, self._fingerprints, self._tables_mtime = entries, fingerprints, mtime
+    
+    @staticmethod
+    def _schema_fingerprint(entry: Dict) -> str:
+        """Schema 条目的内容指纹，作为检索结果缓存键的一部分"""
+        return text_hash(json.dumps(entry, sort_keys=True, ensure_ascii=False))[:16]
+    
+    def register_schema(self, db_id: str, entry: Dict) -> bool:
+        """
+        注册不来自 tables.json 的 Schema 条目（格式同 tables.json，如在线数据库的反射结果）
+        
+        内容与已注册的版本相同时不做任何事；否则替换条目并使该数据库的 SchemaGraph 与检索结果缓存失效。
+        
+        Returns:
+            Schema 是否发生变化
+        """
+        entry = dict(entry, db_id=db_id)
+        fingerprint = self._schema_fingerprint(entry)
+        with self._build_lock:
+            self._registered[db_id] = entry
+            if self._fingerprints.get(db_id) == fingerprint:
+                return False
+            # 整体替换，与 _load_entries 一致
+            self._entries = dict(self._entries, **{db_id: entry})
+            self._fingerprints = dict(self._fingerprints, **{db_id: fingerprint})
+        self.invalidate(db_id)
+        logger.info(f"[注册] 数据库 {db_id}: {len(entry.get('table_names_original', []))} 个表")
+        return True
+    
+    def invalidate(self, db_id: Optional[str] = None):
+        """
+        使数据库的 SchemaGraph 与检索结果缓存失效（下次访问时重建）
+        
+        Args:
+            db_id: 数据库 ID，None 表示全部
+        """
+        if db_id is None:
+            self.schema_graphs.clear()
+            if self.result_cache is not None:
+                self.result_cache.clear()
+            logger.info("[失效] 清空所有 SchemaGraph 与检索结果缓存")
+            return
+        
+        self.schema_graphs.pop(db_id)
+        dropped = self.result_cache.pop_where(lambda key: key[0] == db_id) if self.result_cache is not None else 0
+        logger.info(f"[失效] 数据库 {db_id}: 释放 SchemaGraph，清除 {dropped} 条检索结果缓存")
+    
+    def refresh_if_changed(self, force: bool = False) -> List[str]:
+        """
+        tables.json 被修改时重新解析，并使内容发生变化的数据库失效
+        
+        按 schema_check_interval 节流，只做一次 stat 调用；force=True 时忽略节流。
+        
+        Returns:
+            发生变化（新增/修改/删除）的数据库 ID 列表
+        """
+        now = time.monotonic()
+        if not force and (self.schema_check_interval is None or
+                          now - self._last_schema_check < self.schema_check_interval):
+            return []
+        self._last_schema_check = now
+        
+        if self.tables_json_path is None:
+            return []
+        try:
+            mtime = os.path.getmtime(self.tables_json_path)
+        except OSError:
+            return []
+        if mtime == self._tables_mtime:
+            return []
+        
+        old_fingerprints = self._fingerprints
+        self._load_entries()
+        changed = [db_id for db_id in set(old_fingerprints) | set(self._fingerprints)
+                   if old_fingerprints.get(db_id) != self._fingerprints.get(db_id)]
+        for db_id in changed:
+            self.invalidate(db_id)
+        if changed:
+            logger.info(f"[刷新] tables.json 已更新，{len(changed)} 个数据库的 Schema 发生变化")
+        return changed
+    
+    def _result_key(self, db_id: str, question: str, top_k: int, keyword_weight: float,
+                    embedding_weight: float, max_columns_per_table: int) -> Tuple:
+        """检索结果缓存键：包含 Schema 指纹，Schema 内容变化后旧结果不会再被命中"""
+        return (db_id, self._fingerprints.get(db_id), normalize_question(question),
+                top_k, keyword_weight, embedding_weight, max_columns_per_table,
+                self.fk_factor, self.fk_hops, self.join_path_completion)
+    
+    def _cached_result(self, key: Tuple) -> Optional[Tuple[str, Dict]]:
+        """
+        查询检索结果缓存，命中时返回元数据的副本（调用方可以安全修改）
+
+        命中的元数据带 cached=True，不含 timings（首次检索的耗时不代表本次调用）
+        """
+        if self.result_cache is None:
+            return None
+        cached = self.result_cache.get(key)
+        if cached is None:
+            return None
+        schema_text, metadata = cached
+        metadata = copy.deepcopy(metadata)
+        metadata["cached"] = True
+        return schema_text, metadata
+    
+    def _store_result(self, key: Tuple, result: Tuple[str, Dict]):
+        if self.result_cache is not None and "error" not in result[1]:
+            metadata = {k: v for k, v in result[1].items() if k != "timings"}
+            self.result_cache.put(key, (result[0], copy.deepcopy(metadata)))
+    
+    def _load_schemas(self):
+        """
+        构建所有（已过滤）数据库的 schema 图
+        
+        配置了批量加载器时，先只构建各数据库的图结构，汇总全部表/列文本一次性并发预取 Embedding，
+        再逐个装配向量（此时全部命中缓存）
+        """
+        if self.loader is None:
+            for db_id in self._entries:
+                self.get_schema_graph(db_id)
+        else:
+            pending = {db_id: self._new_graph(db_id, entry, defer_embeddings=True)
+                       for db_id, entry in self._entries.items() if db_id not in self.schema_graphs}
+            texts = [text for graph in pending.values() for text in graph.embedding_texts()]
+            self.loader.prefetch(self.store, texts)
+            for db_id, graph in pending.items():
+                graph._compute_embeddings()
+                with self._build_lock:
+                    self._register_graph(db_id, graph)
         
         logger.info(f"[完成] 加载完成: {len(self.schema_graphs)} 个数据库")
     
+    def _new_graph(self, db_id: str, entry: Dict, defer_embeddings: bool = False) -> SchemaGraph:
+        return SchemaGraph(db_id, entry, self.embeddings, self.store,
+                           defer_embeddings=defer_embeddings, **self.graph_options)
+    
+    def _register_graph(self, db_id: str, graph: SchemaGraph):
+        """放入 SchemaGraph 注册表（调用方需持有 _build_lock）"""
+        for evicted_id, _ in self.schema_graphs.put(db_id, graph):
+            logger.info(f"[淘汰] 释放数据库 {evicted_id} 的 SchemaGraph")
+    
+    def get_schema_graph(self, db_id: str) -> Optional[SchemaGraph]:
+        """获取数据库的 SchemaGraph，首次访问时构建，超出内存上限时淘汰最久未用的图"""
+        graph = self.schema_graphs.get(db_id)
+        if graph is not None:
+            return graph
+        
+        entry = self._entries.get(db_id)
+        if entry is None:
+            return None
+        
+        # 同一数据库只构建一次；不同数据库的构建（含 Embedding 计算）并行进行
+        with self._build_lock:
+            lock = self._db_build_locks.setdefault(db_id, threading.Lock())
+        try:
+            with lock:
+                # 双重检查：等待锁期间可能已被其他线程构建（不计入 LRU 命中统计）
+                try:
+                    return self.schema_graphs[db_id]
+                except KeyError:
+                    pass
+                
+                logger.info(f"[加载] 正在加载数据库: {db_id}")
+                graph = self._new_graph(db_id, entry)
+                with self._build_lock:
+                    self._register_graph(db_id, graph)
+            return graph
+        finally:
+            with self._build_lock:
+                if self._db_build_locks.get(db_id) is lock:
+                    del self._db_build_locks[db_id]
+    
     def retrieve_relevant_schema(self, db_id: str, question: str, 
                                  use_full_schema: bool = False,
                                  top_k: int = 5,
                                  keyword_weight: float = 0.4,
-                                 embedding_weight: float = 0.6) -> Tuple[str, Dict]:
+                                 embedding_weight: float = 0.6,
+                                 max_columns_per_table: Optional[int] = None) -> Tuple[str, Dict]:
         """
         基于用户问题检索相关的 schema 信息
         
@@ -348,28 +1256,171 @@ class GraphRAGRetriever:
             top_k: 检索前 K 个相关表
             keyword_weight: 关键词权重
             embedding_weight: Embedding 权重
+            max_columns_per_table: 每张表保留的相关列数（0 不裁剪），None 使用检索器默认值
         
         Returns:
             (schema 文本, 检索元数据)
         """
-        if db_id not in self.schema_graphs:
+        self.refresh_if_changed()
+        
+        if max_columns_per_table is None:
+            max_columns_per_table = self.max_columns_per_table
+        
+        key = self._result_key(db_id, question, top_k, keyword_weight, embedding_weight, max_columns_per_table)
+        if not use_full_schema:
+            cached = self._cached_result(key)
+            if cached is not None:
+                logger.info(f"[缓存] 命中检索结果 (数据库: {db_id})")
+                return cached
+        
+        graph = self.get_schema_graph(db_id)
+        if graph is None:
             logger.warning(f"[警告] 未找到数据库 {db_id}")
             return "", {"error": "database not found"}
         
-        graph = self.schema_graphs[db_id]
-        
         if use_full_schema:
             logger.info(f"[完整] 使用完整 Schema (数据库: {db_id})")
             return graph.get_full_schema(), {"mode": "full_schema"}
         
-        # 使用混合检索
-        relevant_tables, scores = graph.get_relevant_tables_hybrid(
-            question, 
-            top_k=top_k,
-            keyword_weight=keyword_weight,
-            embedding_weight=embedding_weight
-        )
+        # 问题向量只计算一次，表检索与列裁剪共用
+        start = time.perf_counter()
+        question_vec = self.question_cache.embed(question)
+        timings = {"embedding_ms": round((time.perf_counter() - start) * 1000, 3)}
+        
+        if graph.hierarchical:
+            # 超大 Schema：簇 -> 表 -> 列 分层检索
+            relevant_tables, scores = graph.get_relevant_tables_hierarchical(
+                question,
+                top_k=top_k,
+                keyword_weight=keyword_weight,
+                embedding_weight=embedding_weight,
+                question_vec=question_vec,
+                fk_factor=self.fk_factor,
+                fk_hops=self.fk_hops,
+                top_clusters=self.top_clusters,
+                timings=timings
+            )
+        else:
+            # 使用混合检索
+            start = time.perf_counter()
+            relevant_tables, scores = graph.get_relevant_tables_hybrid(
+                question, 
+                top_k=top_k,
+                keyword_weight=keyword_weight,
+                embedding_weight=embedding_weight,
+                question_vec=question_vec,
+                fk_factor=self.fk_factor,
+                fk_hops=self.fk_hops
+            )
+            timings["tables_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        
+        result = self._build_result(graph, relevant_tables, scores, question_vec,
+                                    keyword_weight, embedding_weight, max_columns_per_table, timings)
+        self._store_result(key, result)
+        return result
+    
+    def retrieve_relevant_schema_batch(self, requests: List[Tuple[str, str]],
+                                       use_full_schema: bool = False,
+                                       top_k: int = 5,
+                                       keyword_weight: float = 0.4,
+                                       embedding_weight: float = 0.6,
+                                       max_columns_per_table: Optional[int] = None,
+                                       batch_size: int = 64) -> List[Tuple[str, Dict]]:
+        """
+        批量检索：问题向量经问题向量缓存并发计算（与单条检索相同的 embed_query），同一数据库的问题用矩阵运算一次打分
+        
+        Args:
+            requests: [(db_id, question), ...]
+            batch_size: 每批写入问题向量缓存的问题数
+            其余参数同 retrieve_relevant_schema
+        
+        Returns:
+            与 requests 一一对应的 (schema 文本, 检索元数据) 列表
+        """
+        self.refresh_if_changed()
+        
+        results: List[Optional[Tuple[str, Dict]]] = [None] * len(requests)
+        if max_columns_per_table is None:
+            max_columns_per_table = self.max_columns_per_table
+        
+        keys = [self._result_key(db_id, question, top_k, keyword_weight, embedding_weight, max_columns_per_table)
+                for db_id, question in requests]
+        by_db: Dict[str, List[int]] = defaultdict(list)
+        for i, (db_id, _) in enumerate(requests):
+            cached = None if use_full_schema else self._cached_result(keys[i])
+            if cached is not None:
+                results[i] = cached
+            else:
+                by_db[db_id].append(i)
         
+        graphs = {}
+        for db_id, indices in by_db.items():
+            graph = self.get_schema_graph(db_id)
+            if graph is None:
+                logger.warning(f"[警告] 未找到数据库 {db_id}")
+                for i in indices:
+                    results[i] = ("", {"error": "database not found"})
+            elif use_full_schema:
+                for i in indices:
+                    results[i] = (graph.get_full_schema(), {"mode": "full_schema"})
+            else:
+                graphs[db_id] = graph
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        start = time.perf_counter()
+        pending_vecs = self.question_cache.embed_many([requests[i][1] for i in pending], batch_size)
+        question_vecs = dict(zip(pending, pending_vecs))
+        # 与单条检索的元数据结构一致：批量计算的阶段记录分摊到每个问题的耗时
+        embedding_ms = round((time.perf_counter() - start) * 1000 / max(1, len(pending)), 3)
+        
+        for db_id, graph in graphs.items():
+            indices = by_db[db_id]
+            questions = [requests[i][1] for i in indices]
+            vec_matrix = np.vstack([question_vecs[i] for i in indices])
+            timings = [{"embedding_ms": embedding_ms} for _ in indices]
+            if graph.hierarchical:
+                # 分层检索按问题逐个选簇，候选表集合各不相同
+                ranked = [graph.get_relevant_tables_hierarchical(
+                    question, top_k, keyword_weight, embedding_weight, vec,
+                    self.fk_factor, self.fk_hops, self.top_clusters, timings=question_timings)
+                    for question, vec, question_timings in zip(questions, vec_matrix, timings)]
+            else:
+                start = time.perf_counter()
+                ranked = graph.rank_tables_batch(
+                    questions, vec_matrix,
+                    top_k=top_k,
+                    keyword_weight=keyword_weight,
+                    embedding_weight=embedding_weight,
+                    fk_factor=self.fk_factor,
+                    fk_hops=self.fk_hops
+                )
+                tables_ms = round((time.perf_counter() - start) * 1000 / len(indices), 3)
+                for question_timings in timings:
+                    question_timings["tables_ms"] = tables_ms
+            for i, vec, (relevant_tables, scores), question_timings in zip(indices, vec_matrix, ranked, timings):
+                results[i] = self._build_result(graph, relevant_tables, scores, vec,
+                                                keyword_weight, embedding_weight, max_columns_per_table,
+                                                question_timings)
+                self._store_result(keys[i], results[i])
+        
+        logger.info(f"[批量] 完成 {len(requests)} 个问题的检索 ({len(by_db)} 个数据库)")
+        return results
+    
+    def cache_stats(self) -> Dict:
+        """问题向量缓存、检索结果缓存与 SchemaGraph 注册表的命中统计"""
+        stats = {
+            "question_embeddings": self.question_cache.stats(),
+            "schema_graphs": self.schema_graphs.stats(),
+        }
+        if self.result_cache is not None:
+            stats["results"] = self.result_cache.stats()
+        return stats
+    
+    def _build_result(self, graph: SchemaGraph, relevant_tables: List[str], scores: Dict[str, float],
+                      question_vec: np.ndarray, keyword_weight: float, embedding_weight: float,
+                      max_columns_per_table: int,
+                      timings: Optional[Dict[str, float]] = None) -> Tuple[str, Dict]:
+        """根据排好序的相关表生成子图 schema 文本与检索元数据（timings 为已完成阶段的耗时，会补充列阶段耗时）"""
         if not relevant_tables:
             logger.warning(f"[警告] 未检索到相关表，回退到完整 Schema")
             return graph.get_full_schema(), {
@@ -377,29 +1428,44 @@ class GraphRAGRetriever:
                 "reason": "no relevant tables found"
             }
         
+        start = time.perf_counter()
+        # 补全连接路径上的桥接表，避免 Agent 额外调用 sql_db_schema 查找 JOIN 表
+        bridge_tables = graph.complete_join_paths(relevant_tables) if self.join_path_completion else []
+        
         # 返回子图 schema
-        schema_text = graph.get_schema_subgraph(relevant_tables)
+        schema_text = graph.get_schema_subgraph(
+            relevant_tables + bridge_tables,
+            question_vec=question_vec,
+            max_columns=max_columns_per_table,
+            expand_hops=self.fk_hops
+        )
+        columns_ms = (time.perf_counter() - start) * 1000
         
         metadata = {
-            "mode": "hybrid_retrieval",
+            "mode": "hierarchical_retrieval" if graph.hierarchical else "hybrid_retrieval",
             "relevant_tables": relevant_tables,
             "scores": {table: scores[table] for table in relevant_tables},
-            "total_tables": len(graph.tables),
+            "total_tables": len(graph.table_names),
             "retrieved_tables": len(relevant_tables),
+            "bridge_tables": bridge_tables,
             "weights": {
                 "keyword": keyword_weight,
                 "embedding": embedding_weight
-            }
+            },
+            "max_columns_per_table": max_columns_per_table,
+            "cached": False
         }
+        if timings is not None:
+            metadata["timings"] = {**timings, "columns_ms": round(columns_ms, 3)}
         
         return schema_text, metadata
     
     def get_foreign_key_hints(self, db_id: str) -> str:
         """获取外键关系提示"""
-        if db_id not in self.schema_graphs:
+        graph = self.get_schema_graph(db_id)
+        if graph is None:
             return ""
         
-        graph = self.schema_graphs[db_id]
         hints = []
         
         for fk in graph.foreign_keys:
@@ -409,4 +1475,70 @@ class GraphRAGRetriever:
         
         if hints:
             return "Foreign key relationships:\n" + "\n".join(hints)
-        return ""
\ No newline at end of file
+        return ""
+
+
+# ========== 进程级检索器注册表 ==========
+_shared_retrievers: Dict[Tuple, GraphRAGRetriever] = {}
+_shared_lock = threading.Lock()
+
+
+def load_graphrag_config(config_path: str = "config.yaml") -> Dict:
+    """读取 config.yaml 中的 graphrag 配置段"""
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    return config.get("graphrag", {}) or {}
+
+
+def retriever_options(graphrag_config: Dict) -> Dict:
+    """把 config.yaml 的 graphrag 段映射为 GraphRAGRetriever 的构造参数（缓存目录与内存上限除外）"""
+    return {
+        "ann_threshold": graphrag_config.get("ann_threshold", 0),
+        "ann_candidates": graphrag_config.get("ann_candidates", 200),
+        "max_columns_per_table": graphrag_config.get("max_columns_per_table", 0),
+        "fk_factor": graphrag_config.get("fk_propagation_factor", 0.3),
+        "fk_hops": graphrag_config.get("fk_hops", 1),
+        "join_path_completion": graphrag_config.get("join_path_completion", True),
+        "question_cache_size": graphrag_config.get("question_cache_size", 4096),
+        "question_cache_persist": graphrag_config.get("question_cache_persist", True),
+        "embedding_dtype": graphrag_config.get("embedding_dtype", "float16"),
+        "embedding_dim": graphrag_config.get("embedding_dim"),
+        "result_cache_size": graphrag_config.get("result_cache_size", 1024),
+        "result_cache_ttl": graphrag_config.get("result_cache_ttl", 3600),
+        "schema_check_interval": graphrag_config.get("schema_check_interval", 10),
+        "hierarchical_threshold": graphrag_config.get("hierarchical_threshold", 0),
+        "n_clusters": graphrag_config.get("n_clusters", 0),
+        "top_clusters": graphrag_config.get("top_clusters", 3),
+    }
+
+
+def get_shared_retriever(tables_json_path: Optional[str],
+                         cache_dir: Optional[str] = None,
+                         max_memory_mb: Optional[float] = None) -> GraphRAGRetriever:
+    """
+    获取进程内共享的 GraphRAG 检索器
+    
+    同一个 tables.json 只解析一次（tables_json_path 为 None 时只包含 register_schema 注册的数据库），各数据库的 SchemaGraph 在首次提问时构建并跨请求复用，
+    超出 max_memory_mb 时按 LRU 淘汰。未指定的参数从 config.yaml 的 graphrag 段读取。
+    """
+    graphrag_config = load_graphrag_config()
+    if cache_dir is None:
+        cache_dir = graphrag_config.get("cache_dir", ".cache/graphrag")
+    if max_memory_mb is None:
+        max_memory_mb = graphrag_config.get("max_memory_mb")
+    
+    key = (os.path.abspath(tables_json_path) if tables_json_path else None, cache_dir, max_memory_mb)
+    with _shared_lock:
+        retriever = _shared_retrievers.get(key)
+        if retriever is None:
+            retriever = GraphRAGRetriever(
+                tables_json_path,
+                cache_dir=cache_dir,
+                lazy=True,
+                max_memory_mb=max_memory_mb,
+                **retriever_options(graphrag_config)
+            )
+            _shared_retrievers[key] = retriever
+    return retriever
@@ -0,0 +1,279 @@
+"""
+在线数据库 Schema 反射
+生产环境的 Postgres / MySQL 没有 Spider 风格的 tables.json：通过 SQLAlchemy Inspector 批量反射
+（get_multi_columns / get_multi_pk_constraint / get_multi_foreign_keys，每类目录信息每个 schema 一次查询，
+而不是每张表一次），生成与 tables.json 同格式的条目，交给 GraphRAGRetriever.register_schema 进入同一条检索流程。
+
+反射结果按 Schema 签名缓存到磁盘：签名由一条轻量的目录查询得到（SQLite 为 PRAGMA schema_version，
+Postgres / MySQL 为列与约束定义的哈希），签名不变时进程启动直接读取缓存，只有 Schema 变化后才重新反射。
+"""
+import os
+import re
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+from sqlalchemy import create_engine, inspect, text, types
+from sqlalchemy.engine import Engine
+
+from utils.embedding_store import text_hash
+from utils.graphrag import GraphRAGRetriever, get_shared_retriever, load_graphrag_config
+
+logger = logging.getLogger(__name__)
+
+
+# 各方言的 Schema 签名查询：结果随表/列/类型/主外键的任何变化而变化
+_SIGNATURE_QUERIES = {
+    "sqlite": "PRAGMA schema_version",
+    "postgresql": """
+        SELECT
+          (SELECT md5(coalesce(string_agg(
+                    n.nspname || '.' || c.relname || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod),
+                    ',' ORDER BY n.nspname, c.relname, a.attnum), ''))
+             FROM pg_attribute a
+             JOIN pg_class c ON c.oid = a.attrelid
+             JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%')
+          || ':' ||
+          (SELECT md5(coalesce(string_agg(
+                    con.conrelid::regclass::text || '.' || con.conname || ':' || pg_get_constraintdef(con.oid),
+                    ',' ORDER BY con.conrelid::regclass::text, con.conname), ''))
+             FROM pg_constraint con
+            WHERE con.contype IN ('p', 'f'))
+    """,
+    # GROUP_CONCAT 受 group_concat_max_len 截断，改用与顺序无关的 CRC32 求和
+    "mysql": """
+        SELECT CONCAT_WS(':',
+          (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS('.', table_name, column_name,
+                                                                      column_type, column_key))), 0))
+             FROM information_schema.columns WHERE table_schema = DATABASE()),
+          (SELECT CONCAT(COUNT(*), '-', COALESCE(SUM(CRC32(CONCAT_WS('.', table_name, column_name,
+                                                                      referenced_table_name,
+                                                                      referenced_column_name))), 0))
+             FROM information_schema.key_column_usage WHERE table_schema = DATABASE()))
+    """,
+}
+_SIGNATURE_QUERIES["mariadb"] = _SIGNATURE_QUERIES["mysql"]
+
+
+def natural_name(name: str) -> str:
+    """原始名称转为 tables.json 风格的自然语言名称（下划线、驼峰拆成空格，小写）"""
+    name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", name)
+    return " ".join(name.replace("_", " ").split()).lower()
+
+
+def spider_type(column_type) -> str:
+    """SQLAlchemy 类型映射为 tables.json 的列类型（number / text / time / boolean / others）"""
+    if isinstance(column_type, types.Boolean):
+        return "boolean"
+    if isinstance(column_type, (types.Integer, types.Numeric)):
+        return "number"
+    if isinstance(column_type, (types.Date, types.DateTime, types.Time, types.Interval)):
+        return "time"
+    if isinstance(column_type, types.String):
+        return "text"
+    return "others"
+
+
+def schema_signature(engine: Engine) -> Optional[str]:
+    """
+    用一条目录查询计算 Schema 签名
+
+    Returns:
+        签名字符串；方言不支持或查询失败时返回 None（调用方每次都重新反射）
+    """
+    query = _SIGNATURE_QUERIES.get(engine.dialect.name)
+    if query is None:
+        return None
+    try:
+        with engine.connect() as conn:
+            value = conn.execute(text(query)).scalar()
+    except Exception as e:
+        logger.warning(f"[反射] 无法计算 {engine.dialect.name} 的 Schema 签名: {str(e)}")
+        return None
+    return f"{engine.dialect.name}:{value}"
+
+
+def reflect_entry(engine: Engine, db_id: str, schemas: Optional[List[str]] = None) -> Dict:
+    """
+    通过 Inspector 的批量接口反射表、列、主键与外键，生成 tables.json 格式的条目
+
+    Args:
+        engine: SQLAlchemy Engine
+        db_id: 条目中的数据库 ID
+        schemas: 要反射的 schema 列表，None 表示默认 schema；多个 schema 时表名带 "schema." 前缀
+                 （分层检索据此按命名空间分簇）
+
+    Returns:
+        与 tables.json 中单个数据库条目结构相同的字典
+    """
+    start = time.perf_counter()
+    inspector = inspect(engine)
+    columns, primary_keys, foreign_keys = {}, {}, {}
+    for schema in schemas or [None]:
+        columns.update(inspector.get_multi_columns(schema=schema))
+        primary_keys.update(inspector.get_multi_pk_constraint(schema=schema))
+        foreign_keys.update(inspector.get_multi_foreign_keys(schema=schema))
+
+    qualify = bool(schemas) and len(schemas) > 1
+    table_keys = sorted(columns, key=lambda key: (key[0] or "", key[1]))
+    entry = {
+        "db_id": db_id,
+        "table_names_original": [],
+        "table_names": [],
+        "column_names_original": [[-1, "*"]],
+        "column_names": [[-1, "*"]],
+        "column_types": ["text"],
+        "primary_keys": [],
+        "foreign_keys": [],
+    }
+    column_index: Dict[Tuple[Optional[str], str, str], int] = {}
+    for table_idx, (schema, table) in enumerate(table_keys):
+        name = f"{schema}.{table}" if qualify and schema else table
+        entry["table_names_original"].append(name)
+        entry["table_names"].append(natural_name(name))
+        for column in columns[(schema, table)]:
+            column_index[(schema, table, column["name"])] = len(entry["column_names_original"])
+            entry["column_names_original"].append([table_idx, column["name"]])
+            entry["column_names"].append([table_idx, natural_name(column["name"])])
+            entry["column_types"].append(spider_type(column["type"]))
+
+    for schema, table in table_keys:
+        pk_columns = [column_index[(schema, table, column)]
+                      for column in (primary_keys.get((schema, table)) or {}).get("constrained_columns") or []
+                      if (schema, table, column) in column_index]
+        if len(pk_columns) == 1:
+            entry["primary_keys"].append(pk_columns[0])
+        elif pk_columns:
+            entry["primary_keys"].append(pk_columns)
+
+        for fk in foreign_keys.get((schema, table)) or []:
+            # referred_schema 为 None 表示与引用方同在默认 schema
+            referred_schema = fk.get("referred_schema") or schema
+            for column, referred in zip(fk["constrained_columns"], fk["referred_columns"]):
+                source = column_index.get((schema, table, column))
+                target = column_index.get((referred_schema, fk["referred_table"], referred))
+                if source is not None and target is not None:
+                    entry["foreign_keys"].append([source, target])
+
+    logger.info(f"[反射] {db_id}: {len(table_keys)} 个表, {len(column_index)} 个列, "
+                f"{len(entry['foreign_keys'])} 个外键，耗时 {time.perf_counter() - start:.2f}s")
+    return entry
+
+
+def default_db_id(engine: Engine) -> str:
+    """未指定 db_id 时取连接 URL 中的数据库名（SQLite 取文件名）"""
+    database = engine.url.database or engine.dialect.name
+    return os.path.splitext(os.path.basename(database))[0] or engine.dialect.name
+
+
+def load_live_entry(engine: Engine, db_id: Optional[str] = None,
+                    schemas: Optional[List[str]] = None,
+                    cache_dir: Optional[str] = ".cache/graphrag",
+                    force: bool = False) -> Dict:
+    """
+    获取在线数据库的 tables.json 条目：签名与磁盘缓存一致时直接读取，否则批量反射并写入缓存
+
+    Args:
+        engine: SQLAlchemy Engine
+        db_id: 条目中的数据库 ID，None 时取连接 URL 中的数据库名
+        schemas: 要反射的 schema 列表，None 表示默认 schema
+        cache_dir: 缓存目录（与 Embedding 缓存共用），None 表示不缓存
+        force: 忽略缓存强制反射
+    """
+    db_id = db_id or default_db_id(engine)
+    signature = schema_signature(engine)
+    path = None
+    if cache_dir:
+        # 缓存键不含密码
+        source = engine.url.render_as_string(hide_password=True) + "|" + ",".join(schemas or [])
+        path = os.path.join(cache_dir, "live_schema", f"{db_id}_{text_hash(source)[:16]}.json")
+
+    if path and signature and not force and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("signature") == signature:
+                logger.info(f"[反射] {db_id}: Schema 未变化，使用缓存 ({path})")
+                return dict(cached["entry"], db_id=db_id)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[反射] 读取缓存失败，重新反射: {str(e)}")
+
+    entry = reflect_entry(engine, db_id, schemas)
+    if path and signature:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"signature": signature, "entry": entry}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    return entry
+
+
+def register_live_database(retriever: GraphRAGRetriever, engine: Engine,
+                           db_id: Optional[str] = None,
+                           schemas: Optional[List[str]] = None,
+                           force: bool = False) -> str:
+    """
+    反射（或从缓存读取）在线数据库的 Schema 并注册到检索器，Schema 变化时旧图与检索结果自动失效
+
+    Returns:
+        注册使用的 db_id
+    """
+    db_id = db_id or default_db_id(engine)
+    cache_dir = retriever.store.cache_dir if retriever.store is not None else None
+    entry = load_live_entry(engine, db_id, schemas, cache_dir=cache_dir, force=force)
+    retriever.register_schema(db_id, entry)
+    return db_id
+
+
+# ========== 进程级在线数据库注册表 ==========
+_live_checks: Dict[Tuple, float] = {}
+_live_engines: Dict[str, Engine] = {}
+_live_locks: Dict[Tuple, threading.Lock] = {}
+_live_lock = threading.Lock()   # 只保护上面三个字典，不在持有期间访问数据库
+
+
+def get_live_retriever(db_url: Optional[str] = None,
+                       db_id: Optional[str] = None,
+                       schemas: Optional[List[str]] = None,
+                       tables_json_path: Optional[str] = None) -> Tuple[GraphRAGRetriever, str]:
+    """
+    获取已注册在线数据库的共享检索器
+
+    db_url / schemas 默认读取 config.yaml 的 db_url 与 database.live_schemas；
+    按 graphrag.schema_check_interval 节流重新计算签名，Schema 变化时重新反射并使旧的 SchemaGraph 失效。
+
+    Returns:
+        (检索器, db_id)
+    """
+    if db_url is None or schemas is None:
+        with open("config.yaml", "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+        db_url = db_url or config["db_url"]
+        schemas = schemas or (config.get("database", {}) or {}).get("live_schemas")
+    check_interval = load_graphrag_config().get("schema_check_interval", 10)
+    retriever = get_shared_retriever(tables_json_path)
+
+    with _live_lock:
+        engine = _live_engines.get(db_url)
+        if engine is None:
+            engine = _live_engines[db_url] = create_engine(db_url)
+    db_id = db_id or default_db_id(engine)
+
+    key = (id(retriever), db_url, db_id, tuple(schemas or []))
+    with _live_lock:
+        lock = _live_locks.setdefault(key, threading.Lock())
+    # 按数据库加锁：首次注册完成前，同一数据库的其他请求不会拿到尚未包含它的检索器；
+    # 反射慢的数据库不阻塞其他在线数据库
+    with lock:
+        now = time.monotonic()
+        last_check = _live_checks.get(key)
+        if last_check is None or (check_interval is not None and now - last_check >= check_interval):
+            register_live_database(retriever, engine, db_id, schemas)
+            _live_checks[key] = now
+    return retriever, db_id
@@ -0,0 +1,30 @@
+"""
+文本与数据集的通用工具
+- WORD_RE：表名 / 列名 / 问题的单词切分（GraphRAG 关键词索引与数据库路由共用）
+- load_sql_pairs：解析 dev.sql 格式（Question ... ||| db_id / SQL: ...）的问答对文件
+"""
+import re
+from typing import Dict, List
+
+WORD_RE = re.compile(r'\b\w+\b')
+
+
+def load_sql_pairs(path: str) -> List[Dict[str, str]]:
+    """按顺序读取 dev.sql 格式文件中的 (数据库, 问题, SQL)，返回 {"db_id", "question", "query"} 列表"""
+    pairs = []
+    pending = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("Question"):
+                parts = line.split("|||")
+                if len(parts) >= 2:
+                    pending = {"db_id": parts[1].strip(), "question": parts[0].split(":", 1)[1].strip()}
+            elif line.startswith("SQL:") and pending is not None:
+                query = line.split(":", 1)[1].strip()
+                if query.endswith(";"):
+                    query = query[:-1]
+                pending["query"] = query
+                pairs.append(pending)
+                pending = None
+    return pairs
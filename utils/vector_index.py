@@ -0,0 +1,123 @@
+"""
+FAISS 向量索引
+为大型 Schema 的表向量与大规模 Few-shot 示例库提供近似最近邻（ANN）检索，按规模自动选择索引类型：
+- 小规模：IndexFlatIP（精确）
+- 中等规模：HNSW
+- 超大规模：IVF
+"""
+import os
+import logging
+from typing import Optional, Tuple
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # faiss 为可选依赖，缺失时回退到暴力打分
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+
+def faiss_available() -> bool:
+    return faiss is not None
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """按行做 L2 归一化（零向量保持为零）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """基于内积的 FAISS 索引（输入向量需已 L2 归一化，内积即余弦相似度）"""
+
+    def __init__(self, index, size: int):
+        self.index = index
+        self.size = size
+
+    @classmethod
+    def build(cls, matrix: np.ndarray,
+              flat_threshold: int = 5000,
+              ivf_threshold: int = 100000,
+              hnsw_m: int = 32) -> "VectorIndex":
+        """
+        根据向量数量构建索引
+
+        Args:
+            matrix: (n, d) 已归一化的向量矩阵
+            flat_threshold: 少于该数量使用精确的 Flat 索引
+            ivf_threshold: 少于该数量使用 HNSW，否则使用 IVF
+            hnsw_m: HNSW 每个节点的邻居数
+        """
+        if faiss is None:
+            raise ImportError("未安装 faiss-cpu，无法构建 ANN 索引")
+
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        n, dim = matrix.shape
+
+        if n < flat_threshold:
+            index = faiss.IndexFlatIP(dim)
+        elif n < ivf_threshold:
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = 128
+        else:
+            nlist = int(4 * np.sqrt(n))
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(matrix)
+            index.nprobe = max(1, nlist // 16)
+
+        index.add(matrix)
+        logger.info(f"[索引] 构建 {type(index).__name__}: {n} 条向量, 维度 {dim}")
+        return cls(index, n)
+
+    def search(self, query_vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        检索最相似的 k 个向量
+
+        Args:
+            query_vecs: (n_queries, d) 已归一化的查询向量
+
+        Returns:
+            (scores, ids)，形状均为 (n_queries, k)，不足 k 个时 id 为 -1
+        """
+        query_vecs = np.ascontiguousarray(query_vecs, dtype=np.float32)
+        return self.index.search(query_vecs, min(k, self.size))
+
+    def add(self, vectors: np.ndarray):
+        """追加 (n, d) 已归一化的向量，行号接在已有向量之后（调用方负责与 search 互斥）"""
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        self.index.add(vectors)
+        self.size += len(vectors)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorIndex"]:
+        """从磁盘加载索引，文件不存在或损坏时返回 None"""
+        if faiss is None or not os.path.exists(path):
+            return None
+        try:
+            index = faiss.read_index(path)
+            return cls(index, index.ntotal)
+        except Exception as e:
+            logger.warning(f"[索引] 加载 {path} 失败: {str(e)}")
+            return None
+
+    @classmethod
+    def load_or_build(cls, matrix: np.ndarray, path: Optional[str] = None, **build_kwargs) -> "VectorIndex":
+        """优先从磁盘加载，不存在时构建并保存"""
+        if path:
+            index = cls.load(path)
+            if index is not None and index.size == len(matrix):
+                return index
+        index = cls.build(matrix, **build_kwargs)
+        if path:
+            index.save(path)
+        return index